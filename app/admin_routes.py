@@ -1,22 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
 from app.database import get_db
 from app.models import User, ApiKey
-from app.schemas import UserCreate, ApiKeyCreate, ApiKey, Token, User as UserSchema
+from app.schemas import UserCreate, ApiKeyCreate, ApiKeyUpdate, ApiKey, Token, User as UserSchema, UsageReport
 from app.auth import authenticate_user, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
-from app.crud import create_user, get_api_keys, create_api_key, update_api_key, delete_api_key
-from datetime import timedelta
+from app.crud import create_user, get_user, get_api_keys, create_api_key, update_api_key, delete_api_key, get_usage
+from app.usage_writer import bucket_start
+from datetime import datetime, timedelta, timezone
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -33,39 +34,49 @@ async def login_for_access_token(
 async def create_new_user(
     user: UserCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_user = db.query(User).filter(User.username == user.username).first()
+    db_user = await get_user(db, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return create_user(db=db, user=user)
+    return await create_user(db=db, user=user)
 
 @router.get("/api-keys", response_model=List[ApiKey])
 async def read_api_keys(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    api_keys = get_api_keys(db, skip=skip, limit=limit)
+    api_keys = await get_api_keys(db, skip=skip, limit=limit)
     return api_keys
 
 @router.post("/api-keys", response_model=ApiKey)
 async def create_new_api_key(
     api_key: ApiKeyCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    return create_api_key(db=db, api_key=api_key)
+    return await create_api_key(db=db, api_key=api_key)
 
 @router.put("/api-keys/{api_key_id}")
 async def toggle_api_key(
     api_key_id: int,
-    is_active: bool,
+    is_active: Optional[bool] = None,
+    weight: Optional[int] = Query(None, ge=1),
+    rpm_limit: Optional[int] = Query(None, ge=0),
+    tokens_per_day_limit: Optional[int] = Query(None, ge=0),
+    changes: Optional[ApiKeyUpdate] = Body(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_api_key = update_api_key(db=db, api_key_id=api_key_id, is_active=is_active)
+    # Query parameters can only set values; a JSON body can also reset a limit to the default with null
+    changes = changes or ApiKeyUpdate()
+    query = {"is_active": is_active, "weight": weight, "rpm_limit": rpm_limit, "tokens_per_day_limit": tokens_per_day_limit}
+    for field, value in query.items():
+        if value is not None:
+            setattr(changes, field, value)
+    db_api_key = await update_api_key(db, api_key_id, changes)
     if not db_api_key:
         raise HTTPException(status_code=404, detail="API key not found")
     return {"message": "API key updated successfully"}
@@ -74,9 +85,69 @@ async def toggle_api_key(
 async def remove_api_key(
     api_key_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_api_key = delete_api_key(db=db, api_key_id=api_key_id)
+    db_api_key = await delete_api_key(db=db, api_key_id=api_key_id)
     if not db_api_key:
         raise HTTPException(status_code=404, detail="API key not found")
-    return {"message": "API key deleted successfully"} 
\ No newline at end of file
+    return {"message": "API key deleted successfully"} 
+
+def as_utc(value: datetime):
+    """Treat naive datetimes as UTC"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+@router.get("/usage", response_model=UsageReport)
+async def read_usage(
+    granularity: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    api_key_id: Optional[int] = None,
+    model: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Requests, tokens, errors and latency per API key and model, bucketed by UTC hour or day
+
+    Read from the pre-aggregated usage rollups; defaults to the last 30 days.
+    The range is widened to start at the beginning of the bucket containing start.
+    """
+    end = as_utc(end) if end else datetime.now(timezone.utc)
+    start = as_utc(start) if start else end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    start = bucket_start(start, granularity)
+    end = end.replace(tzinfo=None)
+
+    series, totals = [], {}
+    for row in await get_usage(db, granularity, start, end, api_key_id=api_key_id, model=model):
+        point = {
+            "bucket_start": row["bucket_start"],
+            "api_key_id": row["api_key_id"],
+            "model": row["model"],
+            "requests": row["requests"],
+            "cache_hits": row["cache_hits"],
+            "errors": row["errors"],
+            "prompt_tokens": row["prompt_tokens"],
+            "completion_tokens": row["completion_tokens"],
+            "total_tokens": row["prompt_tokens"] + row["completion_tokens"],
+            "avg_latency_ms": round(row["latency_ms_total"] / row["requests"], 1) if row["requests"] else 0.0,
+        }
+        series.append(point)
+        total = totals.setdefault((row["api_key_id"], row["model"]), {
+            "api_key_id": row["api_key_id"], "model": row["model"], "requests": 0, "cache_hits": 0, "errors": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "latency_ms_total": 0.0,
+        })
+        for name in ("requests", "cache_hits", "errors", "prompt_tokens", "completion_tokens", "total_tokens"):
+            total[name] += point[name]
+        total["latency_ms_total"] += row["latency_ms_total"]
+    for total in totals.values():
+        latency_ms_total = total.pop("latency_ms_total")
+        total["avg_latency_ms"] = round(latency_ms_total / total["requests"], 1) if total["requests"] else 0.0
+
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "series": series,
+        "totals": sorted(totals.values(), key=lambda total: (total["api_key_id"], total["model"])),
+    }
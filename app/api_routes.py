@@ -1,25 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Dict, Any, Awaitable
 from app.database import get_db
 from app.auth import verify_bearer_token
-from app.ollama_proxy import OllamaProxy
-from app.models import ApiRequestLog
-from fastapi.responses import JSONResponse
+from app.ollama_proxy import OllamaProxy, parse_ollama_timestamp
+from app.usage_writer import usage_writer
+from app.rate_limits import rate_limiter
+from app.response_cache import response_cache, canonical_request_key, is_deterministic
+from app.semantic_cache import semantic_cache, semantic_query
+from app.coalescer import request_coalescer
+from app.scheduler import AdmissionScheduler
+from app.batching import EmbeddingBatcher
+from app.residency import ResidencyManager
+from app import config, metrics
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import base64
+import struct
 import uuid
 import time
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["openai-compatible"])
 
 # Initialize Ollama proxy
 ollama_proxy = OllamaProxy()
+scheduler = AdmissionScheduler(lambda model: len(ollama_proxy.routable_backends(model)))
+embedding_batcher = EmbeddingBatcher(ollama_proxy.embed)
+residency = ResidencyManager(ollama_proxy)
+
+def collect_runtime_metrics():
+    """Copy backend, scheduler and usage writer state into their gauges before a scrape"""
+    metrics.BACKEND_MODEL_LOADED.clear()
+    for backend in ollama_proxy.backends:
+        metrics.UPSTREAM_IN_FLIGHT.set(backend.in_flight, backend=backend.base_url)
+        metrics.BACKEND_UP.set(int(backend.healthy), backend=backend.base_url)
+        for model in backend.loaded or ():
+            if backend.is_loaded(model):
+                metrics.BACKEND_MODEL_LOADED.set(1, backend=backend.base_url, model=model)
+    metrics.SCHEDULER_RUNNING.clear()
+    for model, running in scheduler.running.items():
+        if running:
+            metrics.SCHEDULER_RUNNING.set(running, model=model)
+    metrics.SCHEDULER_QUEUED.set(scheduler.queued)
+    metrics.USAGE_PENDING.set(usage_writer.pending)
+    if semantic_cache is not None:
+        metrics.SEMANTIC_CACHE_ENTRIES.set(semantic_cache.entries)
 
-def log_api_request(db, api_key_obj, endpoint: str):
-    log = ApiRequestLog(api_key_id=api_key_obj.id, endpoint=endpoint)
-    db.add(log)
-    db.commit()
+metrics.registry.add_collector(collect_runtime_metrics)
+
+def log_api_request(api_key_obj, endpoint: str, model: Optional[str] = None, cache_hit: bool = False):
+    """Log the request once its response is finished; the entry is written to the database in the background
+    
+    The entry carries the backend, status, latency and token counts
+    collected in the request's metrics context.
+    """
+    api_key_id = api_key_obj.id
+    
+    def record(request_metrics, status_code: Optional[int], duration: Optional[float]):
+        usage_writer.record(
+            api_key_id, endpoint,
+            model=model,
+            cache_hit=cache_hit,
+            backend=request_metrics.backend if request_metrics else None,
+            status_code=status_code,
+            latency_ms=round(duration * 1000, 1) if duration is not None else None,
+            prompt_tokens=request_metrics.prompt_tokens if request_metrics else 0,
+            completion_tokens=request_metrics.completion_tokens if request_metrics else 0,
+        )
+    
+    metrics.tag_request(model=model, backend="cache" if cache_hit else None)
+    if not metrics.on_request_finished(record):
+        record(None, None, None)
 
 def get_bearer_token(credentials: str = Depends(HTTPBearer())):
     if not credentials:
@@ -30,23 +86,197 @@ def get_bearer_token(credentials: str = Depends(HTTPBearer())):
         )
     return credentials.credentials
 
-def verify_bearer_token_dependency(token: str = Depends(get_bearer_token), db: Session = Depends(get_db)):
-    db_api_key = verify_bearer_token(token, db)
+async def verify_bearer_token_dependency(token: str = Depends(get_bearer_token), db: AsyncSession = Depends(get_db)):
+    with metrics.timed("auth"):
+        db_api_key = await verify_bearer_token(token, db)
     if not db_api_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Bearer token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    rate_limiter.check(db_api_key)
+    api_key_id = db_api_key.id
+    metrics.on_request_finished(
+        lambda request_metrics, status_code, duration: rate_limiter.add_tokens(
+            api_key_id, request_metrics.prompt_tokens + request_metrics.completion_tokens
+        )
+    )
     return db_api_key
 
+# OpenAI sampling parameters and the Ollama options they map to
+OPENAI_TO_OLLAMA_OPTIONS = {
+    "temperature": "temperature",
+    "top_p": "top_p",
+    "max_tokens": "num_predict",
+    "stop": "stop",
+    "seed": "seed",
+    "presence_penalty": "presence_penalty",
+    "frequency_penalty": "frequency_penalty",
+}
+
+def build_ollama_options(request: Dict[str, Any]):
+    options = {
+        ollama_name: request[openai_name]
+        for openai_name, ollama_name in OPENAI_TO_OLLAMA_OPTIONS.items()
+        if request.get(openai_name) is not None
+    }
+    if isinstance(options.get("stop"), str):
+        options["stop"] = [options["stop"]]
+    return options
+
+async def get_cached_response(endpoint: str, ollama_req: Dict[str, Any], cache_control: Optional[str]):
+    """Look a non-streaming request up in the response cache
+    
+    Returns (cache_key, cached_response). cache_key is None when the request
+    is not cacheable (cache disabled or sampling is not deterministic).
+    """
+    if response_cache is None or not is_deterministic(ollama_req):
+        return None, None
+    cache_key = canonical_request_key(endpoint, ollama_req)
+    if "no-cache" in (cache_control or "").lower():
+        return cache_key, None
+    return cache_key, await response_cache.get(cache_key)
+
+async def store_cached_response(cache_key: Optional[str], ollama_response: Dict[str, Any], status_code: int, cache_control: Optional[str]):
+    if cache_key is None or status_code != 200 or "error" in ollama_response:
+        return
+    if "no-store" in (cache_control or "").lower():
+        return
+    await response_cache.put(cache_key, ollama_response)
+
+async def get_semantic_response(ollama_req: Dict[str, Any], cache_control: Optional[str]):
+    """Look a non-streaming chat request up in the semantic cache
+    
+    Returns (entry, cached_response, similarity). entry is the (namespace,
+    vector) to store the answer under, or None when the request is not
+    cacheable (cache disabled, last message not from the user, or the
+    embedding call failed).
+    """
+    if semantic_cache is None:
+        return None, None, None
+    query = semantic_query(ollama_req)
+    if query is None:
+        return None, None, None
+    namespace, text = query
+    model = ollama_req.get("model")
+    try:
+        embeddings, _ = await embedding_batcher.embed(config.SEMANTIC_CACHE_EMBEDDING_MODEL, [text])
+    except Exception:
+        logger.warning("Semantic cache embedding with %s failed", config.SEMANTIC_CACHE_EMBEDDING_MODEL, exc_info=True)
+        metrics.SEMANTIC_CACHE_LOOKUPS.inc(model=model, result="error")
+        return None, None, None
+    entry = (namespace, embeddings[0])
+    if "no-cache" in (cache_control or "").lower():
+        return entry, None, None
+    cached_response, similarity = await semantic_cache.search(namespace, model, embeddings[0])
+    if similarity is not None:
+        metrics.SEMANTIC_CACHE_SIMILARITY.observe(similarity, model=model)
+    metrics.SEMANTIC_CACHE_LOOKUPS.inc(model=model, result="miss" if cached_response is None else "hit")
+    return entry, cached_response, similarity
+
+async def store_semantic_response(entry, ollama_response: Dict[str, Any], status_code: int, cache_control: Optional[str]):
+    if entry is None or status_code != 200 or "error" in ollama_response:
+        return
+    if "no-store" in (cache_control or "").lower():
+        return
+    await semantic_cache.add(*entry, ollama_response)
+
+async def call_ollama(endpoint: str, call, ollama_req: Dict[str, Any], api_key_obj, cache_key: Optional[str] = None):
+    """Run a non-streaming Ollama call through the scheduler
+    
+    Identical requests already in flight share the same call (and slot).
+    """
+    async def scheduled_call():
+        async with scheduler.slot(ollama_req.get("model"), api_key_obj.id, api_key_obj.weight):
+            return await call(ollama_req)
+    
+    if config.REQUEST_COALESCING == "off":
+        return await scheduled_call()
+    if config.REQUEST_COALESCING != "all" and not is_deterministic(ollama_req):
+        return await scheduled_call()
+    key = cache_key or canonical_request_key(endpoint, ollama_req)
+    return await request_coalescer.run(key, scheduled_call)
+
+async def open_ollama_stream(open_stream, ollama_req: Dict[str, Any], api_key_obj):
+    """Open a streaming Ollama call once the scheduler admits it; the slot is held until the stream closes"""
+    model = ollama_req.get("model")
+    await scheduler.acquire(model, api_key_obj.id, api_key_obj.weight)
+    started = time.monotonic()
+    try:
+        chunks = await open_stream(ollama_req)
+    except BaseException:
+        scheduler.release(model)
+        raise
+    chunks.on_close(lambda: scheduler.release(model, time.monotonic() - started))
+    return chunks
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """StreamingResponse that always closes its upstream stream
+    
+    The body iterator may never start if the client disconnects early, so
+    the upstream connection and scheduler slot are released here as well.
+    Closing the upstream connection mid-stream makes Ollama stop generating.
+    """
+    
+    def __init__(self, content, upstream, **kwargs):
+        super().__init__(content, **kwargs)
+        self.upstream = upstream
+        self.body_complete = False
+    
+    async def stream_response(self, send):
+        await super().stream_response(send)
+        self.body_complete = True
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+            # Starlette stops streaming without an error when the client disconnects
+            if not self.body_complete:
+                metrics.ABANDONED_REQUESTS.inc(endpoint=scope.get("path"), model=self.upstream.model)
+        finally:
+            await self.upstream.aclose()
+
+async def cancel_on_disconnect(request: Request, call: Awaitable):
+    """Await call, cancelling it (and so its upstream request) if the client disconnects first
+    
+    Returns None when the client went away.
+    """
+    task = asyncio.ensure_future(call)
+    
+    async def wait_for_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+    
+    watcher = asyncio.create_task(wait_for_disconnect())
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        return None
+    return task.result()
+
+def client_closed_request(request: Request, model: Optional[str]):
+    """Record an abandoned request; the 499 status is only seen by logs and metrics"""
+    metrics.ABANDONED_REQUESTS.inc(endpoint=request.url.path, model=model)
+    return Response(status_code=499)
+
+def cache_headers(cache_key: Optional[str], cached_response: Optional[Dict[str, Any]]):
+    if cache_key is None:
+        return None
+    return {"X-Cache": "HIT" if cached_response is not None else "MISS"}
+
 # OpenAI-compatible /v1/models endpoint
 @router.get("/v1/models")
 async def openai_models(
-    api_key_obj = Depends(verify_bearer_token_dependency),
-    db: Session = Depends(get_db)
+    api_key_obj = Depends(verify_bearer_token_dependency)
 ):
-    log_api_request(db, api_key_obj, "/v1/models")
+    log_api_request(api_key_obj, "/v1/models")
     ollama_response, _ = await ollama_proxy.list_models()
     # Map Ollama response to OpenAI models format
     models = ollama_response.get("models", [])
@@ -54,27 +284,122 @@ async def openai_models(
         {
             "id": m.get("name"),
             "object": "model",
-            "created": int(time.time()),
+            "created": parse_ollama_timestamp(m.get("modified_at")),
             "owned_by": "ollama"
         } for m in models
     ]
     return JSONResponse(content={"object": "list", "data": openai_models})
 
-# OpenAI-compatible /v1/completions endpoint
-@router.post("/v1/completions")
-async def openai_completions(
-    request: Dict[str, Any],
-    api_key_obj = Depends(verify_bearer_token_dependency),
-    db: Session = Depends(get_db)
-):
-    log_api_request(db, api_key_obj, "/v1/completions")
+def build_usage(ollama_response: Dict[str, Any]):
+    """Map Ollama's token counters onto an OpenAI usage block, and count them against the request"""
+    prompt_tokens = ollama_response.get("prompt_eval_count", 0)
+    completion_tokens = ollama_response.get("eval_count", 0)
+    metrics.count_tokens(prompt_tokens, completion_tokens)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+def format_sse(payload: Dict[str, Any]):
+    """Encode one server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def stream_openai_events(chunks, object_type: str, id_prefix: str, model: str, build_choice):
+    """Relay Ollama NDJSON chunks as OpenAI-format server-sent events
+    
+    Ends with a usage-only chunk (empty choices, as with OpenAI's
+    stream_options.include_usage) followed by the [DONE] sentinel.
+    """
+    completion_id = f"{id_prefix}-{uuid.uuid4().hex}"
+    created = int(time.time())
+    first = True
+    try:
+        async for chunk in chunks:
+            if "error" in chunk:
+                yield format_sse({"error": {"message": chunk["error"], "type": "upstream_error"}})
+                return
+            done = chunk.get("done", False)
+            finish_reason = chunk.get("done_reason", "stop") if done else None
+            yield format_sse({
+                "id": completion_id,
+                "object": object_type,
+                "created": created,
+                "model": model,
+                "choices": [build_choice(chunk, first, finish_reason)]
+            })
+            first = False
+            if done:
+                yield format_sse({
+                    "id": completion_id,
+                    "object": object_type,
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": build_usage(chunk)
+                })
+    except HTTPException as e:
+        yield format_sse({"error": {"message": e.detail, "type": "upstream_error"}})
+        return
+    yield "data: [DONE]\n\n"
+
+def completion_stream_choice(chunk: Dict[str, Any], first: bool, finish_reason: Optional[str]):
+    return {
+        "text": chunk.get("response", ""),
+        "index": 0,
+        "logprobs": None,
+        "finish_reason": finish_reason
+    }
+
+def chat_stream_choice(chunk: Dict[str, Any], first: bool, finish_reason: Optional[str]):
+    delta = {}
+    if first:
+        delta["role"] = "assistant"
+    content = chunk.get("message", {}).get("content", "")
+    if content or not finish_reason:
+        delta["content"] = content
+    return {"index": 0, "delta": delta, "finish_reason": finish_reason}
+
+def completion_request(request: Dict[str, Any]):
+    """Non-streaming Ollama /api/generate request for an OpenAI completion request"""
     ollama_req = {
         "model": request.get("model"),
         "prompt": request.get("prompt"),
         "stream": False
     }
-    ollama_response, _ = await ollama_proxy.generate(ollama_req)
-    openai_resp = {
+    options = build_ollama_options(request)
+    if options:
+        ollama_req["options"] = options
+    return ollama_req
+
+def chat_request(request: Dict[str, Any]):
+    """Non-streaming Ollama /api/chat request for an OpenAI chat completion request"""
+    ollama_req = {
+        "model": request.get("model"),
+        "messages": request.get("messages"),
+        "stream": False
+    }
+    options = build_ollama_options(request)
+    if options:
+        ollama_req["options"] = options
+    return ollama_req
+
+def embedding_request(request: Dict[str, Any]):
+    """Validated (inputs, params) for an OpenAI embeddings request"""
+    inputs = request.get("input")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not inputs or not isinstance(inputs, list) or not all(isinstance(text, str) for text in inputs):
+        raise HTTPException(status_code=400, detail="input must be a string or a non-empty list of strings")
+    params = {}
+    if request.get("dimensions") is not None:
+        params["dimensions"] = request["dimensions"]
+    return inputs, params
+
+def completion_body(request: Dict[str, Any], ollama_response: Dict[str, Any]):
+    return {
         "id": f"cmpl-{uuid.uuid4().hex}",
         "object": "text_completion",
         "created": int(time.time()),
@@ -87,29 +412,11 @@ async def openai_completions(
                 "finish_reason": "stop"
             }
         ],
-        "usage": {
-            "prompt_tokens": ollama_response.get("prompt_eval_count", 0),
-            "completion_tokens": ollama_response.get("eval_count", 0),
-            "total_tokens": ollama_response.get("prompt_eval_count", 0) + ollama_response.get("eval_count", 0)
-        }
+        "usage": build_usage(ollama_response)
     }
-    return JSONResponse(content=openai_resp)
 
-# OpenAI-compatible /v1/chat/completions endpoint
-@router.post("/v1/chat/completions")
-async def openai_chat_completions(
-    request: Dict[str, Any],
-    api_key_obj = Depends(verify_bearer_token_dependency),
-    db: Session = Depends(get_db)
-):
-    log_api_request(db, api_key_obj, "/v1/chat/completions")
-    ollama_req = {
-        "model": request.get("model"),
-        "messages": request.get("messages"),
-        "stream": False
-    }
-    ollama_response, _ = await ollama_proxy.chat(ollama_req)
-    openai_resp = {
+def chat_completion_body(request: Dict[str, Any], ollama_response: Dict[str, Any]):
+    return {
         "id": f"chatcmpl-{uuid.uuid4().hex}",
         "object": "chat.completion",
         "created": int(time.time()),
@@ -124,10 +431,116 @@ async def openai_chat_completions(
                 "finish_reason": "stop"
             }
         ],
-        "usage": {
-            "prompt_tokens": ollama_response.get("prompt_eval_count", 0),
-            "completion_tokens": ollama_response.get("eval_count", 0),
-            "total_tokens": ollama_response.get("prompt_eval_count", 0) + ollama_response.get("eval_count", 0)
-        }
+        "usage": build_usage(ollama_response)
     }
-    return JSONResponse(content=openai_resp) 
\ No newline at end of file
+
+def embeddings_body(request: Dict[str, Any], embeddings, prompt_tokens: int):
+    if request.get("encoding_format") == "base64":
+        embeddings = [base64.b64encode(struct.pack(f"<{len(e)}f", *e)).decode("ascii") for e in embeddings]
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": embedding}
+            for i, embedding in enumerate(embeddings)
+        ],
+        "model": request.get("model"),
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+    }
+
+# OpenAI-compatible /v1/completions endpoint
+@router.post("/v1/completions")
+async def openai_completions(
+    request: Dict[str, Any],
+    http_request: Request,
+    api_key_obj = Depends(verify_bearer_token_dependency),
+    cache_control: Optional[str] = Header(None)
+):
+    ollama_req = completion_request(request)
+    if request.get("stream"):
+        log_api_request(api_key_obj, "/v1/completions", model=request.get("model"))
+        chunks = await cancel_on_disconnect(http_request, open_ollama_stream(ollama_proxy.generate_stream, ollama_req, api_key_obj))
+        if chunks is None:
+            return client_closed_request(http_request, request.get("model"))
+        return UpstreamStreamingResponse(
+            stream_openai_events(chunks, "text_completion", "cmpl", request.get("model"), completion_stream_choice),
+            upstream=chunks,
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
+        )
+    cache_key, ollama_response = await get_cached_response("/v1/completions", ollama_req, cache_control)
+    log_api_request(api_key_obj, "/v1/completions", model=request.get("model"), cache_hit=ollama_response is not None)
+    headers = cache_headers(cache_key, ollama_response)
+    if ollama_response is None:
+        result = await cancel_on_disconnect(http_request, call_ollama("/v1/completions", ollama_proxy.generate, ollama_req, api_key_obj, cache_key))
+        if result is None:
+            return client_closed_request(http_request, request.get("model"))
+        ollama_response, status_code = result
+        await store_cached_response(cache_key, ollama_response, status_code, cache_control)
+    with metrics.timed("build"):
+        response = JSONResponse(content=completion_body(request, ollama_response), headers=headers)
+    return response
+
+# OpenAI-compatible /v1/chat/completions endpoint
+@router.post("/v1/chat/completions")
+async def openai_chat_completions(
+    request: Dict[str, Any],
+    http_request: Request,
+    api_key_obj = Depends(verify_bearer_token_dependency),
+    cache_control: Optional[str] = Header(None)
+):
+    ollama_req = chat_request(request)
+    if request.get("stream"):
+        log_api_request(api_key_obj, "/v1/chat/completions", model=request.get("model"))
+        chunks = await cancel_on_disconnect(http_request, open_ollama_stream(ollama_proxy.chat_stream, ollama_req, api_key_obj))
+        if chunks is None:
+            return client_closed_request(http_request, request.get("model"))
+        return UpstreamStreamingResponse(
+            stream_openai_events(chunks, "chat.completion.chunk", "chatcmpl", request.get("model"), chat_stream_choice),
+            upstream=chunks,
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
+        )
+    cache_key, ollama_response = await get_cached_response("/v1/chat/completions", ollama_req, cache_control)
+    headers = cache_headers(cache_key, ollama_response)
+    semantic_entry = None
+    if ollama_response is None:
+        semantic_entry, ollama_response, similarity = await get_semantic_response(ollama_req, cache_control)
+        if semantic_entry is not None:
+            headers = {"X-Cache": "HIT" if ollama_response is not None else "MISS"}
+            if ollama_response is not None:
+                headers["X-Cache-Similarity"] = f"{similarity:.4f}"
+    log_api_request(api_key_obj, "/v1/chat/completions", model=request.get("model"), cache_hit=ollama_response is not None)
+    if ollama_response is None:
+        result = await cancel_on_disconnect(http_request, call_ollama("/v1/chat/completions", ollama_proxy.chat, ollama_req, api_key_obj, cache_key))
+        if result is None:
+            return client_closed_request(http_request, request.get("model"))
+        ollama_response, status_code = result
+        await store_cached_response(cache_key, ollama_response, status_code, cache_control)
+        await store_semantic_response(semantic_entry, ollama_response, status_code, cache_control)
+    with metrics.timed("build"):
+        response = JSONResponse(content=chat_completion_body(request, ollama_response), headers=headers)
+    return response
+
+# OpenAI-compatible /v1/embeddings endpoint
+@router.post("/v1/embeddings")
+async def openai_embeddings(
+    request: Dict[str, Any],
+    http_request: Request,
+    api_key_obj = Depends(verify_bearer_token_dependency)
+):
+    log_api_request(api_key_obj, "/v1/embeddings", model=request.get("model"))
+    inputs, params = embedding_request(request)
+
+    async def scheduled_embed():
+        # Like batch jobs, every caller holds a slot while its inputs are embedded, merged or not
+        async with scheduler.slot(request.get("model"), api_key_obj.id, api_key_obj.weight):
+            return await embedding_batcher.embed(request.get("model"), inputs, params)
+
+    result = await cancel_on_disconnect(http_request, scheduled_embed())
+    if result is None:
+        return client_closed_request(http_request, request.get("model"))
+    embeddings, prompt_tokens = result
+    metrics.count_tokens(prompt_tokens)
+    with metrics.timed("build"):
+        response = JSONResponse(content=embeddings_body(request, embeddings, prompt_tokens))
+    return response
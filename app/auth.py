@@ -4,16 +4,20 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app import config
 from app.database import get_db
 from app.models import User, ApiKey
+from app.key_cache import api_key_cache, CachedApiKey
 import secrets
 import string
 
 # Configuration
-SECRET_KEY = "your-secret-key-change-this-in-production"
+SECRET_KEY = config.SECRET_KEY
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -24,11 +28,11 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await run_in_threadpool(verify_password, password, user.hashed_password):
         return False
     return user
 
@@ -52,7 +56,7 @@ def verify_token(token: str):
     except JWTError:
         return None
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
     token = credentials.credentials
     username = verify_token(token)
     if username is None:
@@ -61,7 +65,7 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -70,18 +74,31 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         )
     return user
 
-def verify_bearer_token(token: str, db: Session):
-    """Verify Bearer token by checking if it exists in the database"""
+async def verify_bearer_token(token: str, db: AsyncSession):
+    """Verify Bearer token, using the in-memory key cache before the database
+    
+    last_used is not written here; app.usage_writer records it in the background.
+    """
+    cached_key = api_key_cache.get(token)
+    if cached_key:
+        return cached_key
+    generation = api_key_cache.generation
+    
     # Find the API key (Bearer token) in the database
-    db_api_key = db.query(ApiKey).filter(ApiKey.api_key == token, ApiKey.is_active == True).first()
+    db_api_key = await db.scalar(select(ApiKey).where(ApiKey.api_key == token, ApiKey.is_active == True))
     if not db_api_key:
         return None
     
-    # Update last used timestamp
-    db_api_key.last_used = datetime.utcnow()
-    db.commit()
-    
-    return db_api_key
+    cached_key = CachedApiKey(
+        id=db_api_key.id,
+        key_name=db_api_key.key_name,
+        api_key=db_api_key.api_key,
+        weight=db_api_key.weight or 1,
+        rpm_limit=db_api_key.rpm_limit,
+        tokens_per_day_limit=db_api_key.tokens_per_day_limit
+    )
+    api_key_cache.put(cached_key, generation)
+    return cached_key
 
 def generate_bearer_token(length: int = 64):
     """Generate a random Bearer token"""
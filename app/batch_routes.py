@@ -0,0 +1,209 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Dict, Optional
+from app import config
+from app.api_routes import verify_bearer_token_dependency
+from app.batches import BATCH_ENDPOINTS, TERMINAL_STATUSES, batch_runner, file_path, utcnow
+from app.database import get_db
+from app.models import BatchFile, BatchJob
+import json
+import os
+import re
+import uuid
+
+router = APIRouter(prefix="/v1", tags=["batches"])
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def save_upload(source, path: str, max_bytes: int) -> Optional[int]:
+    """Copy an uploaded file to path in chunks (blocking); returns its size, or None once it is over max_bytes"""
+    size = 0
+    with open(path, "wb") as out:
+        while chunk := source.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                return None
+            out.write(chunk)
+    return size
+
+def unix_time(value: Optional[datetime]):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def file_object(batch_file: BatchFile):
+    return {
+        "id": batch_file.id,
+        "object": "file",
+        "bytes": batch_file.bytes,
+        "created_at": unix_time(batch_file.created_at),
+        "filename": batch_file.filename,
+        "purpose": batch_file.purpose,
+    }
+
+def batch_object(job: BatchJob):
+    """OpenAI batch object for a job"""
+    finished = {f"{status}_at": None for status in ("failed", "completed", "expired", "cancelled")}
+    if job.status in TERMINAL_STATUSES:
+        finished[f"{job.status}_at"] = unix_time(job.finished_at)
+    return {
+        "id": job.id,
+        "object": "batch",
+        "endpoint": job.endpoint,
+        "errors": {"object": "list", "data": json.loads(job.errors)} if job.errors else None,
+        "input_file_id": job.input_file_id,
+        "completion_window": job.completion_window,
+        "status": job.status,
+        "output_file_id": job.output_file_id,
+        "error_file_id": job.error_file_id,
+        "created_at": unix_time(job.created_at),
+        "in_progress_at": unix_time(job.in_progress_at),
+        "expires_at": unix_time(job.expires_at),
+        "cancelling_at": unix_time(job.cancelling_at),
+        **finished,
+        "request_counts": {"total": job.total, "completed": job.completed, "failed": job.failed},
+        "metadata": json.loads(job.metadata_json) if job.metadata_json else None,
+    }
+
+async def get_own(db: AsyncSession, model, object_id: str, api_key_obj):
+    """Row owned by the calling API key, or 404"""
+    row = await db.get(model, object_id)
+    if row is None or row.api_key_id != api_key_obj.id:
+        raise HTTPException(status_code=404, detail=f"No such {model.__tablename__[:-1].replace('_', ' ')}: {object_id}")
+    return row
+
+# Upload a JSONL file of batch requests
+@router.post("/files")
+async def upload_file(
+    file: UploadFile = File(...),
+    purpose: str = Form(...),
+    api_key_obj = Depends(verify_bearer_token_dependency),
+    db: AsyncSession = Depends(get_db)
+):
+    if purpose != "batch":
+        raise HTTPException(status_code=400, detail="Only purpose=batch is supported")
+    file_id = f"file-{uuid.uuid4().hex}"
+    path = file_path(file_id)
+    try:
+        # Up to BATCH_MAX_FILE_BYTES of disk writes: keep them off the event loop
+        size = await run_in_threadpool(save_upload, file.file, path, config.BATCH_MAX_FILE_BYTES)
+        if size is None:
+            raise HTTPException(status_code=413, detail=f"File is larger than {config.BATCH_MAX_FILE_BYTES} bytes")
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    batch_file = BatchFile(id=file_id, api_key_id=api_key_obj.id, filename=file.filename or "input.jsonl", purpose=purpose, bytes=size)
+    db.add(batch_file)
+    await db.commit()
+    await db.refresh(batch_file)
+    return file_object(batch_file)
+
+@router.get("/files/{file_id}")
+async def read_file(file_id: str, api_key_obj = Depends(verify_bearer_token_dependency), db: AsyncSession = Depends(get_db)):
+    return file_object(await get_own(db, BatchFile, file_id, api_key_obj))
+
+@router.get("/files/{file_id}/content")
+async def read_file_content(file_id: str, api_key_obj = Depends(verify_bearer_token_dependency), db: AsyncSession = Depends(get_db)):
+    batch_file = await get_own(db, BatchFile, file_id, api_key_obj)
+    return FileResponse(file_path(batch_file.id), media_type="application/jsonl", filename=batch_file.filename)
+
+@router.delete("/files/{file_id}")
+async def delete_file(file_id: str, api_key_obj = Depends(verify_bearer_token_dependency), db: AsyncSession = Depends(get_db)):
+    batch_file = await get_own(db, BatchFile, file_id, api_key_obj)
+    in_use = await db.scalar(select(BatchJob.id).where(
+        BatchJob.input_file_id == file_id, BatchJob.status.not_in(TERMINAL_STATUSES)
+    ))
+    if in_use:
+        raise HTTPException(status_code=409, detail=f"File is the input of unfinished batch {in_use}")
+    await db.delete(batch_file)
+    await db.commit()
+    if os.path.exists(file_path(file_id)):
+        os.remove(file_path(file_id))
+    return {"id": file_id, "object": "file", "deleted": True}
+
+# Start a batch job over an uploaded file
+@router.post("/batches")
+async def create_batch(
+    request: Dict[str, Any],
+    api_key_obj = Depends(verify_bearer_token_dependency),
+    db: AsyncSession = Depends(get_db)
+):
+    endpoint = request.get("endpoint")
+    if endpoint not in BATCH_ENDPOINTS:
+        raise HTTPException(status_code=400, detail=f"endpoint must be one of {', '.join(BATCH_ENDPOINTS)}")
+    completion_window = request.get("completion_window", "24h")
+    window = re.fullmatch(r"(\d+)h", str(completion_window))
+    if not window or int(window.group(1)) < 1:
+        raise HTTPException(status_code=400, detail="completion_window must be a number of hours, e.g. 24h")
+    metadata = request.get("metadata")
+    if metadata is not None and not isinstance(metadata, dict):
+        raise HTTPException(status_code=400, detail="metadata must be an object")
+    input_file = await get_own(db, BatchFile, str(request.get("input_file_id")), api_key_obj)
+    if input_file.purpose != "batch":
+        raise HTTPException(status_code=400, detail="input_file_id must be a file uploaded with purpose=batch")
+
+    now = utcnow()
+    job = BatchJob(
+        id=f"batch_{uuid.uuid4().hex}",
+        api_key_id=api_key_obj.id,
+        endpoint=endpoint,
+        input_file_id=input_file.id,
+        completion_window=completion_window,
+        status="validating",
+        metadata_json=json.dumps(metadata) if metadata else None,
+        created_at=now,
+        expires_at=now + timedelta(hours=int(window.group(1))),
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    batch_runner.notify()
+    return batch_object(job)
+
+@router.get("/batches")
+async def list_batches(
+    limit: int = 20,
+    after: Optional[str] = None,
+    api_key_obj = Depends(verify_bearer_token_dependency),
+    db: AsyncSession = Depends(get_db)
+):
+    """The caller's batches, newest first, paginated with after=<last id>"""
+    limit = max(1, min(limit, 100))
+    stmt = select(BatchJob).where(BatchJob.api_key_id == api_key_obj.id)
+    if after:
+        cursor = await get_own(db, BatchJob, after, api_key_obj)
+        stmt = stmt.where(BatchJob.created_at <= cursor.created_at, BatchJob.id != cursor.id)
+    jobs = (await db.scalars(stmt.order_by(BatchJob.created_at.desc(), BatchJob.id.desc()).limit(limit + 1))).all()
+    data = [batch_object(job) for job in jobs[:limit]]
+    return {
+        "object": "list",
+        "data": data,
+        "first_id": data[0]["id"] if data else None,
+        "last_id": data[-1]["id"] if data else None,
+        "has_more": len(jobs) > limit,
+    }
+
+@router.get("/batches/{batch_id}")
+async def read_batch(batch_id: str, api_key_obj = Depends(verify_bearer_token_dependency), db: AsyncSession = Depends(get_db)):
+    return batch_object(await get_own(db, BatchJob, batch_id, api_key_obj))
+
+@router.post("/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, api_key_obj = Depends(verify_bearer_token_dependency), db: AsyncSession = Depends(get_db)):
+    """Stop a batch; results written so far are kept in its output files"""
+    job = await get_own(db, BatchJob, batch_id, api_key_obj)
+    if job.status in ("validating", "in_progress"):
+        job.status = "cancelling"
+        job.cancelling_at = utcnow()
+        await db.commit()
+        await db.refresh(job)
+        batch_runner.notify()
+    elif job.status not in ("cancelling", "cancelled"):
+        raise HTTPException(status_code=409, detail=f"Batch is already {job.status}")
+    return batch_object(job)
@@ -0,0 +1,403 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+from starlette.concurrency import run_in_threadpool
+from app import config
+from app.api_routes import (
+    ollama_proxy,
+    scheduler,
+    embedding_batcher,
+    completion_request,
+    chat_request,
+    embedding_request,
+    completion_body,
+    chat_completion_body,
+    embeddings_body,
+)
+from app.database import SessionLocal
+from app.models import BatchFile, BatchJob
+from app.usage_writer import usage_writer
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINTS = ("/v1/chat/completions", "/v1/completions", "/v1/embeddings")
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+TERMINAL_STATUSES = ("failed", "completed", "expired", "cancelled")
+# Validation errors reported per job; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+def file_path(file_id: str):
+    """Location of a batch file's content"""
+    return os.path.join(config.BATCH_DIR, f"{file_id}.jsonl")
+
+def work_path(batch_id: str, kind: str):
+    """Results being written for a running job ("output" or "error"), moved into the file store when it ends"""
+    return os.path.join(config.BATCH_DIR, f"{batch_id}.{kind}.jsonl")
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+def validate_input(path: str, endpoint: str):
+    """Check every line of an input file; returns (request count, errors)"""
+    errors: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    total = 0
+
+    def error(line: int, code: str, message: str):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"code": code, "message": message, "param": None, "line": line})
+
+    with open(path, "rb") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            total += 1
+            try:
+                request = json.loads(line)
+            except ValueError:
+                error(line_number, "invalid_json", "Line is not valid JSON")
+                continue
+            if not isinstance(request, dict) or not isinstance(request.get("body"), dict):
+                error(line_number, "invalid_request", "Each line needs an object with a JSON object body")
+                continue
+            custom_id = request.get("custom_id")
+            if not isinstance(custom_id, str) or not custom_id:
+                error(line_number, "missing_custom_id", "custom_id must be a non-empty string")
+            elif custom_id in seen:
+                error(line_number, "duplicate_custom_id", f"custom_id {custom_id!r} is used more than once")
+            else:
+                seen.add(custom_id)
+            if request.get("method", "POST").upper() != "POST":
+                error(line_number, "invalid_method", "method must be POST")
+            if request.get("url") != endpoint:
+                error(line_number, "mismatched_url", f"url must be the batch endpoint {endpoint}")
+            if not request["body"].get("model"):
+                error(line_number, "missing_model", "body.model is required")
+    if total == 0:
+        errors.append({"code": "empty_file", "message": "The input file has no requests", "param": None, "line": None})
+    return total, errors
+
+def recover_results(path: str):
+    """custom_ids already written to a work file, dropping a partly written last line"""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, "rb+") as f:
+        content = f.read()
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            f.truncate(end)
+        for line in content[:end].splitlines():
+            try:
+                done.add(json.loads(line)["custom_id"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+class BatchRunner:
+    """Processes batch jobs in the background, one job at a time per worker
+
+    Jobs are claimed through a lease in batch_jobs, so with several workers
+    (or nodes sharing the database) each job runs in exactly one place. The
+    lease is renewed together with the progress counters; if a worker dies,
+    another one resumes the job once the lease expires, skipping requests
+    whose results are already in the output files. Requests run at most
+    concurrency at a time and go through the scheduler as background work,
+    so they only use model slots interactive traffic is not waiting for.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = config.BATCH_CONCURRENCY,
+        poll_interval: float = config.BATCH_POLL_INTERVAL,
+        lease_seconds: float = config.BATCH_LEASE_SECONDS,
+        max_attempts: int = config.BATCH_MAX_ATTEMPTS,
+    ):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(max_attempts, 1)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """Look for new jobs now instead of at the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        os.makedirs(config.BATCH_DIR, exist_ok=True)
+        if self.concurrency > 0:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop processing; the current job's lease is released so it resumes on the next start"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
+
+    async def _run(self):
+        while True:
+            try:
+                job_id = await self._claim()
+                if job_id is not None:
+                    await self._process(job_id)
+                    continue
+            except Exception:
+                logger.exception("Batch runner failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    @staticmethod
+    def _expires_at(job: BatchJob):
+        # SQLite hands back naive datetimes; everything is stored in UTC
+        return job.expires_at if job.expires_at.tzinfo else job.expires_at.replace(tzinfo=timezone.utc)
+
+    def _lease(self):
+        return utcnow() + timedelta(seconds=self.lease_seconds)
+
+    async def _claim(self) -> Optional[str]:
+        """Take the lease on the oldest unfinished job nobody holds"""
+        now = utcnow()
+        unlocked = or_(BatchJob.locked_until.is_(None), BatchJob.locked_until < now)
+        async with SessionLocal() as db:
+            candidates = (await db.scalars(
+                select(BatchJob.id)
+                .where(BatchJob.status.in_(ACTIVE_STATUSES), unlocked)
+                .order_by(BatchJob.created_at)
+                .limit(10)
+            )).all()
+            for job_id in candidates:
+                result = await db.execute(
+                    update(BatchJob)
+                    .where(BatchJob.id == job_id, unlocked)
+                    .values(locked_by=self.worker_id, locked_until=self._lease())
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    return job_id
+        return None
+
+    async def _update(self, job_id: str, if_status: Optional[str] = None, **values):
+        """Update a job this worker holds (only while it is in if_status, when given)
+
+        Returns the job's status afterwards, or None if the lease was lost.
+        """
+        async with SessionLocal() as db:
+            stmt = update(BatchJob).where(BatchJob.id == job_id, BatchJob.locked_by == self.worker_id)
+            if if_status is not None:
+                stmt = stmt.where(BatchJob.status == if_status)
+            await db.execute(stmt.values(**values))
+            await db.commit()
+            row = (await db.execute(select(BatchJob.status, BatchJob.locked_by).where(BatchJob.id == job_id))).one_or_none()
+            if row is None or row.locked_by != self.worker_id:
+                return None
+            return row.status
+
+    async def _process(self, job_id: str):
+        async with SessionLocal() as db:
+            job = await db.get(BatchJob, job_id)
+            db.expunge(job)
+
+        try:
+            if job.status in ("validating", "in_progress") and utcnow() >= self._expires_at(job):
+                await self._finish(job, "expired")
+                return
+            if job.status == "validating":
+                total, errors = await run_in_threadpool(validate_input, file_path(job.input_file_id), job.endpoint)
+                if errors:
+                    await self._finish(job, "failed", errors=json.dumps(errors), total=total)
+                    return
+                # A cancel that arrived during validation wins
+                status = await self._update(job.id, if_status="validating", status="in_progress", total=total, in_progress_at=utcnow())
+                if status is None:
+                    return
+                job.status, job.total = status, total
+            if job.status == "in_progress":
+                job.status = await self._run_requests(job)
+            if job.status in ("cancelling", "cancelled"):
+                await self._finish(job, "cancelled")
+            elif job.status == "expired":
+                await self._finish(job, "expired")
+            elif job.status in ("in_progress", "finalizing"):
+                await self._finish(job, "completed")
+        except asyncio.CancelledError:
+            # Shutting down: let the next worker to start pick the job up straight away
+            await asyncio.shield(self._update(job.id, locked_by=None, locked_until=None))
+            raise
+        except Exception as e:
+            logger.exception("Batch %s failed", job.id)
+            error = [{"code": "internal_error", "message": str(e) or type(e).__name__, "param": None, "line": None}]
+            await self._finish(job, "failed", errors=json.dumps(error))
+
+    async def _run_requests(self, job: BatchJob):
+        """Run every request without a result yet; returns the status the job ends with"""
+        output_path, error_path = work_path(job.id, "output"), work_path(job.id, "error")
+        done_ok = await run_in_threadpool(recover_results, output_path)
+        done_failed = await run_in_threadpool(recover_results, error_path)
+        counts = {"completed": len(done_ok), "failed": len(done_failed)}
+        done = done_ok | done_failed
+        expires_at = self._expires_at(job)
+
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight: Set[asyncio.Task] = set()
+        stop: List[str] = []
+
+        async def heartbeat():
+            while True:
+                # notify() (e.g. a cancel handled by this worker) triggers an early check
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(self.lease_seconds / 3, 5.0))
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                status = await self._update(job.id, locked_until=self._lease(), **counts)
+                if status is None:
+                    stop.append("lost")
+                elif status == "cancelling":
+                    stop.append("cancelling")
+                elif utcnow() >= expires_at:
+                    stop.append("expired")
+                if stop:
+                    for task in in_flight:
+                        task.cancel()
+                    return
+
+        with open(output_path, "a", encoding="utf-8") as output, open(error_path, "a", encoding="utf-8") as errors:
+            async def run_one(request: Dict[str, Any]):
+                try:
+                    status_code, line = await self._execute(job, request)
+                    target = output if status_code < 400 else errors
+                    target.write(json.dumps(line) + "\n")
+                    target.flush()
+                    counts["completed" if status_code < 400 else "failed"] += 1
+                finally:
+                    slots.release()
+
+            beat = asyncio.create_task(heartbeat())
+            try:
+                with open(file_path(job.input_file_id), "rb") as f:
+                    for line in f:
+                        if stop:
+                            break
+                        if not line.strip():
+                            continue
+                        request = json.loads(line)
+                        if request["custom_id"] in done:
+                            continue
+                        await slots.acquire()
+                        if stop:
+                            slots.release()
+                            break
+                        task = asyncio.create_task(run_one(request))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+            finally:
+                beat.cancel()
+                for task in list(in_flight):
+                    task.cancel()
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+
+        if "lost" in stop:
+            logger.warning("Batch %s: lease lost, leaving it to the worker that took it over", job.id)
+            return "lost"
+        status = await self._update(job.id, **counts)
+        if stop:
+            return stop[0]
+        return "finalizing" if status == "in_progress" else status
+
+    async def _execute(self, job: BatchJob, request: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Run one request, retrying 5xx failures; returns (status code, output line)"""
+        body = request["body"]
+        started = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            try:
+                status_code, response_body = await self._call(job.endpoint, body)
+            except HTTPException as e:
+                status_code, response_body = e.status_code, {"error": {"message": e.detail, "type": "upstream_error"}}
+            except Exception as e:
+                logger.exception("Batch %s: request %s failed", job.id, request["custom_id"])
+                status_code, response_body = 500, {"error": {"message": str(e) or type(e).__name__, "type": "internal_error"}}
+            if status_code < 500 or attempt == self.max_attempts - 1:
+                break
+            await asyncio.sleep(2 ** attempt)
+
+        usage = response_body.get("usage") or {}
+        usage_writer.record(
+            job.api_key_id, "/v1/batches",
+            model=body.get("model"),
+            status_code=status_code,
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+        return status_code, {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": status_code, "request_id": uuid.uuid4().hex, "body": response_body},
+            "error": None,
+        }
+
+    async def _call(self, endpoint: str, body: Dict[str, Any]):
+        model = body.get("model")
+        if endpoint == "/v1/embeddings":
+            inputs, params = embedding_request(body)
+            async with scheduler.background_slot(model):
+                embeddings, prompt_tokens = await embedding_batcher.embed(model, inputs, params)
+            return 200, embeddings_body(body, embeddings, prompt_tokens)
+
+        if endpoint == "/v1/completions":
+            ollama_req, call, build_body = completion_request(body), ollama_proxy.generate, completion_body
+        else:
+            ollama_req, call, build_body = chat_request(body), ollama_proxy.chat, chat_completion_body
+        async with scheduler.background_slot(model):
+            ollama_response, status_code = await call(ollama_req)
+        if status_code != 200 or "error" in ollama_response:
+            message = ollama_response.get("error", "Ollama request failed") if isinstance(ollama_response, dict) else "Ollama request failed"
+            return (status_code if status_code >= 400 else 502), {"error": {"message": message, "type": "upstream_error"}}
+        return 200, build_body(body, ollama_response)
+
+    async def _finish(self, job: BatchJob, status: str, **values):
+        """Move the result files into the file store and record the final status"""
+        async with SessionLocal() as db:
+            for kind, purpose, column in (("output", "batch_output", "output_file_id"), ("error", "batch_error", "error_file_id")):
+                path = work_path(job.id, kind)
+                if not os.path.exists(path):
+                    continue
+                size = os.path.getsize(path)
+                if size == 0:
+                    os.remove(path)
+                    continue
+                file_id = f"file-{uuid.uuid4().hex}"
+                os.replace(path, file_path(file_id))
+                db.add(BatchFile(id=file_id, api_key_id=job.api_key_id, filename=f"{job.id}_{kind}.jsonl", purpose=purpose, bytes=size))
+                values[column] = file_id
+            await db.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job.id)
+                .values(status=status, finished_at=utcnow(), locked_by=None, locked_until=None, **values)
+            )
+            await db.commit()
+
+batch_runner = BatchRunner()
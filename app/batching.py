@@ -0,0 +1,96 @@
+from fastapi import HTTPException
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from app import config, metrics
+import asyncio
+import json
+
+class EmbeddingBatcher:
+    """Merge concurrent embedding requests for the same model into one /api/embed call
+
+    The first request for a model opens a batch that is sent after window
+    seconds, or as soon as it holds max_batch_size inputs. Results are split
+    back per caller; prompt tokens are shared out in proportion to each
+    caller's share of the input text. If a merged call fails, its callers are
+    retried one by one so a single bad input only fails its own request.
+    The backend and phase timings of a merged call are attached to every
+    caller's request metrics, not just the one whose request opened the batch.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[Dict[str, Any]], Awaitable[Tuple[Dict[str, Any], int]]],
+        window: float = config.EMBEDDING_BATCH_WINDOW,
+        max_batch_size: int = config.EMBEDDING_MAX_BATCH_SIZE,
+    ):
+        self._embed = embed
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[str, List] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    async def embed(self, model: str, inputs: List[str], params: Dict[str, Any] = None):
+        """Return (embeddings, prompt_tokens) for inputs"""
+        params = params or {}
+        if self.window <= 0 or len(inputs) >= self.max_batch_size:
+            return await self._embed_single(model, inputs, params)
+
+        loop = asyncio.get_running_loop()
+        key = json.dumps([model, params], sort_keys=True)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((inputs, future))
+        if sum(len(item_inputs) for item_inputs, _ in batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        shared, outcome = await future
+        metrics.merge(shared)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def _flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            model, params = json.loads(key)
+            asyncio.create_task(self._run_batch(model, params, batch))
+
+    async def _embed_single(self, model: str, inputs: List[str], params: Dict[str, Any]):
+        response, status_code = await self._embed({**params, "model": model, "input": inputs})
+        if status_code != 200 or "error" in response:
+            raise HTTPException(status_code=status_code if status_code >= 400 else 502, detail=response.get("error", "Embedding failed"))
+        return response.get("embeddings", []), response.get("prompt_eval_count", 0)
+
+    async def _run_batch(self, model: str, params: Dict[str, Any], batch: List):
+        batch = [(inputs, future) for inputs, future in batch if not future.done()]
+        if not batch:
+            return
+        all_inputs = [text for inputs, _ in batch for text in inputs]
+        # Futures get (metrics of the merged call, result or exception)
+        with metrics.capture() as shared:
+            try:
+                embeddings, prompt_tokens = await self._embed_single(model, all_inputs, params)
+            except Exception as e:
+                error = e
+            else:
+                error = None
+        if error is not None:
+            if len(batch) > 1 and isinstance(error, HTTPException) and error.status_code < 500:
+                await asyncio.gather(*(self._run_batch(model, params, [item]) for item in batch))
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_result((shared, error))
+            return
+
+        total_chars = sum(len(text) for text in all_inputs) or 1
+        offset = 0
+        for inputs, future in batch:
+            caller_embeddings = embeddings[offset:offset + len(inputs)]
+            offset += len(inputs)
+            caller_tokens = round(prompt_tokens * sum(len(text) for text in inputs) / total_chars)
+            if not future.done():
+                future.set_result((shared, (caller_embeddings, caller_tokens)))
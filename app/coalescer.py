@@ -0,0 +1,59 @@
+from typing import Any, Awaitable, Callable, Dict
+from app import metrics
+import asyncio
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class RequestCoalescer:
+    """Share one upstream call between identical concurrent requests
+
+    The first caller for a key starts the call as a task; callers arriving
+    while it runs wait on the same task. The task is shielded from any single
+    caller going away and is only cancelled once every waiter has left.
+    The backend and phase timings of the call are attached to every waiter's
+    request metrics, not just the first caller's.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self, key: str):
+        return key in self._flights
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.create_task(self._shared_call(call)))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+
+        flight.waiters += 1
+        try:
+            shared, outcome = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self._forget(key, flight)
+        metrics.merge(shared)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    @staticmethod
+    async def _shared_call(call: Callable[[], Awaitable[Any]]):
+        """(metrics, result or exception) of call, measured apart from any one caller's request"""
+        with metrics.capture() as shared:
+            try:
+                return shared, await call()
+            except Exception as e:
+                return shared, e
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,173 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def _get_float(name: str, default: float):
+    return float(os.getenv(name, default))
+
+def _get_int(name: str, default: int):
+    return int(os.getenv(name, default))
+
+def _get_map(name: str):
+    """Parse "key=value,key=value" into a dict of strings"""
+    values = {}
+    for item in os.getenv(name, "").split(","):
+        key, sep, value = item.partition("=")
+        if sep and key.strip():
+            values[key.strip()] = value.strip()
+    return values
+
+def _get_float_map(name: str):
+    """Parse "key=value,key=value" into a dict of floats"""
+    return {key: float(value) for key, value in _get_map(name).items()}
+
+# Server (run.py production mode); PORT=0 picks the first free port from 8000
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = _get_int("PORT", 0)
+WORKERS = _get_int("WORKERS", os.cpu_count() or 1)
+# Worker processes actually serving this app, which split the scheduler caps
+# and each key's requests per minute between them; run.py sets it to WORKERS,
+# other multi-process launchers must set it themselves
+WORKER_PROCESSES = _get_int("WORKER_PROCESSES", 1)
+# Event loop and HTTP parser: auto uses uvloop/httptools when installed
+UVICORN_LOOP = os.getenv("UVICORN_LOOP", "auto")
+UVICORN_HTTP = os.getenv("UVICORN_HTTP", "auto")
+BACKLOG = _get_int("BACKLOG", 2048)
+# Concurrent connections per worker before answering 503 (0 = unlimited)
+LIMIT_CONCURRENCY = _get_int("LIMIT_CONCURRENCY", 0)
+TIMEOUT_KEEP_ALIVE = _get_int("TIMEOUT_KEEP_ALIVE", 5)
+# Seconds a stopping worker waits for in-flight requests and streams
+TIMEOUT_GRACEFUL_SHUTDOWN = _get_int("TIMEOUT_GRACEFUL_SHUTDOWN", 300)
+
+# Database
+# sqlite:///... and postgresql://... URLs are mapped to their async drivers
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/ollama_middleware.db")
+DB_POOL_SIZE = _get_int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _get_int("DB_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT = _get_float("DB_POOL_TIMEOUT", 30.0)
+DB_POOL_RECYCLE = _get_int("DB_POOL_RECYCLE", 1800)
+SQLITE_BUSY_TIMEOUT_MS = _get_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_MMAP_SIZE = _get_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+# Apply pending schema migrations when the app starts
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() == "true"
+
+# Ollama Settings
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Comma-separated list of Ollama hosts to balance across (defaults to OLLAMA_BASE_URL)
+OLLAMA_BASE_URLS = [url.strip() for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",") if url.strip()]
+
+# Backend health probes against /api/tags
+OLLAMA_HEALTH_CHECK_INTERVAL = _get_float("OLLAMA_HEALTH_CHECK_INTERVAL", 10.0)
+OLLAMA_HEALTH_CHECK_TIMEOUT = _get_float("OLLAMA_HEALTH_CHECK_TIMEOUT", 2.0)
+
+# Model catalogue (/api/tags) cache: fresh for MODELS_CACHE_TTL, then served
+# stale while refreshing in the background until MODELS_CACHE_STALE_TTL
+MODELS_CACHE_TTL = _get_float("MODELS_CACHE_TTL", 30.0)
+MODELS_CACHE_STALE_TTL = _get_float("MODELS_CACHE_STALE_TTL", 300.0)
+
+# Upstream connection pool (one per Ollama backend)
+OLLAMA_MAX_CONNECTIONS = _get_int("OLLAMA_MAX_CONNECTIONS", 100)
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = _get_int("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", 20)
+OLLAMA_KEEPALIVE_EXPIRY = _get_float("OLLAMA_KEEPALIVE_EXPIRY", 30.0)
+
+# Upstream timeouts in seconds, per phase
+OLLAMA_CONNECT_TIMEOUT = _get_float("OLLAMA_CONNECT_TIMEOUT", 5.0)
+OLLAMA_READ_TIMEOUT = _get_float("OLLAMA_READ_TIMEOUT", 300.0)
+OLLAMA_WRITE_TIMEOUT = _get_float("OLLAMA_WRITE_TIMEOUT", 30.0)
+OLLAMA_POOL_TIMEOUT = _get_float("OLLAMA_POOL_TIMEOUT", 10.0)
+# Read timeout overrides for long generations, keyed by model or endpoint
+# (e.g. "llama3:70b=1800,/api/embed=60"); a model entry wins over an endpoint one
+OLLAMA_READ_TIMEOUTS = _get_float_map("OLLAMA_READ_TIMEOUTS")
+
+# Model residency: hot models are loaded on every backend that has them at
+# startup and reloaded when a poll of /api/ps finds them gone
+OLLAMA_PRELOAD_MODELS = [name.strip() for name in os.getenv("OLLAMA_PRELOAD_MODELS", "").split(",") if name.strip()]
+# keep_alive sent with every request for a model, e.g. "llama3=-1,mistral=30m"
+# (hot models default to -1, i.e. never unloaded)
+OLLAMA_KEEP_ALIVE = _get_map("OLLAMA_KEEP_ALIVE")
+# Seconds between reads of each backend's loaded models (0 disables tracking)
+OLLAMA_PS_POLL_INTERVAL = _get_float("OLLAMA_PS_POLL_INTERVAL", 5.0)
+
+# JWT and session signing; must be the same on every worker and node
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
+ACCESS_TOKEN_EXPIRE_MINUTES = _get_int("ACCESS_TOKEN_EXPIRE_MINUTES", 30)
+
+# Web UI sessions: "database" (server-side, revoked on logout) or "signed"
+# (stateless signed cookies); both work across workers and nodes
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "database")
+SESSION_MAX_AGE = _get_int("SESSION_MAX_AGE", 3600)
+SESSION_SWEEP_INTERVAL = _get_float("SESSION_SWEEP_INTERVAL", 300.0)
+
+# Authentication cache for active API keys
+API_KEY_CACHE_SIZE = _get_int("API_KEY_CACHE_SIZE", 10000)
+API_KEY_CACHE_TTL = _get_float("API_KEY_CACHE_TTL", 60.0)
+
+# Default per-key limits for keys without their own (0 = unlimited); daily
+# token usage is reloaded from the usage rollups every RATE_LIMIT_SYNC_INTERVAL
+RATE_LIMIT_RPM = _get_int("RATE_LIMIT_RPM", 0)
+RATE_LIMIT_TOKENS_PER_DAY = _get_int("RATE_LIMIT_TOKENS_PER_DAY", 0)
+RATE_LIMIT_SYNC_INTERVAL = _get_float("RATE_LIMIT_SYNC_INTERVAL", 10.0)
+
+# Write-behind batching of request logs and last_used updates
+USAGE_FLUSH_BATCH_SIZE = _get_int("USAGE_FLUSH_BATCH_SIZE", 500)
+USAGE_FLUSH_INTERVAL = _get_float("USAGE_FLUSH_INTERVAL", 1.0)
+USAGE_MAX_PENDING = _get_int("USAGE_MAX_PENDING", 100000)
+
+# Opt-in cache of deterministic (temperature 0) completion and chat responses
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = _get_int("RESPONSE_CACHE_MAX_ENTRIES", 10000)
+RESPONSE_CACHE_MAX_BYTES = _get_int("RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+RESPONSE_CACHE_TTL = _get_float("RESPONSE_CACHE_TTL", 3600.0)
+# Directory for the on-disk tier; leave unset to keep the cache in memory only
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR") or None
+# Caps of the on-disk tier, enforced (along with the TTL) by a sweep every
+# RESPONSE_CACHE_SWEEP_INTERVAL seconds that deletes the oldest entries first
+RESPONSE_CACHE_DISK_MAX_ENTRIES = _get_int("RESPONSE_CACHE_DISK_MAX_ENTRIES", 100000)
+RESPONSE_CACHE_DISK_MAX_BYTES = _get_int("RESPONSE_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)
+RESPONSE_CACHE_SWEEP_INTERVAL = _get_float("RESPONSE_CACHE_SWEEP_INTERVAL", 300.0)
+
+# Opt-in semantic cache: answer non-streaming chat requests whose last user
+# message is close enough (cosine similarity) to one answered before
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "nomic-embed-text")
+SEMANTIC_CACHE_THRESHOLD = _get_float("SEMANTIC_CACHE_THRESHOLD", 0.95)
+# Per-model overrides, e.g. "llama3=0.9,mistral=0.97"
+SEMANTIC_CACHE_THRESHOLDS = _get_float_map("SEMANTIC_CACHE_THRESHOLDS")
+SEMANTIC_CACHE_MAX_ENTRIES = _get_int("SEMANTIC_CACHE_MAX_ENTRIES", 10000)
+SEMANTIC_CACHE_TTL = _get_float("SEMANTIC_CACHE_TTL", 86400.0)
+# Directory for the memory-mapped index, one worker-<n> subdirectory per
+# worker process; leave unset to keep it in memory only
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR") or None
+
+# Share one upstream call between identical concurrent non-streaming requests:
+# "deterministic" (temperature 0 only), "all" or "off"
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "deterministic").lower()
+
+# Admission scheduler in front of the backends (0 disables a limit)
+SCHEDULER_BACKEND_CONCURRENCY = _get_int("SCHEDULER_BACKEND_CONCURRENCY", 4)
+SCHEDULER_MODEL_CONCURRENCY = _get_int("SCHEDULER_MODEL_CONCURRENCY", 0)
+SCHEDULER_MAX_QUEUE = _get_int("SCHEDULER_MAX_QUEUE", 256)
+SCHEDULER_QUEUE_TIMEOUT = _get_float("SCHEDULER_QUEUE_TIMEOUT", 30.0)
+
+# Offline batch jobs (/v1/batches): where input and output files are kept,
+# requests in flight per job, and how often idle workers look for new jobs
+BATCH_DIR = os.getenv("BATCH_DIR", "./data/batches")
+BATCH_MAX_FILE_BYTES = _get_int("BATCH_MAX_FILE_BYTES", 200 * 1024 * 1024)
+BATCH_CONCURRENCY = _get_int("BATCH_CONCURRENCY", 4)
+BATCH_POLL_INTERVAL = _get_float("BATCH_POLL_INTERVAL", 5.0)
+# A job whose worker stops renewing its lease for this long is resumed elsewhere
+BATCH_LEASE_SECONDS = _get_float("BATCH_LEASE_SECONDS", 60.0)
+# Attempts for requests failing with 5xx before they go to the error file
+BATCH_MAX_ATTEMPTS = _get_int("BATCH_MAX_ATTEMPTS", 3)
+
+# Micro-batching of /v1/embeddings requests per model
+EMBEDDING_BATCH_WINDOW = _get_float("EMBEDDING_BATCH_WINDOW", 0.005)
+EMBEDDING_MAX_BATCH_SIZE = _get_int("EMBEDDING_MAX_BATCH_SIZE", 64)
+
+# Per-request timing: Server-Timing response header and a log of slow requests
+# (0 disables the log), sampled and capped at SLOW_REQUEST_LOG_LIMIT per minute
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+SLOW_REQUEST_THRESHOLD = _get_float("SLOW_REQUEST_THRESHOLD", 5.0)
+SLOW_REQUEST_SAMPLE_RATE = _get_float("SLOW_REQUEST_SAMPLE_RATE", 1.0)
+SLOW_REQUEST_LOG_LIMIT = _get_int("SLOW_REQUEST_LOG_LIMIT", 60)
@@ -1,44 +1,99 @@
-from sqlalchemy.orm import Session
-from app.models import User, ApiKey
-from app.schemas import UserCreate, ApiKeyCreate
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from app.models import User, ApiKey, UsageRollup
+from app.schemas import UserCreate, ApiKeyCreate, ApiKeyUpdate
 from app.auth import get_password_hash, generate_bearer_token
+from app.key_cache import api_key_cache
 
-def get_user(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_user(db: AsyncSession, username: str):
+    return await db.scalar(select(User).where(User.username == username))
 
-def create_user(db: Session, user: UserCreate):
-    hashed_password = get_password_hash(user.password)
+async def get_users(db: AsyncSession):
+    return (await db.scalars(select(User))).all()
+
+async def create_user(db: AsyncSession, user: UserCreate):
+    # bcrypt is deliberately slow; keep it off the event loop
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
     db_user = User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_api_keys(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(ApiKey).offset(skip).limit(limit).all()
+async def get_api_keys(db: AsyncSession, skip: int = 0, limit: int = 100):
+    return (await db.scalars(select(ApiKey).offset(skip).limit(limit))).all()
 
-def get_api_key(db: Session, api_key_id: int):
-    return db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+async def get_api_key(db: AsyncSession, api_key_id: int):
+    return await db.get(ApiKey, api_key_id)
 
-def create_api_key(db: Session, api_key: ApiKeyCreate):
+async def create_api_key(db: AsyncSession, api_key: ApiKeyCreate):
     generated_token = generate_bearer_token()
-    db_api_key = ApiKey(key_name=api_key.key_name, api_key=generated_token)
+    db_api_key = ApiKey(
+        key_name=api_key.key_name,
+        api_key=generated_token,
+        weight=api_key.weight,
+        rpm_limit=api_key.rpm_limit,
+        tokens_per_day_limit=api_key.tokens_per_day_limit,
+    )
     db.add(db_api_key)
-    db.commit()
-    db.refresh(db_api_key)
+    await db.commit()
+    await db.refresh(db_api_key)
     return db_api_key
 
-def update_api_key(db: Session, api_key_id: int, is_active: bool):
-    db_api_key = db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+async def update_api_key(db: AsyncSession, api_key_id: int, changes: ApiKeyUpdate):
+    """Apply the fields set in changes (model_fields_set) to an API key"""
+    db_api_key = await db.get(ApiKey, api_key_id)
     if db_api_key:
-        db_api_key.is_active = is_active
-        db.commit()
-        db.refresh(db_api_key)
+        for field, value in changes.model_dump(exclude_unset=True).items():
+            setattr(db_api_key, field, value)
+        await db.commit()
+        await db.refresh(db_api_key)
+        api_key_cache.invalidate(db_api_key.api_key)
     return db_api_key
 
-def delete_api_key(db: Session, api_key_id: int):
-    db_api_key = db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+async def delete_api_key(db: AsyncSession, api_key_id: int):
+    db_api_key = await db.get(ApiKey, api_key_id)
     if db_api_key:
-        db.delete(db_api_key)
-        db.commit()
-    return db_api_key 
\ No newline at end of file
+        token = db_api_key.api_key
+        await db.delete(db_api_key)
+        await db.commit()
+        api_key_cache.invalidate(token)
+    return db_api_key
+
+async def get_usage(
+    db: AsyncSession,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    api_key_id: Optional[int] = None,
+    model: Optional[str] = None,
+):
+    """Usage per bucket, API key and model from the rollups, for buckets starting in [start, end)"""
+    stmt = (
+        select(
+            UsageRollup.bucket_start,
+            UsageRollup.api_key_id,
+            UsageRollup.model,
+            func.sum(UsageRollup.request_count).label("requests"),
+            func.sum(UsageRollup.cache_hits).label("cache_hits"),
+            func.sum(UsageRollup.error_count).label("errors"),
+            func.sum(UsageRollup.prompt_tokens).label("prompt_tokens"),
+            func.sum(UsageRollup.completion_tokens).label("completion_tokens"),
+            func.sum(UsageRollup.latency_ms_total).label("latency_ms_total"),
+        )
+        .where(
+            UsageRollup.granularity == granularity,
+            UsageRollup.bucket_start >= start,
+            UsageRollup.bucket_start < end,
+        )
+        .group_by(UsageRollup.bucket_start, UsageRollup.api_key_id, UsageRollup.model)
+        .order_by(UsageRollup.bucket_start, UsageRollup.api_key_id, UsageRollup.model)
+    )
+    if api_key_id is not None:
+        stmt = stmt.where(UsageRollup.api_key_id == api_key_id)
+    if model is not None:
+        stmt = stmt.where(UsageRollup.model == model)
+    return (await db.execute(stmt)).mappings().all()
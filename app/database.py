@@ -1,23 +1,59 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app import config
 import os
 
-# Create database directory if it doesn't exist
-os.makedirs("data", exist_ok=True)
+# Async driver for each supported backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./data/ollama_middleware.db"
+def async_database_url(url: str):
+    """Map a plain sqlite:// or postgresql:// URL onto its async driver"""
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+SQLALCHEMY_DATABASE_URL = async_database_url(config.DATABASE_URL)
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.get_backend_name() == "sqlite"
+
+if IS_SQLITE and SQLALCHEMY_DATABASE_URL.database not in (None, "", ":memory:"):
+    # Create database directory if it doesn't exist
+    os.makedirs(os.path.dirname(os.path.abspath(SQLALCHEMY_DATABASE_URL.database)), exist_ok=True)
+
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    # aiosqlite defaults to NullPool; pool its connections like any other backend
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=config.DB_POOL_TIMEOUT,
+    pool_recycle=config.DB_POOL_RECYCLE,
+    pool_pre_ping=not IS_SQLITE,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def configure_sqlite(dbapi_connection, connection_record):
+        """WAL lets readers proceed while the single writer commits"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+        cursor.close()
+
+# Objects stay usable after commit, so routes never trigger implicit (blocking) refreshes
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close() 
\ No newline at end of file
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from app import config
+import threading
+import time
+
+class CachedApiKey(NamedTuple):
+    """Detached snapshot of an active API key, safe to share between requests"""
+    id: int
+    key_name: str
+    api_key: str
+    weight: int = 1
+    rpm_limit: Optional[int] = None
+    tokens_per_day_limit: Optional[int] = None
+
+class ApiKeyCache:
+    """Bounded TTL/LRU cache of active API keys, keyed by Bearer token
+
+    Entries are dropped explicitly when a key is deactivated or deleted
+    through app.crud. Other worker processes only see such changes once
+    their own entry expires, so the TTL bounds how long a revoked key can
+    remain usable there.
+    """
+
+    def __init__(self, max_size: int = config.API_KEY_CACHE_SIZE, ttl: float = config.API_KEY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with it cannot re-insert a stale key
+        self.generation = 0
+
+    def get(self, token: str) -> Optional[CachedApiKey]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            cached_key, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return cached_key
+
+    def put(self, cached_key: CachedApiKey, generation: Optional[int] = None):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[cached_key.api_key] = (cached_key, time.monotonic() + self.ttl)
+            self._entries.move_to_end(cached_key.api_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+api_key_cache = ApiKeyCache()
@@ -1,13 +1,25 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from app.database import engine, get_db
+from fastapi.responses import Response
+from contextlib import asynccontextmanager
+from sqlalchemy.exc import IntegrityError
+from app import config, metrics
+from app.database import engine, SessionLocal
+from app.migrations import run_migrations
 from app.models import Base, User, ApiKey, ApiRequestLog
-from app.api_routes import router as api_router
+from app.api_routes import router as api_router, ollama_proxy, residency
+from app.ollama_routes import router as ollama_router
+from app.batch_routes import router as batch_router
+from app.batches import batch_runner
+from app.usage_writer import usage_writer
+from app.semantic_cache import semantic_cache
+from app.response_cache import response_cache
+from app.rate_limits import rate_limiter, RateLimitHeadersMiddleware
+from app.sessions import session_store
 from app.admin_routes import router as admin_router
 from app.web_routes import router as web_router
-from app.crud import create_user
+from app.crud import create_user, get_user
 from app.schemas import UserCreate
 import os
 import logging
@@ -22,13 +34,40 @@ if not DEBUG:
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
     logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and release them on shutdown"""
+    if config.AUTO_MIGRATE:
+        await run_migrations()
+    await ollama_proxy.start()
+    await residency.start()
+    await usage_writer.start()
+    await rate_limiter.start()
+    await session_store.start()
+    if response_cache is not None:
+        await response_cache.start()
+    await startup_event()
+    await batch_runner.start()
+    try:
+        yield
+    finally:
+        await batch_runner.stop()
+        if response_cache is not None:
+            await response_cache.stop()
+        await session_store.stop()
+        await rate_limiter.stop()
+        await usage_writer.stop()
+        await residency.stop()
+        await ollama_proxy.close()
+        if semantic_cache is not None:
+            semantic_cache.close()
+        await engine.dispose()
 
 app = FastAPI(
     title="Ollama API Middleware",
     description="A middleware service that adds API key authentication to Ollama",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -40,35 +79,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# x-ratelimit-* headers from the per-key rate limiter
+app.add_middleware(RateLimitHeadersMiddleware)
+
+# Request counts and latency for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers
 app.include_router(api_router)
+app.include_router(ollama_router)
+app.include_router(batch_router)
 app.include_router(admin_router)
 app.include_router(web_router)
 
-@app.on_event("startup")
 async def startup_event():
-    """Initialize the application with a default admin user"""
-    db = next(get_db())
+    """Initialize the application with a default admin user
     
-    # Check if admin user exists
-    admin_user = db.query(User).filter(User.username == "admin").first()
-    if not admin_user:
-        # Create default admin user
-        admin_data = UserCreate(username="admin", password="admin123")
-        create_user(db, admin_data)
-        if DEBUG:
-            print("Default admin user created: username=admin, password=admin123")
-            print("Please change the default password after first login!")
-        else:
-            print("✅ Application started successfully")
-    
-    db.close()
+    Every worker runs this; when several race to create the user, the unique
+    username lets exactly one insert succeed and the others carry on.
+    """
+    async with SessionLocal() as db:
+        # Check if admin user exists
+        admin_user = await get_user(db, "admin")
+        if not admin_user:
+            # Create default admin user
+            admin_data = UserCreate(username="admin", password="admin123")
+            try:
+                await create_user(db, admin_data)
+            except IntegrityError:
+                await db.rollback()
+                return
+            if DEBUG:
+                print("Default admin user created: username=admin, password=admin123")
+                print("Please change the default password after first login!")
+            else:
+                print("✅ Application started successfully")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "ollama-middleware"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
     """Custom documentation page"""
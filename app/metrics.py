@@ -0,0 +1,412 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from app import config
+import json
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+slow_request_logger = logging.getLogger("app.slow_requests")
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 2000, 5000)
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.95, 0.96, 0.97, 0.98, 0.99, 1.0)
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_value(value: float):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]):
+        return tuple("" if labels.get(name) is None else str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def clear(self):
+        self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in list(self._series.items()):
+            lines.append(f"{self.name}{self._labels(key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._series[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # Per-bucket counts (the last one is +Inf), sum, count
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+class Registry:
+    """In-process metrics in the Prometheus text exposition format
+
+    Updating a metric is a dict lookup and an addition on the event loop, so
+    instrumenting the request path costs next to nothing. Gauges that mirror
+    state owned elsewhere (backend load, queue lengths) are filled in by
+    collectors right before each scrape instead. Every worker process keeps
+    its own registry.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception("Metrics collector failed")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "ollama_middleware_http_requests_total", "HTTP requests handled",
+    ("route", "model", "backend", "status"))
+HTTP_REQUEST_DURATION = registry.histogram(
+    "ollama_middleware_http_request_duration_seconds", "Time to handle an HTTP request, including the streamed body",
+    ("route", "model", "backend", "status"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "ollama_middleware_http_requests_in_flight", "HTTP requests currently being handled")
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    "ollama_middleware_time_to_first_token_seconds", "Time from receiving a streaming request to its first upstream chunk",
+    ("endpoint", "model", "backend"))
+UPSTREAM_REQUESTS = registry.counter(
+    "ollama_middleware_upstream_requests_total", "Requests sent to Ollama backends",
+    ("endpoint", "backend", "status"))
+UPSTREAM_DURATION = registry.histogram(
+    "ollama_middleware_upstream_duration_seconds", "Time from sending a request to Ollama until its response is complete",
+    ("endpoint", "model", "backend"))
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "ollama_middleware_upstream_in_flight", "Requests currently open against each Ollama backend",
+    ("backend",))
+BACKEND_UP = registry.gauge(
+    "ollama_middleware_backend_up", "Whether an Ollama backend is in rotation",
+    ("backend",))
+BACKEND_MODEL_LOADED = registry.gauge(
+    "ollama_middleware_backend_model_loaded", "Models each Ollama backend holds in memory, from /api/ps",
+    ("backend", "model"))
+COLD_STARTS = registry.counter(
+    "ollama_middleware_cold_starts_total", "Model requests routed to a backend that did not have the model loaded",
+    ("model", "backend"))
+ABANDONED_REQUESTS = registry.counter(
+    "ollama_middleware_abandoned_requests_total", "Requests whose client disconnected before the response was complete; their upstream call is cancelled",
+    ("endpoint", "model"))
+QUEUE_WAIT = registry.histogram(
+    "ollama_middleware_scheduler_queue_wait_seconds", "Time a request waited for a scheduler slot",
+    ("model",))
+SCHEDULER_RUNNING = registry.gauge(
+    "ollama_middleware_scheduler_running", "Requests holding a scheduler slot",
+    ("model",))
+SCHEDULER_QUEUED = registry.gauge(
+    "ollama_middleware_scheduler_queued", "Requests waiting for a scheduler slot")
+SCHEDULER_REJECTED = registry.counter(
+    "ollama_middleware_scheduler_rejected_total", "Requests shed by the scheduler with 429",
+    ("model", "reason"))
+TOKENS = registry.counter(
+    "ollama_middleware_tokens_total", "Tokens processed by Ollama",
+    ("model", "backend", "kind"))
+TOKENS_PER_SECOND = registry.histogram(
+    "ollama_middleware_tokens_per_second", "Ollama throughput per request, from eval_count/eval_duration and prompt_eval_count/prompt_eval_duration",
+    ("model", "backend", "phase"), buckets=TOKENS_PER_SECOND_BUCKETS)
+RATE_LIMITED = registry.counter(
+    "ollama_middleware_rate_limited_total", "Requests rejected by a per-key limit",
+    ("limit",))
+SEMANTIC_CACHE_LOOKUPS = registry.counter(
+    "ollama_middleware_semantic_cache_lookups_total", "Chat requests looked up in the semantic cache, by result (hit, miss or error)",
+    ("model", "result"))
+SEMANTIC_CACHE_SIMILARITY = registry.histogram(
+    "ollama_middleware_semantic_cache_similarity", "Cosine similarity of the closest semantic cache entry per lookup",
+    ("model",), buckets=SIMILARITY_BUCKETS)
+SEMANTIC_CACHE_ENTRIES = registry.gauge(
+    "ollama_middleware_semantic_cache_entries", "Live entries in the semantic cache index")
+USAGE_PENDING = registry.gauge(
+    "ollama_middleware_usage_pending", "Usage events waiting to be written to the database")
+
+class RequestMetrics:
+    """Labels, token counts and phase timings gathered while one HTTP request is handled"""
+    __slots__ = ("started", "model", "backend", "phases", "prompt_tokens", "completion_tokens", "on_finish")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.model: Optional[str] = None
+        self.backend: Optional[str] = None
+        # Seconds spent per phase (auth, queue, connect, upstream, load, build)
+        self.phases: Dict[str, float] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Called with (request_metrics, status_code, duration) once the response is finished
+        self.on_finish: List[Callable[["RequestMetrics", int, float], None]] = []
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request", default=None)
+
+def tag_request(model: Optional[str] = None, backend: Optional[str] = None):
+    """Attach the model and backend that served the current request to its metrics"""
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return
+    if model:
+        request_metrics.model = model
+    if backend:
+        request_metrics.backend = backend
+
+def count_tokens(prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Set the token counts reported to the client of the current request"""
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.prompt_tokens = prompt_tokens or 0
+        request_metrics.completion_tokens = completion_tokens or 0
+
+def on_request_finished(callback: Callable[[RequestMetrics, int, float], None]):
+    """Run callback(request_metrics, status_code, duration) when the current response is finished
+
+    Returns False (and does nothing) outside of a request.
+    """
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return False
+    request_metrics.on_finish.append(callback)
+    return True
+
+@contextmanager
+def capture():
+    """Record tags and phases into a RequestMetrics of their own rather than the current request's
+
+    For a call made once on behalf of several requests (coalesced or batched);
+    each of them then copies the result into its own metrics with merge().
+    """
+    captured = RequestMetrics()
+    token = current_request.set(captured)
+    try:
+        yield captured
+    finally:
+        current_request.reset(token)
+
+def merge(captured: RequestMetrics):
+    """Attach the model, backend and phase timings of a shared call to the current request"""
+    tag_request(model=captured.model, backend=captured.backend)
+    for name, seconds in captured.phases.items():
+        record_phase(name, seconds)
+
+def record_phase(name: str, seconds: float):
+    """Add time spent in one phase to the current request's timing breakdown"""
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.phases[name] = request_metrics.phases.get(name, 0.0) + seconds
+
+@contextmanager
+def timed(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+def server_timing(phases: Dict[str, float], total: float):
+    """Format a Server-Timing header value (durations in milliseconds)"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def observe_generation(model: Optional[str], backend: str, stats: Dict[str, Any]):
+    """Record token counts and throughput from the timing fields of a final Ollama response"""
+    for kind, phase, count_key, duration_key in (
+        ("prompt", "prompt", "prompt_eval_count", "prompt_eval_duration"),
+        ("completion", "generation", "eval_count", "eval_duration"),
+    ):
+        count = stats.get(count_key)
+        if not isinstance(count, (int, float)) or count <= 0:
+            continue
+        TOKENS.inc(count, model=model, backend=backend, kind=kind)
+        duration = stats.get(duration_key)
+        if isinstance(duration, (int, float)) and duration > 0:
+            # Ollama reports durations in nanoseconds
+            TOKENS_PER_SECOND.observe(count * 1e9 / duration, model=model, backend=backend, phase=phase)
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route, model, backend and status
+
+    It also adds the phase breakdown collected through record_phase() as a
+    Server-Timing header (phases finished before the headers go out; for
+    streams that excludes the body) and logs requests slower than
+    SLOW_REQUEST_THRESHOLD as one JSON line each, sampled and capped per
+    minute so a slow backend cannot flood the logs.
+    """
+
+    def __init__(
+        self,
+        app,
+        server_timing: bool = config.SERVER_TIMING_ENABLED,
+        slow_threshold: float = config.SLOW_REQUEST_THRESHOLD,
+        slow_sample_rate: float = config.SLOW_REQUEST_SAMPLE_RATE,
+        slow_log_limit: int = config.SLOW_REQUEST_LOG_LIMIT,
+    ):
+        self.app = app
+        self.server_timing = server_timing
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self.slow_log_limit = slow_log_limit
+        self._route_paths: Dict[Any, str] = {}
+        self._slow_window = 0
+        self._slow_logged = 0
+
+    def _route_path(self, scope):
+        """Route template (e.g. /api-keys/{key_id}) so label values stay bounded"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            path = "unmatched"
+            for route in getattr(scope.get("app"), "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint or getattr(route, "app", None) is endpoint:
+                    path = route.path
+                    break
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    timing = server_timing(request_metrics.phases, time.perf_counter() - request_metrics.started)
+                    message = {**message, "headers": [*message.get("headers", ()), (b"server-timing", timing.encode("latin-1"))]}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            current_request.reset(token)
+            labels = {
+                "route": self._route_path(scope),
+                "model": request_metrics.model,
+                "backend": request_metrics.backend,
+                "status": status_code,
+            }
+            duration = time.perf_counter() - request_metrics.started
+            HTTP_REQUESTS.inc(**labels)
+            HTTP_REQUEST_DURATION.observe(duration, **labels)
+            for callback in request_metrics.on_finish:
+                try:
+                    callback(request_metrics, status_code, duration)
+                except Exception:
+                    logger.exception("Request finish callback failed")
+            if 0 < self.slow_threshold <= duration:
+                self._log_slow_request(scope, labels, duration, request_metrics.phases)
+
+    def _log_slow_request(self, scope, labels: Dict[str, Any], duration: float, phases: Dict[str, float]):
+        if random.random() >= self.slow_sample_rate:
+            return
+        window = int(time.monotonic() // 60)
+        if window != self._slow_window:
+            self._slow_window = window
+            self._slow_logged = 0
+        if self._slow_logged >= self.slow_log_limit:
+            return
+        self._slow_logged += 1
+        slow_request_logger.warning(json.dumps({
+            "event": "slow_request",
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            **labels,
+            "duration_ms": round(duration * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        }))
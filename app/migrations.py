@@ -0,0 +1,80 @@
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from app.database import engine
+import os
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+# Tables and columns of each revision that databases built with create_all
+# (before migrations existed) can be at
+SCHEMA_0001 = {
+    "users": {"id", "username", "hashed_password", "is_active", "created_at", "updated_at"},
+    "api_keys": {"id", "key_name", "api_key", "is_active", "created_at", "updated_at", "last_used"},
+    "api_request_logs": {"id", "api_key_id", "endpoint", "timestamp"},
+}
+SCHEMA_0002 = {
+    **SCHEMA_0001,
+    "api_keys": SCHEMA_0001["api_keys"] | {"weight"},
+    "api_request_logs": SCHEMA_0001["api_request_logs"] | {"model", "cache_hit"},
+    "usage_rollups": {"id", "granularity", "bucket_start", "api_key_id", "model", "endpoint", "request_count", "cache_hits"},
+}
+LEGACY_SCHEMAS = (("0002", SCHEMA_0002), ("0001", SCHEMA_0001))
+# Columns and tables that create_all in releases before migrations could
+# leave on a 0001 database ahead of 0002 (from a fresh install of that
+# release, or new tables created next to an older database's); 0002 only
+# adds the ones that are missing
+PARTIAL_0002 = {
+    "api_keys": {"weight"},
+    "api_request_logs": {"cache_hit"},
+}
+PARTIAL_0002_TABLES = {"usage_rollups"}
+
+def is_partial_0002(schema):
+    """Whether schema is 0001 plus some of the columns in PARTIAL_0002 and tables in PARTIAL_0002_TABLES"""
+    if not set(SCHEMA_0001) <= set(schema) <= set(SCHEMA_0001) | PARTIAL_0002_TABLES:
+        return False
+    return all(
+        columns == SCHEMA_0002[table] if table in PARTIAL_0002_TABLES else
+        SCHEMA_0001[table] <= columns and columns - SCHEMA_0001[table] <= PARTIAL_0002.get(table, set())
+        for table, columns in schema.items()
+    )
+
+def legacy_revision(schema):
+    """Revision an unversioned database matches exactly, or None for an empty database
+
+    Raises RuntimeError for any other schema rather than guess, since a wrong
+    stamp would make later migrations be skipped silently.
+    """
+    if not schema:
+        return None
+    for revision, known in LEGACY_SCHEMAS:
+        if schema == known:
+            return revision
+    if is_partial_0002(schema):
+        return "0001"
+    found = "; ".join(f"{table}({', '.join(sorted(columns))})" for table, columns in sorted(schema.items()))
+    raise RuntimeError(
+        f"The database has no migration history and its schema does not match any known revision ({found}). "
+        "Bring it to a known schema and run 'alembic stamp <revision>' before starting the app."
+    )
+
+def _upgrade(connection):
+    alembic_config = Config(ALEMBIC_INI)
+    alembic_config.attributes["connection"] = connection
+    alembic_config.attributes["configure_logger"] = False
+
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    if "alembic_version" not in tables:
+        # Databases created before migrations existed: record how far they already are
+        schema = {table: {column["name"] for column in inspector.get_columns(table)} for table in tables}
+        revision = legacy_revision(schema)
+        if revision is not None:
+            command.stamp(alembic_config, revision)
+    command.upgrade(alembic_config, "head")
+
+async def run_migrations():
+    """Bring the database schema up to date (alembic upgrade head)"""
+    async with engine.begin() as conn:
+        await conn.run_sync(_upgrade)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -19,13 +19,105 @@ class ApiKey(Base):
     key_name = Column(String, index=True)
     api_key = Column(String, unique=True, index=True)
     is_active = Column(Boolean, default=True)
+    # Share of model slots under contention (weighted fair queuing)
+    weight = Column(Integer, default=1, nullable=False)
+    # Requests per minute and tokens per UTC day; NULL uses the configured default, 0 is unlimited
+    rpm_limit = Column(Integer, nullable=True)
+    tokens_per_day_limit = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     last_used = Column(DateTime(timezone=True), nullable=True)
 
 class ApiRequestLog(Base):
     __tablename__ = "api_request_logs"
+    __table_args__ = (
+        Index("ix_api_request_logs_timestamp_api_key_id", "timestamp", "api_key_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    api_key_id = Column(Integer, ForeignKey("api_keys.id"))
+    # Logs outlive their key, so deleting a key only detaches them
+    api_key_id = Column(Integer, ForeignKey("api_keys.id", ondelete="SET NULL"))
     endpoint = Column(String)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now()) 
\ No newline at end of file
+    model = Column(String, nullable=True)
+    cache_hit = Column(Boolean, default=False)
+    # Backend base URL ("cache" for cache hits), response status and time to the last byte
+    backend = Column(String, nullable=True)
+    status_code = Column(Integer, nullable=True)
+    latency_ms = Column(Float, nullable=True)
+    # Token counts as reported to the client
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+class WebSession(Base):
+    """Server-side web UI session (SESSION_BACKEND=database), keyed by a hash of the cookie token"""
+    __tablename__ = "web_sessions"
+    token_hash = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class UsageRollup(Base):
+    """Request and token counts pre-aggregated per hour/day bucket, API key, model and endpoint
+    
+    Maintained incrementally by app.usage_writer so reports never scan api_request_logs.
+    """
+    __tablename__ = "usage_rollups"
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "api_key_id", "model", "endpoint", name="uq_usage_rollups_bucket"),
+        Index("ix_usage_rollups_api_key_id_bucket", "api_key_id", "granularity", "bucket_start"),
+        Index("ix_usage_rollups_bucket_model", "granularity", "bucket_start", "model"),
+    )
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String, nullable=False)  # "hour" or "day"
+    bucket_start = Column(DateTime, nullable=False)
+    # No foreign key: aggregates are kept for billing after a key is deleted
+    api_key_id = Column(Integer, nullable=False)
+    model = Column(String, nullable=False, default="")
+    endpoint = Column(String, nullable=False)
+    request_count = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    # Responses with a status of 400 or more
+    error_count = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    # Divide by request_count for the mean latency
+    latency_ms_total = Column(Float, nullable=False, default=0.0) 
+
+class BatchFile(Base):
+    """Uploaded batch input or generated output file; the content lives in BATCH_DIR/<id>.jsonl"""
+    __tablename__ = "batch_files"
+    id = Column(String, primary_key=True)
+    api_key_id = Column(Integer, nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    purpose = Column(String, nullable=False)  # "batch", "batch_output" or "batch_error"
+    bytes = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class BatchJob(Base):
+    """Offline batch of OpenAI-style requests processed in the background by app.batches"""
+    __tablename__ = "batch_jobs"
+    __table_args__ = (
+        Index("ix_batch_jobs_status_locked_until", "status", "locked_until"),
+    )
+    id = Column(String, primary_key=True)
+    api_key_id = Column(Integer, nullable=False, index=True)
+    endpoint = Column(String, nullable=False)
+    input_file_id = Column(String, nullable=False)
+    output_file_id = Column(String, nullable=True)
+    error_file_id = Column(String, nullable=True)
+    completion_window = Column(String, nullable=False)
+    # validating, failed, in_progress, finalizing, completed, expired, cancelling or cancelled
+    status = Column(String, nullable=False)
+    errors = Column(String, nullable=True)  # JSON list of validation errors
+    metadata_json = Column(String, nullable=True)
+    total = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    in_progress_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    cancelling_at = Column(DateTime(timezone=True), nullable=True)
+    # Lease of the worker processing the job; an expired lease lets another worker resume it
+    locked_by = Column(String, nullable=True)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
@@ -1,62 +1,619 @@
 import httpx
 from fastapi import HTTPException
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from app import config, metrics
+from app.scheduler import worker_share
+import asyncio
+import itertools
 import json
+import logging
+import math
+import re
+import time
 
-class OllamaProxy:
-    def __init__(self, base_url: str = "http://localhost:11434"):
+logger = logging.getLogger(__name__)
+
+def normalize_model_name(name: str):
+    """Ollama treats "llama2" and "llama2:latest" as the same model"""
+    if name and ":" not in name:
+        return f"{name}:latest"
+    return name
+
+def trace_connect():
+    """httpcore trace hook adding time spent opening new upstream connections to the request's "connect" phase"""
+    started = {}
+
+    async def trace(event_name: str, info: Dict[str, Any]):
+        step, _, stage = event_name.rpartition(".")
+        if step not in ("connection.connect_tcp", "connection.start_tls"):
+            return
+        if stage == "started":
+            started[step] = time.perf_counter()
+        elif step in started:
+            metrics.record_phase("connect", time.perf_counter() - started.pop(step))
+
+    return trace
+
+# Read timeout overrides with model keys normalized like request model names
+READ_TIMEOUTS = {
+    key if key.startswith("/") else normalize_model_name(key): value
+    for key, value in config.OLLAMA_READ_TIMEOUTS.items()
+}
+
+def upstream_timeout(endpoint: str, model: Optional[str] = None):
+    """Timeouts for one upstream call: the read timeout can be raised per model or endpoint"""
+    read = READ_TIMEOUTS.get(normalize_model_name(model)) if model else None
+    if read is None:
+        read = READ_TIMEOUTS.get(endpoint, config.OLLAMA_READ_TIMEOUT)
+    return httpx.Timeout(
+        connect=config.OLLAMA_CONNECT_TIMEOUT,
+        read=read,
+        write=config.OLLAMA_WRITE_TIMEOUT,
+        pool=config.OLLAMA_POOL_TIMEOUT,
+    )
+
+# keep_alive policies with model keys normalized like request model names;
+# hot models are pinned unless given their own policy
+KEEP_ALIVE = {
+    **{normalize_model_name(name): -1 for name in config.OLLAMA_PRELOAD_MODELS},
+    **{normalize_model_name(name): value for name, value in config.OLLAMA_KEEP_ALIVE.items()},
+}
+# Endpoints that load a model and so take a keep_alive
+KEEP_ALIVE_ENDPOINTS = {"/api/generate", "/api/chat", "/api/embed", "/api/embeddings"}
+# How long Ollama keeps a model loaded after a request without keep_alive
+DEFAULT_KEEP_ALIVE_SECONDS = 300
+
+def keep_alive_value(value):
+    """keep_alive as Ollama expects it: seconds as a number, or a duration string such as 10m"""
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+        return int(number) if number.is_integer() else number
+    return value
+
+def with_keep_alive(data: Optional[Dict[str, Any]], content, keep_alive):
+    """(data, content) with keep_alive set in the JSON body, whichever of the two carries it"""
+    keep_alive = keep_alive_value(keep_alive)
+    if isinstance(data, dict):
+        return {**data, "keep_alive": keep_alive}, content
+    if isinstance(content, bytes):
+        try:
+            payload = json.loads(content)
+        except ValueError:
+            return data, content
+        if isinstance(payload, dict):
+            return data, json.dumps({**payload, "keep_alive": keep_alive}).encode("utf-8")
+    return data, content
+
+def parse_ollama_timestamp(value: Optional[str]):
+    """Convert an Ollama RFC 3339 timestamp (nanosecond precision) to a Unix timestamp"""
+    if not value:
+        return 0
+    # datetime only handles microseconds, so trim the extra fractional digits
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return 0
+
+class OllamaBackend:
+    """One Ollama host with its own connection pool, health and load state"""
+
+    def __init__(self, base_url: str):
         self.base_url = base_url.rstrip('/')
-    
-    async def forward_request(self, method: str, endpoint: str, data: Dict[str, Any] = None, params: Dict[str, Any] = None):
-        """Forward request to Ollama API"""
-        url = f"{self.base_url}{endpoint}"
-        
-        async with httpx.AsyncClient() as client:
+        self._client: Optional[httpx.AsyncClient] = None
+        self.healthy = True
+        self.in_flight = 0
+        self.models = set()
+        self.last_checked = 0.0
+        self.last_error: Optional[str] = None
+        # Models held in memory -> Unix time they unload, from /api/ps; None while unknown
+        self.loaded: Optional[Dict[str, float]] = None
+
+    def _create_client(self):
+        """Create the pooled HTTP client used for every call to this backend"""
+        limits = httpx.Limits(
+            max_connections=config.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.OLLAMA_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            connect=config.OLLAMA_CONNECT_TIMEOUT,
+            read=config.OLLAMA_READ_TIMEOUT,
+            write=config.OLLAMA_WRITE_TIMEOUT,
+            pool=config.OLLAMA_POOL_TIMEOUT,
+        )
+        return httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared client, created on first use if the app lifespan has not opened it"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def has_model(self, model: str):
+        return normalize_model_name(model) in self.models
+
+    def is_loaded(self, model: str):
+        return self.loaded is not None and self.loaded.get(normalize_model_name(model), 0.0) > time.time()
+
+    def mark_loaded(self, model: Optional[str]):
+        """Record that a request just ran model here, until the next /api/ps poll says otherwise"""
+        if self.loaded is None or not model:
+            return
+        name = normalize_model_name(model)
+        keep_alive = KEEP_ALIVE.get(name)
+        try:
+            seconds = float(keep_alive) if keep_alive is not None else DEFAULT_KEEP_ALIVE_SECONDS
+        except ValueError:
+            # A duration string: the next poll reads the real expiry
+            seconds = DEFAULT_KEEP_ALIVE_SECONDS
+        expires_at = math.inf if seconds < 0 else time.time() + seconds
+        self.loaded[name] = max(self.loaded.get(name, 0.0), expires_at)
+
+    def mark_resident(self, models: List[Dict[str, Any]]):
+        """Replace the loaded models with an /api/ps listing"""
+        self.loaded = {
+            normalize_model_name(m.get("name") or m.get("model")): parse_ollama_timestamp(m.get("expires_at")) or math.inf
+            for m in models if m.get("name") or m.get("model")
+        }
+
+    def mark_healthy(self, models: List[Dict[str, Any]]):
+        if not self.healthy:
+            logger.warning("Ollama backend %s is back in rotation", self.base_url)
+        self.healthy = True
+        self.last_error = None
+        self.models = {normalize_model_name(m.get("name")) for m in models if m.get("name")}
+
+    def mark_failed(self, error: str):
+        """Eject the backend from rotation until a health probe succeeds again"""
+        if self.healthy:
+            logger.warning("Ejecting Ollama backend %s: %s", self.base_url, error)
+        self.healthy = False
+        self.last_error = error
+        # A restarted Ollama has nothing loaded; wait for the next poll
+        self.loaded = None
+
+class OllamaStream:
+    """NDJSON chunks of a streaming Ollama response
+
+    Iterating yields one decoded object per line. aclose() releases the
+    upstream connection and the backend's in-flight slot and runs any
+    on_close callbacks; it is idempotent, so it can be called both when
+    iteration ends and when the downstream response is torn down.
+    """
+
+    def __init__(self, backend: OllamaBackend, response: httpx.Response, endpoint: str = "", model: Optional[str] = None, started: Optional[float] = None):
+        self.backend = backend
+        self.response = response
+        self.endpoint = endpoint
+        self.model = model
+        self.started = started if started is not None else time.perf_counter()
+        self._closed = False
+        self._on_close = []
+
+    def on_close(self, callback):
+        self._on_close.append(callback)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        first = True
+        try:
+            async for line in self.response.aiter_lines():
+                if line.strip():
+                    chunk = json.loads(line)
+                    if first:
+                        first = False
+                        request_metrics = metrics.current_request.get()
+                        received = request_metrics.started if request_metrics is not None else self.started
+                        metrics.TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - received, endpoint=self.endpoint, model=self.model, backend=self.backend.base_url)
+                    if chunk.get("done"):
+                        metrics.observe_generation(self.model, self.backend.base_url, chunk)
+                        self.backend.mark_loaded(self.model)
+                        if chunk.get("load_duration"):
+                            metrics.record_phase("load", chunk["load_duration"] / 1e9)
+                    yield chunk
+        except httpx.TimeoutException as e:
+            raise HTTPException(status_code=504, detail=f"Ollama did not respond in time: {type(e).__name__}")
+        except httpx.RequestError as e:
+            raise HTTPException(status_code=503, detail=f"Ollama service unavailable: {str(e)}")
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail="Invalid JSON response from Ollama")
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.response.aclose()
+        finally:
+            self.backend.in_flight -= 1
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - self.started, endpoint=self.endpoint, model=self.model, backend=self.backend.base_url)
+            for callback in self._on_close:
+                callback()
+
+class OllamaRawStream(OllamaStream):
+    """Upstream response passed through byte for byte
+
+    Nothing is decoded on the way through. With track_usage set, only the
+    last NDJSON line is kept, and once the body ends it is decoded as
+    final_chunk (Ollama's closing chunk with its token counters).
+    """
+
+    # Give up on usage rather than buffer an unusually large single-line response
+    MAX_TAIL_BYTES = 1024 * 1024
+
+    def __init__(self, backend: OllamaBackend, response: httpx.Response, track_usage: bool = False, **kwargs):
+        super().__init__(backend, response, **kwargs)
+        self.track_usage = track_usage and "content-encoding" not in response.headers
+        self.final_chunk: Optional[Dict[str, Any]] = None
+
+    async def _iterate(self):
+        first = True
+        tail = b"" if self.track_usage else None
+        try:
+            async for data in self.response.aiter_raw():
+                if first:
+                    first = False
+                    request_metrics = metrics.current_request.get()
+                    received = request_metrics.started if request_metrics is not None else self.started
+                    metrics.TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - received, endpoint=self.endpoint, model=self.model, backend=self.backend.base_url)
+                if tail is not None:
+                    tail += data
+                    # Keep only the last non-empty line (with its newline, if it has one yet)
+                    tail = tail[tail.rfind(b"\n", 0, len(tail.rstrip(b"\r\n"))) + 1:]
+                    if len(tail) > self.MAX_TAIL_BYTES:
+                        tail = None
+                yield data
+            if tail and self.response.status_code == 200:
+                self._finish(tail)
+        finally:
+            await self.aclose()
+
+    def _finish(self, tail: bytes):
+        try:
+            chunk = json.loads(tail)
+        except ValueError:
+            return
+        # Generations end with a "done" chunk; embedding responses are a single object
+        if isinstance(chunk, dict) and (chunk.get("done") or "embeddings" in chunk or "embedding" in chunk):
+            self.final_chunk = chunk
+            metrics.observe_generation(self.model, self.backend.base_url, chunk)
+            metrics.count_tokens(chunk.get("prompt_eval_count", 0), chunk.get("eval_count", 0))
+            self.backend.mark_loaded(self.model)
+            if chunk.get("load_duration"):
+                metrics.record_phase("load", chunk["load_duration"] / 1e9)
+
+class OllamaProxy:
+    """Proxy for a pool of Ollama backends
+
+    Requests go to the healthy backend with the fewest in-flight requests
+    that has the requested model. Backends that fail to connect or fail a
+    periodic /api/tags probe are ejected, and re-admitted by a later probe.
+    """
+
+    def __init__(self, base_urls: Optional[List[str]] = None):
+        self.backends = [OllamaBackend(url) for url in (base_urls or config.OLLAMA_BASE_URLS)]
+        self._round_robin = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+        # Model catalogue cache: (response, status_code), refreshed by one shared task
+        self._models_cache = None
+        self._models_fetched_at = 0.0
+        self._models_refresh: Optional[asyncio.Task] = None
+        self._models_generation = 0
+
+    async def start(self):
+        """Open the connection pools and start health checking (called from the app lifespan)"""
+        await self.check_health()
+        if config.OLLAMA_HEALTH_CHECK_INTERVAL > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        """Stop health checking and close every connection pool"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for backend in self.backends:
+            await backend.close()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(config.OLLAMA_HEALTH_CHECK_INTERVAL)
+            try:
+                await self.check_health()
+            except Exception:
+                logger.exception("Ollama health check failed")
+
+    async def check_health(self):
+        """Probe every backend's /api/tags and refresh its health and model list"""
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+    async def _probe(self, backend: OllamaBackend):
+        backend.last_checked = time.time()
+        try:
+            response = await backend.client.get("/api/tags", timeout=config.OLLAMA_HEALTH_CHECK_TIMEOUT)
+            response.raise_for_status()
+            backend.mark_healthy(response.json().get("models", []))
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            backend.mark_failed(str(e) or type(e).__name__)
+
+    def routable_backends(self, model: Optional[str] = None, exclude: List[OllamaBackend] = ()):
+        """Backends a request for model may go to, preferring healthy ones that have it"""
+        candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            # Every backend is ejected: try them anyway rather than failing outright
+            candidates = [b for b in self.backends if b not in exclude]
+        if model:
+            with_model = [b for b in candidates if b.has_model(model)]
+            # Fall back to any healthy backend; it may still have been pulled since the last probe
+            candidates = with_model or candidates
+        return candidates
+
+    def select_backend(self, model: Optional[str] = None, exclude: List[OllamaBackend] = ()):
+        """Pick the least-loaded routable backend
+
+        Backends that already hold the model in memory are preferred until they
+        are running this process's share of SCHEDULER_BACKEND_CONCURRENCY
+        requests, so a request only pays for loading the model when every warm
+        backend is busy.
+        """
+        candidates = self.routable_backends(model, exclude)
+        if not candidates:
+            raise HTTPException(status_code=503, detail="Ollama service unavailable: no backend left to try")
+        if model:
+            limit = worker_share(config.SCHEDULER_BACKEND_CONCURRENCY)
+            warm = [b for b in candidates if b.is_loaded(model) and (limit <= 0 or b.in_flight < limit)]
+            candidates = warm or candidates
+        # Rotate the starting point so ties are spread across backends
+        offset = next(self._round_robin) % len(candidates)
+        candidates = candidates[offset:] + candidates[:offset]
+        return min(candidates, key=lambda b: b.in_flight)
+
+    async def _send(self, method: str, endpoint: str, data: Dict[str, Any] = None, params: Dict[str, Any] = None, stream: bool = False, backend: Optional[OllamaBackend] = None, content=None, headers: Optional[Dict[str, str]] = None, model: Optional[str] = None):
+        """Send a request, retrying on other backends when a connection cannot be made
+
+        Returns the backend and its response; the caller owns backend.in_flight,
+        which is incremented here. Raw bodies are sent as content, with model
+        given explicitly for routing.
+        """
+        model = model or self._request_model(data)
+        timeout = upstream_timeout(endpoint, model) if READ_TIMEOUTS else httpx.USE_CLIENT_DEFAULT
+        keep_alive = KEEP_ALIVE.get(normalize_model_name(model)) if model and endpoint in KEEP_ALIVE_ENDPOINTS else None
+        if keep_alive is not None:
+            data, content = with_keep_alive(data, content, keep_alive)
+        tried = []
+        while True:
+            target = backend or self.select_backend(model, exclude=tried)
+            request = target.client.build_request(method, endpoint, params=params, json=data, content=content, headers=headers, timeout=timeout)
+            request.extensions["trace"] = trace_connect()
+            target.in_flight += 1
+            sent = time.perf_counter()
             try:
-                if method.upper() == "GET":
-                    response = await client.get(url, params=params)
-                elif method.upper() == "POST":
-                    response = await client.post(url, json=data)
-                elif method.upper() == "DELETE":
-                    response = await client.delete(url)
-                else:
-                    raise HTTPException(status_code=405, detail="Method not allowed")
-                
-                return response.json(), response.status_code
-                
+                response = await target.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                target.in_flight -= 1
+                metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, backend=target.base_url, status="error")
+                target.mark_failed(str(e) or type(e).__name__)
+                tried.append(target)
+                if backend is not None or len(tried) == len(self.backends):
+                    raise HTTPException(status_code=503, detail=f"Ollama service unavailable: {str(e)}")
+            except httpx.TimeoutException as e:
+                target.in_flight -= 1
+                metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, backend=target.base_url, status="timeout")
+                raise HTTPException(status_code=504, detail=f"Ollama did not respond in time: {type(e).__name__}")
             except httpx.RequestError as e:
+                target.in_flight -= 1
+                metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, backend=target.base_url, status="error")
                 raise HTTPException(status_code=503, detail=f"Ollama service unavailable: {str(e)}")
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail="Invalid JSON response from Ollama")
-    
+            except asyncio.CancelledError:
+                # The caller went away (e.g. client disconnect): the connection is dropped, freeing the backend
+                target.in_flight -= 1
+                metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, backend=target.base_url, status="cancelled")
+                raise
+            metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, backend=target.base_url, status=response.status_code)
+            if backend is None and model and endpoint in KEEP_ALIVE_ENDPOINTS and target.loaded is not None and not target.is_loaded(model):
+                metrics.COLD_STARTS.inc(model=model, backend=target.base_url)
+            metrics.tag_request(backend=target.base_url)
+            metrics.record_phase("upstream", time.perf_counter() - sent)
+            return target, response
+
+    @staticmethod
+    def _request_model(data: Optional[Dict[str, Any]]):
+        return (data.get("model") or data.get("name")) if isinstance(data, dict) else None
+
+    async def forward_request(self, method: str, endpoint: str, data: Dict[str, Any] = None, params: Dict[str, Any] = None, backend: Optional[OllamaBackend] = None):
+        """Forward request to Ollama API"""
+        method = method.upper()
+        if method not in ("GET", "POST", "DELETE"):
+            raise HTTPException(status_code=405, detail="Method not allowed")
+
+        started = time.perf_counter()
+        target, response = await self._send(method, endpoint, data=data, params=params, backend=backend)
+        model = self._request_model(data)
+        try:
+            # Some endpoints (e.g. DELETE /api/delete) answer success with an empty body
+            result = {} if response.is_success and not response.content else response.json()
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail="Invalid JSON response from Ollama")
+        finally:
+            target.in_flight -= 1
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, model=model, backend=target.base_url)
+        if response.status_code == 200 and isinstance(result, dict):
+            metrics.observe_generation(model, target.base_url, result)
+            if endpoint in KEEP_ALIVE_ENDPOINTS:
+                target.mark_loaded(model)
+            if result.get("load_duration"):
+                metrics.record_phase("load", result["load_duration"] / 1e9)
+        return result, response.status_code
+
+    async def stream_request(self, method: str, endpoint: str, data: Dict[str, Any] = None):
+        """Open a streaming request to Ollama and return an iterator over its NDJSON chunks
+
+        The upstream status is checked before returning, so connection and HTTP
+        errors still surface as HTTPException before any response is sent.
+        """
+        started = time.perf_counter()
+        target, response = await self._send(method.upper(), endpoint, data=data, stream=True)
+
+        if response.is_error:
+            try:
+                await response.aread()
+                detail = response.json().get("error", response.text)
+            except (httpx.HTTPError, json.JSONDecodeError, AttributeError):
+                detail = response.text
+            finally:
+                await response.aclose()
+                target.in_flight -= 1
+            raise HTTPException(status_code=response.status_code, detail=detail)
+
+        return OllamaStream(target, response, endpoint=endpoint, model=self._request_model(data), started=started)
+
+    async def stream_raw(self, method: str, endpoint: str, content=None, params: Dict[str, Any] = None, headers: Optional[Dict[str, str]] = None, model: Optional[str] = None, track_usage: bool = False):
+        """Open a request whose body and response are passed through as raw bytes
+
+        Unlike stream_request, upstream error statuses are returned as they are.
+        """
+        started = time.perf_counter()
+        target, response = await self._send(method.upper(), endpoint, params=params, stream=True, content=content, headers=headers, model=model)
+        return OllamaRawStream(target, response, track_usage=track_usage, endpoint=endpoint, model=model, started=started)
+
     async def list_models(self):
-        """List available models"""
-        return await self.forward_request("GET", "/api/tags")
-    
+        """List available models, cached with stale-while-revalidate
+
+        Within MODELS_CACHE_TTL the cached catalogue is returned as is. Up to
+        MODELS_CACHE_STALE_TTL it is still returned while one background fetch
+        refreshes it. Concurrent misses all wait on that same fetch.
+        """
+        if self._models_cache is not None:
+            age = time.monotonic() - self._models_fetched_at
+            if age < config.MODELS_CACHE_TTL:
+                return self._models_cache
+            if age < config.MODELS_CACHE_STALE_TTL:
+                self._refresh_models()
+                return self._models_cache
+        # Shield so a caller that goes away does not cancel the fetch others are waiting on
+        return await asyncio.shield(self._refresh_models())
+
+    def invalidate_models(self):
+        """Drop the cached catalogue after a model is pulled, created or deleted"""
+        self._models_generation += 1
+        self._models_cache = None
+        self._models_refresh = None
+
+    def _refresh_models(self):
+        if self._models_refresh is None or self._models_refresh.done():
+            self._models_refresh = asyncio.create_task(self._fetch_and_cache_models())
+            self._models_refresh.add_done_callback(self._log_refresh_error)
+        return self._models_refresh
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Model catalogue refresh failed: %s", task.exception())
+
+    async def _fetch_and_cache_models(self):
+        generation = self._models_generation
+        result = await self.fetch_models()
+        # A model change while the fetch was in flight makes its result stale
+        if generation == self._models_generation:
+            self._models_cache = result
+            self._models_fetched_at = time.monotonic()
+        return result
+
+    async def fetch_models(self):
+        """List available models across all healthy backends"""
+        backends = [b for b in self.backends if b.healthy] or self.backends
+        results = await asyncio.gather(
+            *(self.forward_request("GET", "/api/tags", backend=b) for b in backends),
+            return_exceptions=True
+        )
+
+        models = {}
+        status_code = None
+        for backend, result in zip(backends, results):
+            if isinstance(result, Exception):
+                continue
+            response, status_code = result
+            backend_models = response.get("models", [])
+            backend.mark_healthy(backend_models)
+            for m in backend_models:
+                name = m.get("name")
+                if name not in models or m.get("modified_at", "") > models[name].get("modified_at", ""):
+                    models[name] = m
+        if status_code is None:
+            raise next(r for r in results if isinstance(r, Exception))
+        return {"models": list(models.values())}, status_code
+
     async def generate(self, data: Dict[str, Any]):
         """Generate text using a model"""
         return await self.forward_request("POST", "/api/generate", data=data)
-    
+
     async def chat(self, data: Dict[str, Any]):
         """Chat with a model"""
         return await self.forward_request("POST", "/api/chat", data=data)
-    
+
+    async def generate_stream(self, data: Dict[str, Any]):
+        """Generate text using a model, streaming the NDJSON chunks"""
+        return await self.stream_request("POST", "/api/generate", data={**data, "stream": True})
+
+    async def chat_stream(self, data: Dict[str, Any]):
+        """Chat with a model, streaming the NDJSON chunks"""
+        return await self.stream_request("POST", "/api/chat", data={**data, "stream": True})
+
+    async def embed(self, data: Dict[str, Any]):
+        """Generate embeddings for one or more inputs"""
+        return await self.forward_request("POST", "/api/embed", data=data)
+
     async def pull_model(self, data: Dict[str, Any]):
         """Pull a model"""
-        return await self.forward_request("POST", "/api/pull", data=data)
-    
+        try:
+            return await self.forward_request("POST", "/api/pull", data=data)
+        finally:
+            self.invalidate_models()
+
     async def push_model(self, data: Dict[str, Any]):
         """Push a model"""
         return await self.forward_request("POST", "/api/push", data=data)
-    
+
     async def create_model(self, data: Dict[str, Any]):
         """Create a model"""
-        return await self.forward_request("POST", "/api/create", data=data)
-    
+        try:
+            return await self.forward_request("POST", "/api/create", data=data)
+        finally:
+            self.invalidate_models()
+
     async def delete_model(self, name: str):
-        """Delete a model"""
-        return await self.forward_request("DELETE", f"/api/delete", data={"name": name})
-    
+        """Delete a model from every healthy backend that has it"""
+        try:
+            backends = [b for b in self.backends if b.healthy and b.has_model(name)]
+            if not backends:
+                return await self.forward_request("DELETE", "/api/delete", data={"name": name})
+            results = [await self.forward_request("DELETE", "/api/delete", data={"name": name}, backend=b) for b in backends]
+            for backend, (_, status_code) in zip(backends, results):
+                if status_code < 300:
+                    backend.models.discard(normalize_model_name(name))
+            # Report the first failure, if any backend kept the model
+            return next((result for result in results if result[1] >= 300), results[0])
+        finally:
+            self.invalidate_models()
+
     async def show_model(self, data: Dict[str, Any]):
         """Show model information"""
-        return await self.forward_request("POST", "/api/show", data=data) 
\ No newline at end of file
+        return await self.forward_request("POST", "/api/show", data=data)
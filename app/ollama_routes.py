@@ -0,0 +1,97 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse
+from typing import Optional
+from app.api_routes import (
+    ollama_proxy,
+    log_api_request,
+    verify_bearer_token_dependency,
+    open_ollama_stream,
+    cancel_on_disconnect,
+    client_closed_request,
+    UpstreamStreamingResponse,
+)
+import json
+
+router = APIRouter(tags=["ollama"])
+
+# Endpoints that run a model: admitted through the scheduler, usage read from the final chunk
+MODEL_ENDPOINTS = {"/api/generate", "/api/chat", "/api/embed", "/api/embeddings"}
+# Endpoints that change which models exist, so the cached catalogue must be refreshed
+CATALOGUE_ENDPOINTS = {"/api/pull", "/api/create", "/api/copy"}
+
+# Hop-by-hop headers, plus the middleware's own credentials, are never forwarded
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade"}
+REQUEST_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {"host", "content-length", "authorization", "cookie"}
+# uvicorn sets its own date and server, and the re-streamed body is sent chunked
+RESPONSE_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {"date", "server", "content-length"}
+
+def request_model(body: bytes) -> Optional[str]:
+    """Model named in a JSON request body, used to route it to a backend that has the model"""
+    if not body:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    return payload.get("model") or payload.get("name") or payload.get("source")
+
+# Model list merged across every backend
+@router.get("/api/tags")
+async def ollama_tags(api_key_obj = Depends(verify_bearer_token_dependency)):
+    log_api_request(api_key_obj, "/api/tags")
+    ollama_response, status_code = await ollama_proxy.list_models()
+    return JSONResponse(content=ollama_response, status_code=status_code)
+
+# Deletes the model from every backend that has it
+@router.delete("/api/delete")
+async def ollama_delete(request: Request, api_key_obj = Depends(verify_bearer_token_dependency)):
+    name = request_model(await request.body())
+    log_api_request(api_key_obj, "/api/delete", model=name)
+    ollama_response, status_code = await ollama_proxy.delete_model(name)
+    return JSONResponse(content=ollama_response, status_code=status_code)
+
+# Everything else is passed through as raw bytes in both directions
+@router.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "HEAD"])
+async def ollama_passthrough(path: str, request: Request, api_key_obj = Depends(verify_bearer_token_dependency)):
+    endpoint = f"/api/{path}"
+    headers = {name: value for name, value in request.headers.items() if name not in REQUEST_SKIP_HEADERS}
+    if endpoint.startswith("/api/blobs/"):
+        # Model blobs can be gigabytes: stream the upload without buffering it
+        content, model = request.stream(), None
+    else:
+        content = await request.body()
+        model = request_model(content)
+    log_api_request(api_key_obj, endpoint, model=model)
+
+    async def open_raw(_):
+        return await ollama_proxy.stream_raw(
+            request.method, endpoint,
+            content=content,
+            params=request.query_params.multi_items(),
+            headers=headers,
+            model=model,
+            track_usage=endpoint in MODEL_ENDPOINTS,
+        )
+
+    if endpoint in MODEL_ENDPOINTS:
+        # A non-streaming generate only answers once the whole generation is done
+        upstream = await cancel_on_disconnect(request, open_ollama_stream(open_raw, {"model": model}, api_key_obj))
+        if upstream is None:
+            return client_closed_request(request, model)
+    else:
+        upstream = await open_raw(None)
+    if endpoint in CATALOGUE_ENDPOINTS:
+        upstream.on_close(ollama_proxy.invalidate_models)
+
+    response_headers = {
+        name: value for name, value in upstream.response.headers.items()
+        if name not in RESPONSE_SKIP_HEADERS
+    }
+    return UpstreamStreamingResponse(
+        upstream,
+        upstream=upstream,
+        status_code=upstream.response.status_code,
+        headers=response_headers
+    )
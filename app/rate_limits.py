@@ -0,0 +1,207 @@
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import func, select
+from app import config, metrics
+from app.database import SessionLocal
+from app.models import UsageRollup
+from app.usage_writer import usage_writer, bucket_start
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Headers for the current response, filled in by RateLimiter.check()
+_response_headers: ContextVar[Optional[Dict[str, str]]] = ContextVar("rate_limit_headers", default=None)
+
+def _format_reset(seconds: float):
+    """Duration until a limit resets, in the "1.5s" form OpenAI's headers use"""
+    return f"{round(max(seconds, 0.0), 3):g}s"
+
+class RateLimiter:
+    """Per-key requests per minute (token buckets) and tokens per UTC day, held in memory
+
+    Checking a request costs a few dictionary lookups whatever the number of
+    keys; nothing is read from the database on the request path. Token usage
+    is added locally as responses finish, and a background task reloads each
+    key's tokens for the current day from the daily usage rollups, which every
+    worker writes, so quotas hold across workers and restarts to within one
+    sync interval. Request rates are not shared: each worker process admits
+    1/workers of a key's requests per minute, so together they never exceed
+    it (a limit below the worker count still lets each worker admit
+    one request before its bucket refills).
+    """
+
+    def __init__(
+        self,
+        default_rpm: int = config.RATE_LIMIT_RPM,
+        default_tokens_per_day: int = config.RATE_LIMIT_TOKENS_PER_DAY,
+        sync_interval: float = config.RATE_LIMIT_SYNC_INTERVAL,
+        workers: int = config.WORKER_PROCESSES,
+    ):
+        self.default_rpm = default_rpm
+        self.default_tokens_per_day = default_tokens_per_day
+        self.sync_interval = sync_interval
+        self.workers = max(workers, 1)
+        # api_key_id -> [available requests, monotonic time of the last refill]
+        self._buckets: Dict[int, list] = {}
+        # Tokens used today per key: as of the last sync, and added locally since
+        self._day = self._today()
+        self._tokens_synced: Dict[int, int] = {}
+        self._tokens_local: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _today():
+        return int(time.time() // 86400)
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._tokens_synced = {}
+            self._tokens_local = {}
+
+    def tokens_used(self, api_key_id: int):
+        """Tokens the key has used in the current UTC day"""
+        self._roll_day()
+        return self._tokens_synced.get(api_key_id, 0) + self._tokens_local.get(api_key_id, 0)
+
+    def check(self, api_key):
+        """Admit one request for api_key or raise a 429; sets the x-ratelimit-* response headers"""
+        headers = {}
+        tokens_per_day = self.default_tokens_per_day if api_key.tokens_per_day_limit is None else api_key.tokens_per_day_limit
+        if tokens_per_day > 0:
+            remaining = max(tokens_per_day - self.tokens_used(api_key.id), 0)
+            reset = 86400 - time.time() % 86400
+            headers["x-ratelimit-limit-tokens"] = str(tokens_per_day)
+            headers["x-ratelimit-remaining-tokens"] = str(remaining)
+            headers["x-ratelimit-reset-tokens"] = _format_reset(reset)
+            if remaining <= 0:
+                self._reject("tokens", "Daily token quota exceeded", reset, headers)
+
+        rpm = self.default_rpm if api_key.rpm_limit is None else api_key.rpm_limit
+        if rpm > 0:
+            # This worker's share of the limit, in requests per minute
+            rate = rpm / self.workers
+            capacity = max(rate, 1.0)
+            now = time.monotonic()
+            bucket = self._buckets.get(api_key.id)
+            if bucket is None:
+                bucket = self._buckets[api_key.id] = [capacity, now]
+            available = min(capacity, bucket[0] + (now - bucket[1]) * rate / 60.0)
+            bucket[1] = now
+            headers["x-ratelimit-limit-requests"] = str(rpm)
+            if available < 1.0:
+                bucket[0] = available
+                headers["x-ratelimit-remaining-requests"] = "0"
+                headers["x-ratelimit-reset-requests"] = _format_reset((capacity - available) * 60.0 / rate)
+                self._reject("requests", "Rate limit exceeded", (1.0 - available) * 60.0 / rate, headers)
+            bucket[0] = available - 1.0
+            # Estimated for all workers from this one's share
+            headers["x-ratelimit-remaining-requests"] = str(min(int(bucket[0] * self.workers), rpm))
+            headers["x-ratelimit-reset-requests"] = _format_reset((capacity - bucket[0]) * 60.0 / rate)
+
+        response_headers = _response_headers.get()
+        if response_headers is not None:
+            response_headers.update(headers)
+
+    @staticmethod
+    def _reject(limit: str, detail: str, retry_after: float, headers: Dict[str, str]):
+        metrics.RATE_LIMITED.inc(limit=limit)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={**headers, "Retry-After": str(max(math.ceil(retry_after), 1))},
+        )
+
+    def add_tokens(self, api_key_id: int, tokens: int):
+        """Count tokens a finished response used against the key's daily quota"""
+        if tokens:
+            self._roll_day()
+            self._tokens_local[api_key_id] = self._tokens_local.get(api_key_id, 0) + tokens
+
+    async def sync(self):
+        """Reload today's token usage per key from the daily usage rollups"""
+        day = self._day
+        counted = dict(self._tokens_local)
+        # Write out this worker's queued usage first so the reload includes it
+        await usage_writer.flush()
+        today = bucket_start(datetime.now(timezone.utc), "day")
+        async with SessionLocal() as db:
+            rows = await db.execute(
+                select(UsageRollup.api_key_id, func.sum(UsageRollup.prompt_tokens + UsageRollup.completion_tokens))
+                .where(UsageRollup.granularity == "day", UsageRollup.bucket_start == today)
+                .group_by(UsageRollup.api_key_id)
+            )
+            synced = {api_key_id: int(tokens or 0) for api_key_id, tokens in rows}
+        self._roll_day()
+        if day != self._day:
+            return
+        self._tokens_synced = synced
+        # Tokens added while the reload ran are not in it yet
+        for api_key_id, tokens in counted.items():
+            remaining = self._tokens_local.get(api_key_id, 0) - tokens
+            if remaining > 0:
+                self._tokens_local[api_key_id] = remaining
+            else:
+                self._tokens_local.pop(api_key_id, None)
+
+    async def start(self):
+        try:
+            await self.sync()
+        except Exception:
+            logger.exception("Failed to load today's token usage")
+        if self.sync_interval > 0:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Token usage sync failed")
+
+class RateLimitHeadersMiddleware:
+    """ASGI middleware adding the x-ratelimit-* headers set by RateLimiter.check() to the response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers: Dict[str, str] = {}
+        token = _response_headers.set(headers)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and headers:
+                present = {name.lower() for name, _ in message.get("headers", ())}
+                extra = [
+                    (name.encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers.items() if name.encode("latin-1") not in present
+                ]
+                message = {**message, "headers": [*message.get("headers", ()), *extra]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _response_headers.reset(token)
+
+rate_limiter = RateLimiter()
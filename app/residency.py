@@ -0,0 +1,112 @@
+from fastapi import HTTPException
+from typing import Dict, List, Optional, Tuple
+from app import config
+from app.ollama_proxy import OllamaBackend, OllamaProxy, normalize_model_name
+import asyncio
+import httpx
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between load attempts of one model on one backend, so hot
+# models that do not fit in memory together do not keep evicting each other
+PRELOAD_RETRY_SECONDS = 60.0
+
+class ResidencyManager:
+    """Tracks which models each Ollama backend holds in memory and keeps hot models loaded
+
+    Every poll_interval seconds each healthy backend's /api/ps is read into
+    backend.loaded, which OllamaProxy.select_backend uses to prefer backends
+    that already hold the requested model. Hot models are loaded on every
+    backend that has them pulled, at startup and again whenever a poll finds
+    one gone (e.g. after Ollama restarted); their keep_alive policy pins them.
+    """
+
+    def __init__(
+        self,
+        proxy: OllamaProxy,
+        hot_models: List[str] = config.OLLAMA_PRELOAD_MODELS,
+        poll_interval: float = config.OLLAMA_PS_POLL_INTERVAL,
+    ):
+        self.proxy = proxy
+        self.hot_models = [normalize_model_name(name) for name in hot_models]
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        # (backend URL, model) -> running load, and monotonic time of the last attempt
+        self._preloads: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._attempted: Dict[Tuple[str, str], float] = {}
+
+    async def start(self):
+        """Start polling and loading hot models in the background (called from the app lifespan)"""
+        if self.poll_interval > 0 or self.hot_models:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, *self._preloads.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._preloads = {}
+
+    async def _run(self):
+        while True:
+            try:
+                if self.poll_interval > 0:
+                    await self.poll()
+                self.ensure_hot_models()
+            except Exception:
+                logger.exception("Model residency check failed")
+            if self.poll_interval <= 0:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        """Read every healthy backend's loaded models from /api/ps"""
+        await asyncio.gather(*(self._poll(backend) for backend in self.proxy.backends if backend.healthy))
+
+    async def _poll(self, backend: OllamaBackend):
+        try:
+            response = await backend.client.get("/api/ps", timeout=config.OLLAMA_HEALTH_CHECK_TIMEOUT)
+            response.raise_for_status()
+            backend.mark_resident(response.json().get("models") or [])
+        except (httpx.HTTPError, json.JSONDecodeError, AttributeError) as e:
+            # Unknown residency (e.g. an Ollama without /api/ps) just turns the routing preference off
+            logger.debug("Could not read loaded models from %s: %s", backend.base_url, e)
+            backend.loaded = None
+
+    def ensure_hot_models(self):
+        """Start loading each hot model on every healthy backend that has it but not in memory"""
+        now = time.monotonic()
+        for backend in self.proxy.backends:
+            if not backend.healthy:
+                continue
+            for model in self.hot_models:
+                key = (backend.base_url, model)
+                if not backend.has_model(model) or backend.is_loaded(model) or key in self._preloads:
+                    continue
+                if now - self._attempted.get(key, -PRELOAD_RETRY_SECONDS) < PRELOAD_RETRY_SECONDS:
+                    continue
+                self._attempted[key] = now
+                self._preloads[key] = asyncio.create_task(self.preload(backend, model))
+                self._preloads[key].add_done_callback(lambda _, key=key: self._preloads.pop(key, None))
+
+    async def preload(self, backend: OllamaBackend, model: str):
+        """Load model into backend's memory; its keep_alive policy is added to the request"""
+        started = time.perf_counter()
+        try:
+            # A generate call without a prompt only loads the model
+            response, status_code = await self.proxy.forward_request("POST", "/api/generate", data={"model": model, "stream": False}, backend=backend)
+            if status_code == 400:
+                # Embedding models cannot generate; an embed call with no input loads them too
+                response, status_code = await self.proxy.forward_request("POST", "/api/embed", data={"model": model, "input": []}, backend=backend)
+        except HTTPException as e:
+            logger.warning("Failed to load %s on %s: %s", model, backend.base_url, e.detail)
+            return
+        if status_code != 200:
+            logger.warning("Failed to load %s on %s: %s", model, backend.base_url, response.get("error", status_code))
+            return
+        backend.mark_loaded(model)
+        logger.info("Loaded %s on %s in %.1fs", model, backend.base_url, time.perf_counter() - started)
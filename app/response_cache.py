@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from starlette.concurrency import run_in_threadpool
+from app import config
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Temporary files older than this are left over from writes that never finished
+STALE_TEMP_SECONDS = 3600.0
+
+def canonical_request_key(endpoint: str, payload: Dict[str, Any]):
+    """Stable hash of an upstream request: same model, prompt/messages and options give the same key"""
+    canonical = json.dumps([endpoint, payload], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def is_deterministic(payload: Dict[str, Any]):
+    """Only greedy (temperature 0) generations are safe to replay"""
+    temperature = (payload.get("options") or {}).get("temperature")
+    try:
+        return temperature is not None and float(temperature) == 0.0
+    except (TypeError, ValueError):
+        return False
+
+class ResponseCache:
+    """LRU cache of Ollama responses, bounded by entry count and total bytes
+
+    With disk_dir set, entries are also written to disk (one JSON file per
+    key) and memory misses fall back to that tier, so the cache survives
+    restarts and is shared between worker processes on the same host. The
+    disk tier has caps of its own, enforced by a periodic sweep that also
+    deletes expired entries nobody reads any more.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = config.RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = config.RESPONSE_CACHE_MAX_BYTES,
+        ttl: float = config.RESPONSE_CACHE_TTL,
+        disk_dir: Optional[str] = config.RESPONSE_CACHE_DIR,
+        disk_max_entries: int = config.RESPONSE_CACHE_DISK_MAX_ENTRIES,
+        disk_max_bytes: int = config.RESPONSE_CACHE_DISK_MAX_BYTES,
+        sweep_interval: float = config.RESPONSE_CACHE_SWEEP_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _expired(self, stored_at: float):
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, stored_at = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    return json.loads(body)
+                self._remove(key)
+        if self.disk_dir:
+            return await run_in_threadpool(self._read_disk, key)
+        return None
+
+    async def put(self, key: str, response: Dict[str, Any]):
+        body = json.dumps(response, separators=(",", ":")).encode("utf-8")
+        stored_at = time.time()
+        self._store(key, body, stored_at)
+        if self.disk_dir:
+            await run_in_threadpool(self._write_disk, key, body)
+
+    def _store(self, key: str, body: bytes, stored_at: float):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (body, stored_at)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    def _disk_path(self, key: str):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str):
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.exception("Failed to read response cache entry %s", key)
+            return None
+        self._store(key, body, stored_at)
+        return json.loads(body)
+
+    def _write_disk(self, key: str, body: bytes):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Failed to write response cache entry %s", key)
+
+    def sweep(self):
+        """Delete expired disk entries, then the oldest ones while the disk tier is over its caps
+
+        Returns the number of files deleted. Sweeps of several workers sharing
+        disk_dir may overlap; a file one of them already deleted is skipped.
+        """
+        now = time.time()
+        removed = 0
+        entries = []
+        for subdir in os.scandir(self.disk_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".json"):
+                    if not self._expired(stat.st_mtime):
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        continue
+                elif now - stat.st_mtime < STALE_TEMP_SECONDS:
+                    continue
+                removed += self._unlink(entry.path)
+
+        entries.sort()
+        count, size = len(entries), sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if count <= self.disk_max_entries and size <= self.disk_max_bytes:
+                break
+            removed += self._unlink(path)
+            count -= 1
+            size -= entry_size
+        return removed
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+        except OSError:
+            logger.exception("Failed to delete response cache file %s", path)
+            return 0
+
+    async def start(self):
+        """Start sweeping the disk tier in the background (called from the app lifespan)"""
+        if self.disk_dir and self.sweep_interval > 0:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                removed = await run_in_threadpool(self.sweep)
+                if removed:
+                    logger.info("Deleted %d response cache files from %s", removed, self.disk_dir)
+            except Exception:
+                logger.exception("Response cache sweep failed")
+            await asyncio.sleep(self.sweep_interval)
+
+response_cache = ResponseCache() if config.RESPONSE_CACHE_ENABLED else None
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from typing import Callable, Dict, List, Optional
+from app import config, metrics
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+def worker_share(limit: int, workers: int = config.WORKER_PROCESSES):
+    """This process's part of a concurrency limit meant for all worker processes together
+
+    0 (unlimited) stays unlimited. Every process gets at least 1, so a limit
+    below the number of workers is exceeded up to one request per process.
+    """
+    if limit <= 0:
+        return limit
+    return max(limit // max(workers, 1), 1)
+
+class _Waiter:
+    __slots__ = ("model", "start_tag", "future")
+
+    def __init__(self, model: str, start_tag: float, future: asyncio.Future):
+        self.model = model
+        self.start_tag = start_tag
+        self.future = future
+
+class AdmissionScheduler:
+    """Admission control in front of OllamaProxy
+
+    A request runs once its model is below model_concurrency and the
+    backends that can serve it are below backend_concurrency each (counted
+    in aggregate, since the proxy picks the concrete backend afterwards).
+    Otherwise it waits in a per-model queue ordered by weighted fair queuing
+    tags, so an API key with weight 4 is admitted four times as often as a
+    weight 1 key while both have requests waiting. Requests are shed with
+    429 and Retry-After when max_queue requests are already waiting, or
+    when one waits longer than queue_timeout seconds.
+
+    Background requests (batch jobs) are never shed; they only take a slot
+    while no interactive request is waiting for one. Both concurrency limits
+    are for all worker processes together; each process enforces its share.
+    """
+
+    def __init__(
+        self,
+        backend_count: Callable[[Optional[str]], int],
+        backend_concurrency: int = config.SCHEDULER_BACKEND_CONCURRENCY,
+        model_concurrency: int = config.SCHEDULER_MODEL_CONCURRENCY,
+        max_queue: int = config.SCHEDULER_MAX_QUEUE,
+        queue_timeout: float = config.SCHEDULER_QUEUE_TIMEOUT,
+        workers: int = config.WORKER_PROCESSES,
+    ):
+        self.backend_count = backend_count
+        self.backend_concurrency = worker_share(backend_concurrency, workers)
+        self.model_concurrency = worker_share(model_concurrency, workers)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running: Dict[str, int] = defaultdict(int)
+        self.total_running = 0
+        self.queued = 0
+        self._queues: Dict[str, List] = defaultdict(list)
+        self._virtual_time = 0.0
+        self._last_finish: Dict[int, float] = {}
+        self._sequence = itertools.count()
+        # (model, future) of background requests, first come first served
+        self._background: List = []
+        # Moving average of how long a slot is held, used for Retry-After
+        self._avg_hold = 1.0
+
+    def _model_capacity(self, model: str):
+        capacity = math.inf
+        if self.backend_concurrency > 0:
+            capacity = self.backend_concurrency * max(self.backend_count(model or None), 1)
+        if self.model_concurrency > 0:
+            capacity = min(capacity, self.model_concurrency)
+        return capacity
+
+    def _has_room(self, model: str):
+        if self.backend_concurrency > 0:
+            if self.total_running >= self.backend_concurrency * max(self.backend_count(None), 1):
+                return False
+        return self.running[model] < self._model_capacity(model)
+
+    def _admit(self, model: str):
+        self.running[model] += 1
+        self.total_running += 1
+
+    def _retry_after(self, model: str):
+        capacity = self._model_capacity(model)
+        if capacity == math.inf:
+            return 1
+        return max(1, math.ceil((self.queued + 1) / capacity * self._avg_hold))
+
+    def _shed(self, model: str, reason: str, detail: str):
+        metrics.SCHEDULER_REJECTED.inc(model=model, reason=reason)
+        return HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(self._retry_after(model))},
+        )
+
+    async def acquire(self, model: Optional[str], api_key_id: int, weight: int = 1):
+        """Wait for a slot; returns the time spent queued in seconds"""
+        model = model or ""
+        queue = self._queues[model]
+        if not queue and self._has_room(model):
+            self._admit(model)
+            metrics.QUEUE_WAIT.observe(0.0, model=model)
+            metrics.record_phase("queue", 0.0)
+            return 0.0
+        if self.queued >= self.max_queue:
+            raise self._shed(model, "queue_full", "Server is overloaded, please retry later")
+
+        # Start-time fair queuing: each key's tags advance by 1/weight per request
+        start_tag = max(self._virtual_time, self._last_finish.get(api_key_id, 0.0))
+        self._last_finish[api_key_id] = start_tag + 1.0 / max(weight or 1, 1)
+        waiter = _Waiter(model, start_tag, asyncio.get_running_loop().create_future())
+        heapq.heappush(queue, (start_tag, next(self._sequence), waiter))
+        self.queued += 1
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self.queued -= 1
+                raise self._shed(model, "timeout", "Timed out waiting for a free model slot")
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                # Admitted just as the caller went away: hand the slot on
+                self.release(model)
+            else:
+                waiter.future.cancel()
+                self.queued -= 1
+            raise
+        waited = time.monotonic() - queued_at
+        metrics.QUEUE_WAIT.observe(waited, model=model)
+        metrics.record_phase("queue", waited)
+        return waited
+
+    async def acquire_background(self, model: Optional[str]):
+        """Wait for a slot that no interactive request is waiting for"""
+        model = model or ""
+        if not self.queued and not self._background and self._has_room(model):
+            self._admit(model)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._background.append((model, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(model)
+            else:
+                future.cancel()
+            raise
+
+    def release(self, model: Optional[str], held_for: Optional[float] = None):
+        model = model or ""
+        self.running[model] -= 1
+        self.total_running -= 1
+        if held_for is not None:
+            self._avg_hold += 0.1 * (held_for - self._avg_hold)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit queued requests, lowest start tag first, while their models have room"""
+        while True:
+            best = None
+            for model, queue in self._queues.items():
+                while queue and queue[0][2].future.done():
+                    heapq.heappop(queue)
+                if queue and self._has_room(model) and (best is None or queue[0] < best[0]):
+                    best = (queue[0], model)
+            if best is None:
+                break
+            (_, _, waiter), model = best
+            heapq.heappop(self._queues[model])
+            self.queued -= 1
+            self._virtual_time = waiter.start_tag
+            self._admit(model)
+            waiter.future.set_result(None)
+        if self._background and not self.queued:
+            waiting = []
+            for model, future in self._background:
+                if future.done():
+                    continue
+                if not self.queued and self._has_room(model):
+                    self._admit(model)
+                    future.set_result(None)
+                else:
+                    waiting.append((model, future))
+            self._background = waiting
+        if len(self._last_finish) > 10000:
+            self._last_finish = {k: v for k, v in self._last_finish.items() if v > self._virtual_time}
+
+    @asynccontextmanager
+    async def slot(self, model: Optional[str], api_key_id: int, weight: int = 1):
+        await self.acquire(model, api_key_id, weight)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(model, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def background_slot(self, model: Optional[str]):
+        await self.acquire_background(model)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(model, time.monotonic() - started)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class UserBase(BaseModel):
     username: str
@@ -20,12 +20,24 @@ class ApiKeyBase(BaseModel):
     key_name: str
 
 class ApiKeyCreate(ApiKeyBase):
-    pass
+    weight: int = Field(default=1, ge=1)
+    rpm_limit: Optional[int] = Field(default=None, ge=0)
+    tokens_per_day_limit: Optional[int] = Field(default=None, ge=0)
+
+class ApiKeyUpdate(BaseModel):
+    """Changes to an API key: fields left out are kept, and a null limit falls back to the default"""
+    is_active: bool = True
+    weight: int = Field(default=1, ge=1)
+    rpm_limit: Optional[int] = Field(default=None, ge=0)
+    tokens_per_day_limit: Optional[int] = Field(default=None, ge=0)
 
 class ApiKey(ApiKeyBase):
     id: int
     api_key: str
     is_active: bool
+    weight: int = 1
+    rpm_limit: Optional[int] = None
+    tokens_per_day_limit: Optional[int] = None
     created_at: datetime
     last_used: Optional[datetime] = None
     
@@ -37,4 +49,27 @@ class Token(BaseModel):
     token_type: str
 
 class TokenData(BaseModel):
-    username: Optional[str] = None 
\ No newline at end of file
+    username: Optional[str] = None 
+
+class UsageBucket(BaseModel):
+    api_key_id: int
+    model: str
+    requests: int
+    cache_hits: int
+    errors: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    avg_latency_ms: float
+
+class UsagePoint(UsageBucket):
+    bucket_start: datetime
+
+class UsageReport(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    # One point per bucket, API key and model, oldest first
+    series: List[UsagePoint]
+    # The same counters summed over the whole range per API key and model
+    totals: List[UsageBucket]
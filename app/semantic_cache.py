@@ -0,0 +1,251 @@
+from typing import Any, Dict, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from app import config
+import hashlib
+import itertools
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Per-slot metadata; a slot with stored_at == 0 is empty
+SLOT_DTYPE = np.dtype([("namespace", "S16"), ("stored_at", "f8"), ("used_at", "f8")])
+# An answer stored this close to an existing entry replaces it
+DUPLICATE_SIMILARITY = 0.9999
+
+def semantic_query(ollama_req: Dict[str, Any]) -> Optional[Tuple[bytes, str]]:
+    """(namespace, text) to look a chat request up by, or None if it cannot be served from the cache
+
+    The text is the last message, which must come from the user. The
+    namespace covers the model, the conversation before that message and
+    the options, so answers are only reused in the same context.
+    """
+    messages = ollama_req.get("messages")
+    if not isinstance(messages, list) or not messages or not isinstance(messages[-1], dict):
+        return None
+    last = messages[-1]
+    text = last.get("content")
+    if last.get("role") != "user" or not isinstance(text, str) or not text.strip() or last.get("images"):
+        return None
+    context = [ollama_req.get("model"), messages[:-1], ollama_req.get("options") or {}]
+    canonical = json.dumps(context, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).digest()[:16], text
+
+def _normalize(vector) -> Optional[np.ndarray]:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    if vector.ndim != 1 or norm == 0.0:
+        return None
+    return vector / norm
+
+class SemanticCache:
+    """Chat answers indexed by the embedding of the user message they answered
+
+    Vectors are unit-length float32 rows of a fixed-size matrix, so a lookup
+    is one matrix-vector product; rows from other namespaces or past the TTL
+    are masked out. Once full, the least recently used slot is reused. With
+    index_dir set, the matrix and slot table are memory-mapped .npy files and
+    answers are stored one JSON file per slot, so the index survives restarts.
+    Each process locks the first free index_dir/worker-<n> subdirectory and
+    keeps its index there, so workers never write to each other's files and
+    a restarted worker usually gets its previous index back.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = config.SEMANTIC_CACHE_TTL,
+        threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+        thresholds: Dict[str, float] = config.SEMANTIC_CACHE_THRESHOLDS,
+        index_dir: Optional[str] = config.SEMANTIC_CACHE_DIR,
+        embedding_model: str = config.SEMANTIC_CACHE_EMBEDDING_MODEL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.thresholds = thresholds
+        self.embedding_model = embedding_model
+        self._lock = threading.Lock()
+        # Open lock file of the worker directory, held until close()
+        self._dir_lock = None
+        self.index_dir = self._claim_worker_dir(index_dir) if index_dir else None
+        # Allocated on the first insert, once the embedding size is known
+        self._vectors: Optional[np.ndarray] = None
+        self._slots = np.zeros(max_entries, dtype=SLOT_DTYPE)
+        self._answers: List[Optional[bytes]] = [None] * max_entries
+        if self.index_dir:
+            self._open_index()
+
+    def threshold_for(self, model: Optional[str]):
+        return self.thresholds.get(model, self.threshold)
+
+    def _live(self, now: float):
+        stored_at = self._slots["stored_at"]
+        live = stored_at > 0
+        if self.ttl > 0:
+            live &= stored_at >= now - self.ttl
+        return live
+
+    @property
+    def entries(self):
+        with self._lock:
+            return int(np.count_nonzero(self._live(time.time())))
+
+    async def search(self, namespace: bytes, model: Optional[str], vector) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        """(answer, similarity) of the closest entry in namespace
+
+        answer is None when the closest entry is below the model's threshold;
+        similarity is None when the namespace has no entries.
+        """
+        return await run_in_threadpool(self._search, namespace, self.threshold_for(model), vector)
+
+    def _search(self, namespace: bytes, threshold: float, vector):
+        query = _normalize(vector)
+        with self._lock:
+            if query is None or self._vectors is None or query.shape[0] != self._vectors.shape[1]:
+                return None, None
+            now = time.time()
+            candidates = self._live(now) & (self._slots["namespace"] == namespace)
+            if not candidates.any():
+                return None, None
+            scores = np.where(candidates, self._vectors @ query, -np.inf)
+            slot = int(np.argmax(scores))
+            similarity = float(scores[slot])
+            if similarity < threshold:
+                return None, similarity
+            self._slots["used_at"][slot] = now
+            answer = self._answers[slot]
+        return json.loads(answer), similarity
+
+    async def add(self, namespace: bytes, vector, response: Dict[str, Any]):
+        body = json.dumps(response, separators=(",", ":")).encode("utf-8")
+        await run_in_threadpool(self._add, namespace, vector, body)
+
+    def _add(self, namespace: bytes, vector, body: bytes):
+        row = _normalize(vector)
+        if row is None:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._allocate(row.shape[0])
+            elif row.shape[0] != self._vectors.shape[1]:
+                logger.warning("Semantic cache embedding size changed from %d to %d; not storing", self._vectors.shape[1], row.shape[0])
+                return
+            now = time.time()
+            live = self._live(now)
+            duplicates = np.flatnonzero(live & (self._slots["namespace"] == namespace) & (self._vectors @ row >= DUPLICATE_SIMILARITY))
+            if duplicates.size:
+                # Refresh the answer to the same question (e.g. after Cache-Control: no-cache)
+                slot = int(duplicates[0])
+            else:
+                # Empty and expired slots first, then the least recently used
+                slot = int(np.argmin(np.where(live, self._slots["used_at"], -1.0)))
+            # Mark the slot empty while it is rewritten so a crash never pairs a vector with another answer
+            self._slots[slot] = (b"", 0.0, 0.0)
+            if self.index_dir and not self._write_answer(slot, body):
+                return
+            self._vectors[slot] = row
+            self._answers[slot] = body
+            self._slots[slot] = (namespace, now, now)
+
+    def _allocate(self, dimensions: int):
+        if self.index_dir:
+            self._vectors = np.lib.format.open_memmap(
+                self._path("vectors.npy"), mode="w+", dtype=np.float32, shape=(self.max_entries, dimensions)
+            )
+        else:
+            self._vectors = np.zeros((self.max_entries, dimensions), dtype=np.float32)
+
+    def _path(self, *parts: str):
+        return os.path.join(self.index_dir, *parts)
+
+    def _claim_worker_dir(self, root: str) -> Optional[str]:
+        """Lock the first worker-<n> subdirectory of root that no other process holds, or None to stay in memory"""
+        if fcntl is None:
+            logger.warning("File locks are not available on this platform; keeping the semantic cache in memory")
+            return None
+        os.makedirs(root, exist_ok=True)
+        for n in itertools.count():
+            lock_file = open(os.path.join(root, f"worker-{n}.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            self._dir_lock = lock_file
+            return os.path.join(root, f"worker-{n}")
+
+    def _open_index(self):
+        """Map the index files in index_dir, starting over if they were written with other settings"""
+        os.makedirs(self._path("answers"), exist_ok=True)
+        settings = {"embedding_model": self.embedding_model, "max_entries": self.max_entries}
+        try:
+            with open(self._path("index.json")) as f:
+                reusable = json.load(f) == settings
+            slots = np.lib.format.open_memmap(self._path("slots.npy"), mode="r+")
+            vectors = np.lib.format.open_memmap(self._path("vectors.npy"), mode="r+") if os.path.exists(self._path("vectors.npy")) else None
+            reusable = reusable and slots.dtype == SLOT_DTYPE and slots.shape == (self.max_entries,)
+            reusable = reusable and (vectors is None or (vectors.dtype == np.float32 and vectors.ndim == 2 and vectors.shape[0] == self.max_entries))
+        except (OSError, ValueError):
+            reusable = False
+        if not reusable:
+            self._reset_index(settings)
+            return
+
+        self._slots, self._vectors = slots, vectors
+        if vectors is None:
+            self._slots[:] = (b"", 0.0, 0.0)
+        for slot in np.flatnonzero(self._live(time.time())):
+            try:
+                with open(self._path("answers", f"{slot}.json"), "rb") as f:
+                    self._answers[slot] = f.read()
+            except OSError:
+                self._slots[slot] = (b"", 0.0, 0.0)
+        logger.info("Loaded %d semantic cache entries from %s", self.entries, self.index_dir)
+
+    def _reset_index(self, settings: Dict[str, Any]):
+        for name in ("slots.npy", "vectors.npy"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        shutil.rmtree(self._path("answers"), ignore_errors=True)
+        os.makedirs(self._path("answers"), exist_ok=True)
+        self._slots = np.lib.format.open_memmap(self._path("slots.npy"), mode="w+", dtype=SLOT_DTYPE, shape=(self.max_entries,))
+        self._vectors = None
+        with open(self._path("index.json"), "w") as f:
+            json.dump(settings, f)
+
+    def _write_answer(self, slot: int, body: bytes):
+        path = self._path("answers", f"{slot}.json")
+        try:
+            # Write to a temporary file first so a crash never leaves a partial answer
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+            return True
+        except OSError:
+            logger.exception("Failed to write semantic cache answer %d", slot)
+            return False
+
+    def close(self):
+        """Write the memory-mapped index back to disk and give up its directory"""
+        with self._lock:
+            for array in (self._slots, self._vectors):
+                if isinstance(array, np.memmap):
+                    array.flush()
+            if self._dir_lock is not None:
+                self._dir_lock.close()
+                self._dir_lock = None
+
+semantic_cache = SemanticCache() if config.SEMANTIC_CACHE_ENABLED else None
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import delete, insert, select
+from app import config
+from app.database import SessionLocal
+from app.models import WebSession
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+
+logger = logging.getLogger(__name__)
+
+class SignedCookieSessionStore:
+    """Stateless sessions: the cookie itself carries the user id and expiry, signed with SECRET_KEY
+
+    Any worker or node sharing the secret accepts the cookie. Logging out
+    clears the cookie in the browser but cannot revoke a copy of it before
+    it expires.
+    """
+
+    def __init__(self, secret_key: str = config.SECRET_KEY, max_age: int = config.SESSION_MAX_AGE):
+        self._key = hashlib.sha256(f"web-session:{secret_key}".encode("utf-8")).digest()
+        self.max_age = max_age
+
+    def _sign(self, payload: bytes):
+        return base64.urlsafe_b64encode(hmac.new(self._key, payload, hashlib.sha256).digest()).rstrip(b"=")
+
+    async def create(self, user_id: int) -> str:
+        payload = base64.urlsafe_b64encode(f"{user_id}:{int(time.time()) + self.max_age}".encode("ascii")).rstrip(b"=")
+        return (payload + b"." + self._sign(payload)).decode("ascii")
+
+    async def get(self, token: str) -> Optional[int]:
+        try:
+            payload, signature = token.encode("ascii").split(b".", 1)
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            user_id, expires_at = base64.urlsafe_b64decode(payload + b"=" * (-len(payload) % 4)).decode("ascii").split(":")
+            if int(expires_at) < time.time():
+                return None
+            return int(user_id)
+        except (ValueError, UnicodeError):
+            return None
+
+    async def delete(self, token: str):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class DatabaseSessionStore:
+    """Server-side sessions in the web_sessions table, shared by every worker using the database
+
+    Only a hash of the session token is stored. Expired rows are ignored on
+    lookup and deleted by a background sweep every sweep_interval seconds.
+    """
+
+    def __init__(self, max_age: int = config.SESSION_MAX_AGE, sweep_interval: float = config.SESSION_SWEEP_INTERVAL):
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _hash(token: str):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    async def create(self, user_id: int) -> str:
+        token = secrets.token_urlsafe(32)
+        async with SessionLocal() as db:
+            await db.execute(insert(WebSession).values(
+                token_hash=self._hash(token),
+                user_id=user_id,
+                expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.max_age),
+            ))
+            await db.commit()
+        return token
+
+    async def get(self, token: str) -> Optional[int]:
+        async with SessionLocal() as db:
+            return await db.scalar(select(WebSession.user_id).where(
+                WebSession.token_hash == self._hash(token),
+                WebSession.expires_at > datetime.now(timezone.utc),
+            ))
+
+    async def delete(self, token: str):
+        async with SessionLocal() as db:
+            await db.execute(delete(WebSession).where(WebSession.token_hash == self._hash(token)))
+            await db.commit()
+
+    async def sweep(self):
+        """Delete expired sessions"""
+        async with SessionLocal() as db:
+            await db.execute(delete(WebSession).where(WebSession.expires_at <= datetime.now(timezone.utc)))
+            await db.commit()
+
+    async def start(self):
+        if self.sweep_interval > 0:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+SESSION_STORES = {
+    "signed": SignedCookieSessionStore,
+    "database": DatabaseSessionStore,
+}
+
+session_store = SESSION_STORES[config.SESSION_BACKEND]()
@@ -0,0 +1,195 @@
+from collections import deque
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from app import config
+from app.database import SessionLocal
+from app.models import ApiKey, ApiRequestLog, UsageRollup
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UsageEvent(NamedTuple):
+    api_key_id: int
+    endpoint: str
+    timestamp: datetime
+    model: Optional[str] = None
+    cache_hit: bool = False
+    backend: Optional[str] = None
+    status_code: Optional[int] = None
+    latency_ms: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+ROLLUP_GRANULARITIES = ("hour", "day")
+
+def bucket_start(timestamp: datetime, granularity: str):
+    """Start of the UTC hour/day containing timestamp, as a naive datetime"""
+    timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def aggregate_rollups(batch):
+    """Collapse usage events into one row per rollup bucket"""
+    rollups = {}
+    for event in batch:
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (granularity, bucket_start(event.timestamp, granularity), event.api_key_id, event.model or "", event.endpoint)
+            row = rollups.get(key)
+            if row is None:
+                row = rollups[key] = {
+                    "granularity": key[0],
+                    "bucket_start": key[1],
+                    "api_key_id": key[2],
+                    "model": key[3],
+                    "endpoint": key[4],
+                    "request_count": 0,
+                    "cache_hits": 0,
+                    "error_count": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "latency_ms_total": 0.0,
+                }
+            row["request_count"] += 1
+            row["cache_hits"] += int(event.cache_hit)
+            row["error_count"] += int(event.status_code is not None and event.status_code >= 400)
+            row["prompt_tokens"] += event.prompt_tokens
+            row["completion_tokens"] += event.completion_tokens
+            row["latency_ms_total"] += event.latency_ms or 0.0
+    return list(rollups.values())
+
+async def upsert_rollups(db, rows):
+    """Add rows onto existing rollup buckets (INSERT ... ON CONFLICT DO UPDATE)"""
+    if not rows:
+        return
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    table = UsageRollup.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["granularity", "bucket_start", "api_key_id", "model", "endpoint"],
+        set_={
+            column: table.c[column] + stmt.excluded[column]
+            for column in ("request_count", "cache_hits", "error_count", "prompt_tokens", "completion_tokens", "latency_ms_total")
+        },
+    )
+    await db.execute(stmt, rows)
+
+class UsageWriter:
+    """Write-behind buffer for API request logs and API key last_used timestamps
+
+    Requests only append to an in-process queue. A background task flushes
+    the queue as one bulk insert into api_request_logs, one coalesced
+    last_used update per key and one upsert per usage_rollups bucket,
+    whenever batch_size events are pending or flush_interval seconds have
+    passed, and once more on shutdown.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = config.USAGE_FLUSH_BATCH_SIZE,
+        flush_interval: float = config.USAGE_FLUSH_INTERVAL,
+        max_pending: int = config.USAGE_MAX_PENDING,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Oldest events are dropped if the database falls this far behind
+        self._pending = deque(maxlen=max_pending)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def pending(self):
+        """Number of events not yet written"""
+        return len(self._pending)
+
+    def record(
+        self,
+        api_key_id: int,
+        endpoint: str,
+        model: Optional[str] = None,
+        cache_hit: bool = False,
+        backend: Optional[str] = None,
+        status_code: Optional[int] = None,
+        latency_ms: Optional[float] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+    ):
+        """Queue one request for logging (safe to call from any thread)"""
+        self._pending.append(UsageEvent(
+            api_key_id, endpoint, datetime.now(timezone.utc), model, cache_hit,
+            backend, status_code, latency_ms, prompt_tokens, completion_tokens,
+        ))
+        if len(self._pending) >= self.batch_size and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write out everything still queued"""
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self._loop = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._pending:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popleft())
+            try:
+                try:
+                    await self._write_batch(batch)
+                except IntegrityError:
+                    # A key was deleted while its events were queued
+                    await self._write_batch(await self._drop_deleted_keys(batch))
+            except Exception:
+                logger.exception("Failed to write %d usage events", len(batch))
+
+    async def _drop_deleted_keys(self, batch):
+        async with SessionLocal() as db:
+            existing = set(await db.scalars(select(ApiKey.id).where(ApiKey.id.in_({e.api_key_id for e in batch}))))
+        return [event for event in batch if event.api_key_id in existing]
+
+    async def _write_batch(self, batch):
+        if not batch:
+            return
+        last_used = {}
+        for event in batch:
+            if event.api_key_id not in last_used or event.timestamp > last_used[event.api_key_id]:
+                last_used[event.api_key_id] = event.timestamp
+
+        async with SessionLocal() as db:
+            await db.execute(insert(ApiRequestLog), [event._asdict() for event in batch])
+            # Core executemany: keys deleted since the request simply match no row
+            await db.execute(
+                update(ApiKey.__table__)
+                .where(ApiKey.__table__.c.id == bindparam("key_id"))
+                .values(last_used=bindparam("last_used_at")),
+                [{"key_id": api_key_id, "last_used_at": timestamp} for api_key_id, timestamp in last_used.items()]
+            )
+            await upsert_rollups(db, aggregate_rollups(batch))
+            await db.commit()
+
+usage_writer = UsageWriter()
@@ -1,15 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Form, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from app.database import get_db
-from app.models import User, ApiKey, ApiRequestLog
+from app.models import User, ApiKey, UsageRollup
 from app.auth import authenticate_user, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
-from app.crud import create_user, get_api_keys, create_api_key, update_api_key, delete_api_key, get_user
-from app.schemas import UserCreate, ApiKeyCreate
+from app.crud import create_user, get_api_keys, create_api_key, update_api_key, delete_api_key, get_user, get_users
+from app.schemas import UserCreate, ApiKeyCreate, ApiKeyUpdate
+from app.sessions import session_store
 from datetime import timedelta, datetime, date
-from sqlalchemy import func, and_
+from sqlalchemy import func, select
 import os
 
 router = APIRouter(tags=["web"])
@@ -17,35 +18,47 @@ router = APIRouter(tags=["web"])
 # Templates
 templates = Jinja2Templates(directory="app/templates")
 
-# Session storage (in production, use Redis or database)
-sessions = {}
-
-def get_session_user(request: Request) -> Optional[User]:
+async def get_session_user(request: Request, db: AsyncSession) -> Optional[User]:
+    """Resolve the session cookie to an active user (sessions only store the user id)"""
     session_token = request.cookies.get("session_token")
-    if session_token and session_token in sessions:
-        return sessions[session_token]
-    return None
+    if not session_token:
+        return None
+    user_id = await session_store.get(session_token)
+    if user_id is None:
+        return None
+    user = await db.get(User, user_id)
+    if user is None or not user.is_active:
+        return None
+    return user
 
 @router.get("/", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
-    user = get_session_user(request)
+async def dashboard(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_session_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
-    # Get statistics
-    total_api_keys = db.query(ApiKey).count()
-    active_api_keys = db.query(ApiKey).filter(ApiKey.is_active == True).count()
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
+    # Get statistics in a single round trip
+    total_api_keys, active_api_keys, total_users, active_users = (await db.execute(select(
+        select(func.count(ApiKey.id)).scalar_subquery(),
+        select(func.count(ApiKey.id)).where(ApiKey.is_active == True).scalar_subquery(),
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.count(User.id)).where(User.is_active == True).scalar_subquery(),
+    ))).one()
     
     # Get recent activity (last 5 API keys with recent usage)
-    recent_activity = db.query(ApiKey).order_by(ApiKey.last_used.desc()).limit(5).all()
-
-    # Count API requests today
-    today = date.today()
-    requests_today = db.query(func.count()).select_from(ApiRequestLog).filter(
-        func.date(ApiRequestLog.timestamp) == today
-    ).scalar()
+    recent_activity = (await db.scalars(select(ApiKey).order_by(ApiKey.last_used.desc()).limit(5))).all()
+
+    # Count API requests today and yesterday from the daily rollups (UTC days)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday = today - timedelta(days=1)
+    daily_counts = dict((await db.execute(
+        select(UsageRollup.bucket_start, func.sum(UsageRollup.request_count))
+        .where(UsageRollup.granularity == "day", UsageRollup.bucket_start.in_([today, yesterday]))
+        .group_by(UsageRollup.bucket_start)
+    )).all())
+    requests_today = daily_counts.get(today, 0)
+    requests_yesterday = daily_counts.get(yesterday, 0)
+    requests_increase = round((requests_today - requests_yesterday) * 100 / requests_yesterday) if requests_yesterday else 0
 
     stats = {
         "total_api_keys": total_api_keys,
@@ -53,7 +66,7 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
         "total_users": total_users,
         "active_users": active_users,
         "requests_today": requests_today,
-        "requests_increase": 0  # Placeholder
+        "requests_increase": requests_increase
     }
     
     return templates.TemplateResponse("dashboard.html", {
@@ -72,9 +85,9 @@ async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = authenticate_user(db, username, password)
+    user = await authenticate_user(db, username, password)
     if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
@@ -82,31 +95,29 @@ async def login(
         })
     
     # Create session
-    import secrets
-    session_token = secrets.token_urlsafe(32)
-    sessions[session_token] = user
+    session_token = await session_store.create(user.id)
     
     response = RedirectResponse(url="/", status_code=302)
-    response.set_cookie(key="session_token", value=session_token, httponly=True, max_age=3600)
+    response.set_cookie(key="session_token", value=session_token, httponly=True, max_age=session_store.max_age)
     return response
 
 @router.get("/logout")
 async def logout(request: Request):
     session_token = request.cookies.get("session_token")
-    if session_token in sessions:
-        del sessions[session_token]
+    if session_token:
+        await session_store.delete(session_token)
     
     response = RedirectResponse(url="/login", status_code=302)
     response.delete_cookie("session_token")
     return response
 
 @router.get("/api-keys", response_class=HTMLResponse)
-async def api_keys_page(request: Request, db: Session = Depends(get_db)):
-    user = get_session_user(request)
+async def api_keys_page(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_session_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
-    api_keys = get_api_keys(db)
+    api_keys = await get_api_keys(db)
     return templates.TemplateResponse("api_keys.html", {
         "request": request,
         "current_user": user,
@@ -117,15 +128,15 @@ async def api_keys_page(request: Request, db: Session = Depends(get_db)):
 async def create_api_key_web(
     request: Request,
     key_name: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = get_session_user(request)
+    user = await get_session_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
     try:
         api_key_data = ApiKeyCreate(key_name=key_name)
-        new_api_key = create_api_key(db, api_key_data)
+        new_api_key = await create_api_key(db, api_key_data)
         return RedirectResponse(url="/api-keys?message=API key created successfully", status_code=302)
     except Exception as e:
         return RedirectResponse(url=f"/api-keys?error={str(e)}", status_code=302)
@@ -134,14 +145,13 @@ async def create_api_key_web(
 async def update_api_key_web(
     api_key_id: int,
     request: Request,
-    data: dict = Body(...),
-    db: Session = Depends(get_db)
+    changes: ApiKeyUpdate,
+    db: AsyncSession = Depends(get_db)
 ):
-    user = get_session_user(request)
+    user = await get_session_user(request, db)
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    is_active = data.get("is_active")
-    db_api_key = update_api_key(db, api_key_id, is_active)
+    db_api_key = await update_api_key(db, api_key_id, changes)
     if not db_api_key:
         raise HTTPException(status_code=404, detail="API key not found")
     return {"message": "API key updated successfully"}
@@ -150,24 +160,24 @@ async def update_api_key_web(
 async def delete_api_key_web(
     api_key_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = get_session_user(request)
+    user = await get_session_user(request, db)
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    db_api_key = delete_api_key(db, api_key_id)
+    db_api_key = await delete_api_key(db, api_key_id)
     if not db_api_key:
         raise HTTPException(status_code=404, detail="API key not found")
     return {"message": "API key deleted successfully"}
 
 @router.get("/users", response_class=HTMLResponse)
-async def users_page(request: Request, db: Session = Depends(get_db)):
-    user = get_session_user(request)
+async def users_page(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_session_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
-    users = db.query(User).all()
+    users = await get_users(db)
     return templates.TemplateResponse("users.html", {
         "request": request,
         "current_user": user,
@@ -179,15 +189,15 @@ async def create_user_web(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = get_session_user(request)
+    user = await get_session_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
     try:
         user_data = UserCreate(username=username, password=password)
-        new_user = create_user(db, user_data)
+        new_user = await create_user(db, user_data)
         return RedirectResponse(url="/users?message=User created successfully", status_code=302)
     except Exception as e:
         return RedirectResponse(url=f"/users?error={str(e)}", status_code=302) 
\ No newline at end of file
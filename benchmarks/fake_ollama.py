@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Deterministic fake Ollama server for benchmarks
+Answers /api/tags, /api/generate, /api/chat and /api/embed with fixed output
+after a configurable latency, streaming tokens at a fixed rate
+"""
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import argparse
+import asyncio
+import json
+import uvicorn
+
+def create_app(models, latency: float, tokens: int, tokens_per_second: float):
+    app = FastAPI()
+    token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+    prompt_tokens = 8
+
+    def final_stats():
+        eval_duration = int(tokens * token_interval * 1e9)
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(latency * 1e9) + eval_duration,
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(latency * 1e9),
+            "eval_count": tokens,
+            "eval_duration": eval_duration,
+        }
+
+    def content(key: str, text: str):
+        return {"role": "assistant", "content": text} if key == "message" else text
+
+    async def sleep_until(deadline: float):
+        # Sleep against absolute deadlines so timer rounding does not accumulate per token
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(deadline - loop.time(), 0))
+
+    async def generation(body, key: str):
+        model = body.get("model")
+        started = asyncio.get_running_loop().time()
+        await sleep_until(started + latency)
+        if not body.get("stream", True):
+            await sleep_until(started + latency + tokens * token_interval)
+            return {"model": model, key: content(key, "".join(f"token{i} " for i in range(tokens))), **final_stats()}
+
+        async def chunks():
+            for i in range(tokens):
+                await sleep_until(started + latency + i * token_interval)
+                yield json.dumps({"model": model, key: content(key, f"token{i} "), "done": False}) + "\n"
+            await sleep_until(started + latency + tokens * token_interval)
+            yield json.dumps({"model": model, key: content(key, ""), **final_stats()}) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": name, "modified_at": "2024-01-01T00:00:00.000000000Z", "size": 0} for name in models]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await generation(await request.json(), "response")
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        return await generation(await request.json(), "message")
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(latency)
+        return {
+            "model": body.get("model"),
+            "embeddings": [[float(len(text)), 0.0, 1.0] for text in inputs],
+            "prompt_eval_count": sum(len(text.split()) for text in inputs),
+        }
+
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="llama2:latest", help="comma-separated model names")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per completion")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    args = parser.parse_args()
+
+    app = create_app(args.models.split(","), args.latency, args.tokens, args.tokens_per_second)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
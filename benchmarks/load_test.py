@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Load-testing harness for the Ollama API Middleware
+Starts the fake Ollama server and the real app (uvicorn) on local ports,
+drives the OpenAI-compatible endpoints at several concurrency levels and
+reports the latency the middleware adds on top of the fake upstream,
+requests per second and request-log rows written per second. Results can
+be compared against a baseline file to catch regressions.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+MODEL = "llama2:latest"
+
+SCENARIOS = {
+    "models": ("GET", "/v1/models", None),
+    "completions": ("POST", "/v1/completions", {"model": MODEL, "prompt": "Say hello"}),
+    "chat": ("POST", "/v1/chat/completions", {"model": MODEL, "messages": [{"role": "user", "content": "Say hello"}]}),
+    "chat_stream": ("POST", "/v1/chat/completions", {"model": MODEL, "messages": [{"role": "user", "content": "Say hello"}], "stream": True}),
+}
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, q):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def start_processes(args, workdir: str):
+    """Start the fake Ollama server and the app; returns (processes, app_url, ollama_url, db_path)"""
+    ollama_port, app_port = free_port(), free_port()
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_ollama.py"),
+        "--port", str(ollama_port),
+        "--models", MODEL,
+        "--latency", str(args.latency),
+        "--tokens", str(args.tokens),
+        "--tokens-per-second", str(args.tokens_per_second),
+    ])
+    db_path = os.path.join(workdir, "benchmark.db")
+    env = {
+        **os.environ,
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{ollama_port}",
+        "OLLAMA_BASE_URLS": f"http://127.0.0.1:{ollama_port}",
+        "DEBUG": "false",
+        # Everything the app writes stays in workdir (these override .env, which never replaces set variables)
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "BATCH_DIR": os.path.join(workdir, "batches"),
+        "RESPONSE_CACHE_DIR": os.path.join(workdir, "response_cache"),
+        "SEMANTIC_CACHE_DIR": os.path.join(workdir, "semantic_cache"),
+    }
+    # The fake upstream is not GPU bound, so admission control would only measure queueing
+    env.setdefault("SCHEDULER_BACKEND_CONCURRENCY", "0")
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning", "--no-access-log",
+    ], cwd=ROOT, env=env)
+    return [app, fake], f"http://127.0.0.1:{app_port}", f"http://127.0.0.1:{ollama_port}", db_path
+
+async def create_bearer_token(client: httpx.AsyncClient):
+    login = await client.post("/admin/token", data={"username": "admin", "password": "admin123"})
+    login.raise_for_status()
+    admin_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    key = await client.post("/admin/api-keys", json={"key_name": "benchmark"}, headers=admin_headers)
+    key.raise_for_status()
+    return key.json()["api_key"]
+
+def count_logged_requests(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM api_request_logs").fetchone()[0]
+
+async def run_scenario(client: httpx.AsyncClient, name: str, concurrency: int, total_requests: int, headers):
+    """Send total_requests requests from concurrency workers; returns per-request latencies"""
+    method, path, body = SCENARIOS[name]
+    latencies, first_bytes, errors = [], [], 0
+    remaining = total_requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                async with client.stream(method, path, json=body, headers=headers) as response:
+                    first_byte = None
+                    async for _ in response.aiter_raw():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - started
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            first_bytes.append(first_byte or latencies[-1])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, first_bytes, errors, time.perf_counter() - started
+
+def summarize(name: str, args, latencies, first_bytes, errors: int, elapsed: float, logged: int):
+    # Time the fake upstream itself needs for one request (nothing for the cached model list)
+    upstream = 0.0 if name == "models" else args.latency + args.tokens / args.tokens_per_second
+    overhead = [max(latency - upstream, 0.0) * 1000 for latency in latencies]
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "overhead_p50_ms": round(percentile(overhead, 50), 2),
+        "overhead_p95_ms": round(percentile(overhead, 95), 2),
+        "overhead_p99_ms": round(percentile(overhead, 99), 2),
+        "db_writes_per_s": round(logged / elapsed, 1) if elapsed else 0.0,
+    }
+    if name.endswith("_stream"):
+        result["ttfb_p50_ms"] = round(percentile(first_bytes, 50) * 1000, 2)
+    return result
+
+async def run_benchmarks(args):
+    workdir = tempfile.mkdtemp(prefix="ollama-middleware-bench-")
+    processes, app_url, ollama_url, db_path = start_processes(args, workdir)
+    results = {}
+    try:
+        await wait_until_up(f"{ollama_url}/api/tags")
+        await wait_until_up(f"{app_url}/health")
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=120.0) as client:
+            headers = {"Authorization": f"Bearer {await create_bearer_token(client)}"}
+            for name in args.scenarios:
+                # Warm up connection pools and caches before measuring
+                await run_scenario(client, name, min(args.concurrency), min(args.concurrency) * 2, headers)
+                for concurrency in args.concurrency:
+                    await asyncio.sleep(args.flush_wait)
+                    logged_before = count_logged_requests(db_path)
+                    latencies, first_bytes, errors, elapsed = await run_scenario(client, name, concurrency, args.requests, headers)
+                    # Let the usage writer flush before counting the rows it wrote
+                    await asyncio.sleep(args.flush_wait)
+                    logged = count_logged_requests(db_path) - logged_before
+                    key = f"{name}@{concurrency}"
+                    results[key] = summarize(name, args, latencies, first_bytes, errors, elapsed, logged)
+                    print_row(key, results[key])
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+    return results
+
+def print_header():
+    print(f"{'scenario':<18}{'req':>6}{'err':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db w/s':>9}")
+
+def print_row(key: str, result):
+    print(
+        f"{key:<18}{result['requests']:>6}{result['errors']:>5}{result['rps']:>9}"
+        f"{result['overhead_p50_ms']:>9}{result['overhead_p95_ms']:>9}{result['overhead_p99_ms']:>9}{result['db_writes_per_s']:>9}"
+    )
+
+def compare_with_baseline(results, baseline, tolerance: float, slack_ms: float):
+    """Return a list of regressions against baseline results"""
+    regressions = []
+    for key, base in baseline.get("results", {}).items():
+        current = results.get(key)
+        if current is None:
+            continue
+        for metric in ("overhead_p50_ms", "overhead_p95_ms", "overhead_p99_ms"):
+            limit = base[metric] * (1 + tolerance) + slack_ms
+            if current[metric] > limit:
+                regressions.append(f"{key} {metric}: {current[metric]} > {limit:.2f} (baseline {base[metric]})")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{key} rps: {current['rps']} < {base['rps'] * (1 - tolerance):.1f} (baseline {base['rps']})")
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{key} errors: {current['errors']} (baseline {base['errors']})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the middleware against a fake Ollama server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake upstream latency before the first token")
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--flush-wait", type=float, default=1.5, help="seconds to wait for the usage writer between runs")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite the baseline with these results")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="allowed absolute overhead regression in ms")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    print_header()
+    results = asyncio.run(run_benchmarks(args))
+    report = {
+        "settings": {
+            "requests": args.requests,
+            "latency": args.latency,
+            "tokens": args.tokens,
+            "tokens_per_second": args.tokens_per_second,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against (run with --update-baseline to create one)")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != report["settings"]:
+        print("Baseline was recorded with different settings; skipping the comparison")
+        return
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.slack_ms)
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
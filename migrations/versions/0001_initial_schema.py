@@ -0,0 +1,54 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String()),
+        sa.Column("hashed_password", sa.String()),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    op.create_table(
+        "api_keys",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("key_name", sa.String()),
+        sa.Column("api_key", sa.String()),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+        sa.Column("last_used", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_api_keys_id", "api_keys", ["id"])
+    op.create_index("ix_api_keys_key_name", "api_keys", ["key_name"])
+    op.create_index("ix_api_keys_api_key", "api_keys", ["api_key"], unique=True)
+
+    op.create_table(
+        "api_request_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("api_key_id", sa.Integer(), sa.ForeignKey("api_keys.id")),
+        sa.Column("endpoint", sa.String()),
+        sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_api_request_logs_id", "api_request_logs", ["id"])
+
+def downgrade():
+    op.drop_table("api_request_logs")
+    op.drop_table("api_keys")
+    op.drop_table("users")
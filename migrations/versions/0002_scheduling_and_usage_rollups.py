@@ -0,0 +1,83 @@
+"""api key weights, request log model/cache_hit and usage rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def existing_columns(table: str):
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+def upgrade():
+    # Databases created before migrations may already have some of these columns and tables (see app.migrations.PARTIAL_0002)
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    log_columns = existing_columns("api_request_logs")
+    if "weight" not in existing_columns("api_keys"):
+        with op.batch_alter_table("api_keys") as batch_op:
+            batch_op.add_column(sa.Column("weight", sa.Integer(), nullable=False, server_default="1"))
+
+    with op.batch_alter_table("api_request_logs") as batch_op:
+        batch_op.add_column(sa.Column("model", sa.String(), nullable=True))
+        if "cache_hit" not in log_columns:
+            batch_op.add_column(sa.Column("cache_hit", sa.Boolean(), nullable=True))
+    op.create_index("ix_api_request_logs_timestamp_api_key_id", "api_request_logs", ["timestamp", "api_key_id"])
+    if op.get_bind().dialect.name == "postgresql":
+        # Let API keys be deleted without losing their request logs (SQLite does not enforce foreign keys)
+        op.drop_constraint("api_request_logs_api_key_id_fkey", "api_request_logs", type_="foreignkey")
+        op.create_foreign_key(
+            "api_request_logs_api_key_id_fkey", "api_request_logs", "api_keys",
+            ["api_key_id"], ["id"], ondelete="SET NULL"
+        )
+
+    if "usage_rollups" not in tables:
+        op.create_table(
+            "usage_rollups",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("granularity", sa.String(), nullable=False),
+            sa.Column("bucket_start", sa.DateTime(), nullable=False),
+            sa.Column("api_key_id", sa.Integer(), nullable=False),
+            sa.Column("model", sa.String(), nullable=False),
+            sa.Column("endpoint", sa.String(), nullable=False),
+            sa.Column("request_count", sa.Integer(), nullable=False),
+            sa.Column("cache_hits", sa.Integer(), nullable=False),
+            sa.UniqueConstraint("granularity", "bucket_start", "api_key_id", "model", "endpoint", name="uq_usage_rollups_bucket"),
+        )
+        op.create_index("ix_usage_rollups_api_key_id_bucket", "usage_rollups", ["api_key_id", "granularity", "bucket_start"])
+        # A table create_all made earlier is already maintained by the usage writer; only a new one needs the history
+        backfill_rollups()
+
+def backfill_rollups():
+    """Count the existing request logs into hour and day rollups, since reports read only the rollups"""
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    for granularity, sqlite_format in (("hour", "%Y-%m-%d %H:00:00.000000"), ("day", "%Y-%m-%d 00:00:00.000000")):
+        # Start of the UTC bucket; on SQLite in the text form SQLAlchemy stores datetimes in
+        if postgresql:
+            bucket = f"date_trunc('{granularity}', \"timestamp\" AT TIME ZONE 'UTC')"
+        else:
+            bucket = f"strftime('{sqlite_format}', \"timestamp\")"
+        op.execute(
+            "INSERT INTO usage_rollups (granularity, bucket_start, api_key_id, model, endpoint, request_count, cache_hits) "
+            f"SELECT '{granularity}', {bucket}, api_key_id, COALESCE(model, ''), COALESCE(endpoint, ''), "
+            "COUNT(*), SUM(CASE WHEN cache_hit THEN 1 ELSE 0 END) "
+            "FROM api_request_logs WHERE api_key_id IS NOT NULL AND \"timestamp\" IS NOT NULL "
+            f"GROUP BY {bucket}, api_key_id, COALESCE(model, ''), COALESCE(endpoint, '')"
+        )
+
+def downgrade():
+    op.drop_table("usage_rollups")
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_constraint("api_request_logs_api_key_id_fkey", "api_request_logs", type_="foreignkey")
+        op.create_foreign_key("api_request_logs_api_key_id_fkey", "api_request_logs", "api_keys", ["api_key_id"], ["id"])
+    op.drop_index("ix_api_request_logs_timestamp_api_key_id", table_name="api_request_logs")
+    with op.batch_alter_table("api_request_logs") as batch_op:
+        batch_op.drop_column("cache_hit")
+        batch_op.drop_column("model")
+    with op.batch_alter_table("api_keys") as batch_op:
+        batch_op.drop_column("weight")
@@ -0,0 +1,27 @@
+"""web_sessions table for the database session store
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "web_sessions",
+        sa.Column("token_hash", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_web_sessions_expires_at", "web_sessions", ["expires_at"])
+
+def downgrade():
+    op.drop_index("ix_web_sessions_expires_at", table_name="web_sessions")
+    op.drop_table("web_sessions")
@@ -0,0 +1,43 @@
+"""request log tokens, backend, status and latency; token and error totals in usage rollups
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("api_request_logs") as batch_op:
+        batch_op.add_column(sa.Column("backend", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("status_code", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("latency_ms", sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column("prompt_tokens", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("completion_tokens", sa.Integer(), nullable=False, server_default="0"))
+
+    with op.batch_alter_table("usage_rollups") as batch_op:
+        batch_op.add_column(sa.Column("error_count", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("prompt_tokens", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("completion_tokens", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("latency_ms_total", sa.Float(), nullable=False, server_default="0"))
+    # Reports across all keys filter on the bucket range first
+    op.create_index("ix_usage_rollups_bucket_model", "usage_rollups", ["granularity", "bucket_start", "model"])
+
+def downgrade():
+    op.drop_index("ix_usage_rollups_bucket_model", table_name="usage_rollups")
+    with op.batch_alter_table("usage_rollups") as batch_op:
+        batch_op.drop_column("latency_ms_total")
+        batch_op.drop_column("completion_tokens")
+        batch_op.drop_column("prompt_tokens")
+        batch_op.drop_column("error_count")
+    with op.batch_alter_table("api_request_logs") as batch_op:
+        batch_op.drop_column("completion_tokens")
+        batch_op.drop_column("prompt_tokens")
+        batch_op.drop_column("latency_ms")
+        batch_op.drop_column("status_code")
+        batch_op.drop_column("backend")
@@ -0,0 +1,23 @@
+"""per-key requests-per-minute and tokens-per-day limits
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("api_keys") as batch_op:
+        batch_op.add_column(sa.Column("rpm_limit", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("tokens_per_day_limit", sa.Integer(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table("api_keys") as batch_op:
+        batch_op.drop_column("tokens_per_day_limit")
+        batch_op.drop_column("rpm_limit")
@@ -0,0 +1,58 @@
+"""batch files and batch jobs
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "batch_files",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("api_key_id", sa.Integer(), nullable=False),
+        sa.Column("filename", sa.String(), nullable=False),
+        sa.Column("purpose", sa.String(), nullable=False),
+        sa.Column("bytes", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_batch_files_api_key_id", "batch_files", ["api_key_id"])
+
+    op.create_table(
+        "batch_jobs",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("api_key_id", sa.Integer(), nullable=False),
+        sa.Column("endpoint", sa.String(), nullable=False),
+        sa.Column("input_file_id", sa.String(), nullable=False),
+        sa.Column("output_file_id", sa.String(), nullable=True),
+        sa.Column("error_file_id", sa.String(), nullable=True),
+        sa.Column("completion_window", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("errors", sa.String(), nullable=True),
+        sa.Column("metadata_json", sa.String(), nullable=True),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("completed", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("failed", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("in_progress_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("cancelling_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("locked_by", sa.String(), nullable=True),
+        sa.Column("locked_until", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_batch_jobs_api_key_id", "batch_jobs", ["api_key_id"])
+    op.create_index("ix_batch_jobs_status_locked_until", "batch_jobs", ["status", "locked_until"])
+
+def downgrade():
+    op.drop_index("ix_batch_jobs_status_locked_until", table_name="batch_jobs")
+    op.drop_index("ix_batch_jobs_api_key_id", table_name="batch_jobs")
+    op.drop_table("batch_jobs")
+    op.drop_index("ix_batch_files_api_key_id", table_name="batch_files")
+    op.drop_table("batch_files")
@@ -5,8 +5,10 @@ A simple script to run the FastAPI application
 """
 
 import uvicorn
+import asyncio
 import socket
 import os
+from app import config
 
 def find_available_port(start_port=8000, max_attempts=100):
     """Find an available port starting from start_port"""
@@ -19,12 +21,27 @@ def find_available_port(start_port=8000, max_attempts=100):
             continue
     raise RuntimeError(f"Could not find an available port in range {start_port}-{start_port + max_attempts}")
 
+def migrate_database():
+    """Apply pending migrations once, before any worker starts, so workers never race on DDL"""
+    from app.database import engine
+    from app.migrations import run_migrations
+
+    async def migrate():
+        try:
+            await run_migrations()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(migrate())
+    # Workers inherit the environment: the schema is already up to date
+    os.environ["AUTO_MIGRATE"] = "false"
+
 if __name__ == "__main__":
     # Check debug mode
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
     
-    # Find available port
-    port = find_available_port(8000)
+    # Use the configured port, or find an available one
+    port = config.PORT or find_available_port(8000)
     
     if DEBUG:
         print("🚀 Starting Ollama API Middleware (DEBUG MODE)...")
@@ -33,14 +50,31 @@ if __name__ == "__main__":
         print("🔑 Default admin: admin / admin123")
         print("⚠️  Please change the default password after first login!")
         print("-" * 50)
+        uvicorn.run(
+            "app.main:app",
+            host=config.HOST,
+            port=port,
+            reload=True,
+            log_level="debug"
+        )
     else:
-        print(f"🚀 Ollama API Middleware starting on port {port}")
+        workers = max(config.WORKERS, 1)
+        print(f"🚀 Ollama API Middleware starting on port {port} with {workers} worker(s)")
         print(f"📖 Web UI: http://localhost:{port}")
-    
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=port,
-        reload=DEBUG,  # Only enable reload in debug mode
-        log_level="debug" if DEBUG else "info"
-    ) 
\ No newline at end of file
+        if config.AUTO_MIGRATE:
+            migrate_database()
+        # Each worker enforces its share of the scheduler caps and of every key's requests per minute
+        os.environ["WORKER_PROCESSES"] = str(workers)
+        uvicorn.run(
+            "app.main:app",
+            host=config.HOST,
+            port=port,
+            workers=workers,
+            loop=config.UVICORN_LOOP,
+            http=config.UVICORN_HTTP,
+            backlog=config.BACKLOG,
+            limit_concurrency=config.LIMIT_CONCURRENCY or None,
+            timeout_keep_alive=config.TIMEOUT_KEEP_ALIVE,
+            timeout_graceful_shutdown=config.TIMEOUT_GRACEFUL_SHUTDOWN,
+            log_level="info"
+        )
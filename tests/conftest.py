@@ -0,0 +1,31 @@
+import asyncio
+import os
+import pytest
+import tempfile
+
+# Keep test runs away from ./data: settings are read when app modules are first imported
+_data_dir = tempfile.mkdtemp(prefix="ollama-middleware-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_data_dir, 'test.db')}")
+os.environ.setdefault("BATCH_DIR", os.path.join(_data_dir, "batches"))
+os.environ.setdefault("DEBUG", "true")
+
+@pytest.fixture(scope="session")
+def run_with_db():
+    """Migrate the test database once and return run(coro)
+
+    run() executes coro in a fresh event loop like asyncio.run, then closes
+    the pooled connections, which belong to that loop.
+    """
+    from app.database import engine
+    from app.migrations import run_migrations
+
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+
+    run(run_migrations())
+    return run
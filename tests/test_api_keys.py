@@ -0,0 +1,25 @@
+from app.crud import create_api_key, get_api_key, update_api_key
+from app.database import SessionLocal
+from app.schemas import ApiKeyCreate, ApiKeyUpdate
+from pydantic import ValidationError
+import pytest
+
+async def create_and_update(changes: ApiKeyUpdate):
+    async with SessionLocal() as db:
+        api_key = await create_api_key(db, ApiKeyCreate(key_name="limits", weight=2, rpm_limit=60, tokens_per_day_limit=1000))
+        await update_api_key(db, api_key.id, changes)
+    async with SessionLocal() as db:
+        return await get_api_key(db, api_key.id)
+
+def test_fields_left_out_are_kept(run_with_db):
+    api_key = run_with_db(create_and_update(ApiKeyUpdate(rpm_limit=120)))
+    assert (api_key.weight, api_key.rpm_limit, api_key.tokens_per_day_limit, api_key.is_active) == (2, 120, 1000, True)
+
+def test_null_limits_are_cleared(run_with_db):
+    api_key = run_with_db(create_and_update(ApiKeyUpdate(rpm_limit=None, tokens_per_day_limit=None)))
+    assert (api_key.weight, api_key.rpm_limit, api_key.tokens_per_day_limit) == (2, None, None)
+
+@pytest.mark.parametrize("changes", [{"weight": 0}, {"weight": None}, {"rpm_limit": -1}, {"tokens_per_day_limit": -5}, {"is_active": None}])
+def test_out_of_range_changes_are_rejected(changes):
+    with pytest.raises(ValidationError):
+        ApiKeyUpdate(**changes)
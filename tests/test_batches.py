@@ -0,0 +1,183 @@
+from datetime import timedelta
+from sqlalchemy import delete
+from app import config
+from app.batch_routes import UPLOAD_CHUNK_BYTES, save_upload
+from app.batches import BatchRunner, file_path, utcnow, work_path
+from app.database import SessionLocal
+from app.models import BatchFile, BatchJob
+import asyncio
+import io
+import json
+import os
+import pytest
+import uuid
+
+class FakeRunner(BatchRunner):
+    """BatchRunner whose requests are answered locally, recording each custom_id sent"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**{"concurrency": 2, "poll_interval": 0.01, "lease_seconds": 30, **kwargs})
+        self.sent = []
+
+    async def _call(self, endpoint, body):
+        self.sent.append(body["messages"][0]["content"])
+        await asyncio.sleep(0)
+        return 200, {"object": "chat.completion", "choices": []}
+
+@pytest.fixture
+def jobs(run_with_db):
+    """Start each test without batch jobs left over from others"""
+    async def clear():
+        async with SessionLocal() as db:
+            await db.execute(delete(BatchJob))
+            await db.commit()
+    os.makedirs(config.BATCH_DIR, exist_ok=True)
+    run_with_db(clear())
+    return run_with_db
+
+async def create_job(requests=5, status="in_progress", **values):
+    """An in_progress chat job over requests lines with custom_ids req-0, req-1, ..."""
+    input_file_id = f"file-{uuid.uuid4().hex}"
+    with open(file_path(input_file_id), "w") as f:
+        for i in range(requests):
+            body = {"model": "llama2", "messages": [{"role": "user", "content": f"req-{i}"}]}
+            f.write(json.dumps({"custom_id": f"req-{i}", "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+    job = BatchJob(
+        id=f"batch_{uuid.uuid4().hex}", api_key_id=1, endpoint="/v1/chat/completions", input_file_id=input_file_id,
+        completion_window="24h", status=status, total=requests, expires_at=utcnow() + timedelta(hours=1), **values,
+    )
+    async with SessionLocal() as db:
+        db.add(BatchFile(id=input_file_id, api_key_id=1, filename="input.jsonl", purpose="batch", bytes=0))
+        db.add(job)
+        await db.commit()
+    return job.id
+
+async def get_job(job_id):
+    async with SessionLocal() as db:
+        return await db.get(BatchJob, job_id)
+
+async def process(runner, job_id):
+    runner._wakeup = asyncio.Event()
+    await runner._process(job_id)
+
+def read_lines(file_id):
+    with open(file_path(file_id)) as f:
+        return [json.loads(line) for line in f]
+
+def test_a_held_lease_is_not_claimed_until_it_expires(jobs):
+    async def main():
+        job_id = await create_job(locked_by="other-worker", locked_until=utcnow() + timedelta(seconds=30))
+        runner = FakeRunner()
+        assert await runner._claim() is None
+
+        async with SessionLocal() as db:
+            job = await db.get(BatchJob, job_id)
+            job.locked_until = utcnow() - timedelta(seconds=1)
+            await db.commit()
+        assert await runner._claim() == job_id
+        assert (await get_job(job_id)).locked_by == runner.worker_id
+
+    jobs(main())
+
+def test_only_one_runner_claims_a_job(jobs):
+    async def main():
+        job_id = await create_job()
+        runners = [FakeRunner() for _ in range(4)]
+        claims = await asyncio.gather(*(runner._claim() for runner in runners))
+        assert claims.count(job_id) == 1
+        assert claims.count(None) == 3
+
+    jobs(main())
+
+def test_a_lost_lease_stops_updates(jobs):
+    async def main():
+        job_id = await create_job()
+        first, second = FakeRunner(), FakeRunner()
+        assert await first._claim() == job_id
+        async with SessionLocal() as db:
+            job = await db.get(BatchJob, job_id)
+            job.locked_until = utcnow() - timedelta(seconds=1)
+            await db.commit()
+        assert await second._claim() == job_id
+        # The first runner's heartbeat now finds the lease gone and changes nothing
+        assert await first._update(job_id, completed=99) is None
+        assert (await get_job(job_id)).completed == 0
+
+    jobs(main())
+
+def test_resumed_job_skips_requests_that_have_results(jobs):
+    async def main():
+        job_id = await create_job(requests=6)
+        # A worker died after writing two results and half of a third
+        with open(work_path(job_id, "output"), "w") as f:
+            for custom_id in ("req-0", "req-3"):
+                f.write(json.dumps({"custom_id": custom_id, "response": {"status_code": 200}}) + "\n")
+            f.write('{"custom_id": "req-4", "resp')
+        with open(work_path(job_id, "error"), "w") as f:
+            f.write(json.dumps({"custom_id": "req-5", "response": {"status_code": 400}}) + "\n")
+
+        runner = FakeRunner()
+        assert await runner._claim() == job_id
+        await process(runner, job_id)
+        return runner, await get_job(job_id)
+
+    runner, job = jobs(main())
+    assert sorted(runner.sent) == ["req-1", "req-2", "req-4"]
+    assert (job.status, job.completed, job.failed, job.locked_by) == ("completed", 5, 1, None)
+    output = read_lines(job.output_file_id)
+    assert sorted(line["custom_id"] for line in output) == ["req-0", "req-1", "req-2", "req-3", "req-4"]
+    assert [line["custom_id"] for line in read_lines(job.error_file_id)] == ["req-5"]
+    assert not os.path.exists(work_path(job.id, "output"))
+
+def test_stopping_releases_the_lease_for_the_next_worker(jobs):
+    async def main():
+        job_id = await create_job(requests=20)
+        blocked = asyncio.Event()
+
+        class SlowRunner(FakeRunner):
+            async def _call(self, endpoint, body):
+                if len(self.sent) >= 3:
+                    blocked.set()
+                    await asyncio.sleep(60)
+                return await super()._call(endpoint, body)
+
+        first = SlowRunner(concurrency=1)
+        await first.start()
+        await asyncio.wait_for(blocked.wait(), timeout=5)
+        await first.stop()
+        job = await get_job(job_id)
+        assert (job.status, job.locked_by, job.locked_until) == ("in_progress", None, None)
+
+        second = FakeRunner()
+        assert await second._claim() == job_id
+        await process(second, job_id)
+        return first, second, await get_job(job_id)
+
+    first, second, job = jobs(main())
+    assert job.status == "completed" and job.completed == 20
+    # The request cut off by the stop had no result yet, so the second runner ran it; nothing ran twice
+    assert not set(first.sent) & set(second.sent)
+    assert sorted(first.sent + second.sent) == sorted(f"req-{i}" for i in range(20))
+    assert len(read_lines(job.output_file_id)) == 20
+
+def test_upload_is_copied_in_full(tmp_path):
+    source = io.BytesIO(b"x" * (UPLOAD_CHUNK_BYTES * 2 + 10))
+    assert save_upload(source, str(tmp_path / "upload.jsonl"), UPLOAD_CHUNK_BYTES * 3) == UPLOAD_CHUNK_BYTES * 2 + 10
+    assert (tmp_path / "upload.jsonl").read_bytes() == source.getvalue()
+
+def test_oversized_upload_is_refused_and_removed(monkeypatch):
+    from types import SimpleNamespace
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app import batch_routes
+
+    monkeypatch.setattr(config, "BATCH_MAX_FILE_BYTES", 100)
+    os.makedirs(config.BATCH_DIR, exist_ok=True)
+    before = set(os.listdir(config.BATCH_DIR))
+    app = FastAPI()
+    app.include_router(batch_routes.router)
+    app.dependency_overrides[batch_routes.verify_bearer_token_dependency] = lambda: SimpleNamespace(id=1, weight=1)
+
+    response = TestClient(app).post("/v1/files", files={"file": ("big.jsonl", b"x" * 101)}, data={"purpose": "batch"})
+    assert response.status_code == 413
+    assert set(os.listdir(config.BATCH_DIR)) == before
@@ -0,0 +1,135 @@
+from fastapi import HTTPException
+from app import metrics
+from app.batching import EmbeddingBatcher
+import asyncio
+import pytest
+
+class FakeEmbed:
+    """Stands in for OllamaProxy.embed: one vector per input, a token per character"""
+
+    def __init__(self, backend="http://backend-1", status_for=None):
+        self.backend = backend
+        self.status_for = status_for or (lambda inputs: 200)
+        self.calls = []
+
+    async def __call__(self, data):
+        self.calls.append(list(data["input"]))
+        metrics.tag_request(backend=self.backend)
+        await asyncio.sleep(0)
+        status_code = self.status_for(data["input"])
+        if status_code != 200:
+            return {"error": f"failed with {status_code}"}, status_code
+        return {
+            "embeddings": [[float(len(text))] for text in data["input"]],
+            "prompt_eval_count": sum(len(text) for text in data["input"]),
+        }, 200
+
+async def embed_as_request(batcher, model, inputs):
+    """batcher.embed with request metrics of its own, like a request inside MetricsMiddleware"""
+    request_metrics = metrics.RequestMetrics()
+    metrics.current_request.set(request_metrics)
+    try:
+        return await batcher.embed(model, inputs), request_metrics
+    except HTTPException as e:
+        return e, request_metrics
+
+def run_callers(batcher, *callers):
+    async def main():
+        return await asyncio.gather(*(
+            asyncio.create_task(embed_as_request(batcher, model, inputs)) for model, inputs in callers
+        ))
+    return asyncio.run(main())
+
+def test_concurrent_requests_are_merged_and_split_back():
+    fake = FakeEmbed()
+    batcher = EmbeddingBatcher(fake, window=0.01, max_batch_size=100)
+    results = run_callers(batcher, ("nomic", ["a", "bb"]), ("nomic", ["cccc"]))
+
+    assert fake.calls == [["a", "bb", "cccc"]]
+    (first, first_metrics), (second, second_metrics) = results
+    assert first == ([[1.0], [2.0]], 3)
+    assert second == ([[4.0]], 4)
+    # Every caller is attributed to the backend, not only the one that opened the batch
+    assert first_metrics.backend == second_metrics.backend == "http://backend-1"
+
+def test_prompt_tokens_are_shared_by_input_length():
+    async def embed(data):
+        return {"embeddings": [[0.0]] * len(data["input"]), "prompt_eval_count": 100}, 200
+
+    batcher = EmbeddingBatcher(embed, window=0.01, max_batch_size=100)
+    (first, _), (second, _) = run_callers(batcher, ("nomic", ["x" * 30]), ("nomic", ["y" * 10]))
+    assert (first[1], second[1]) == (75, 25)
+
+def test_different_models_are_not_merged():
+    fake = FakeEmbed()
+    batcher = EmbeddingBatcher(fake, window=0.01, max_batch_size=100)
+    run_callers(batcher, ("nomic", ["a"]), ("mxbai", ["b"]))
+    assert sorted(fake.calls) == [["a"], ["b"]]
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    fake = FakeEmbed()
+    batcher = EmbeddingBatcher(fake, window=10, max_batch_size=3)
+
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(
+            batcher.embed("nomic", ["a", "b"]), batcher.embed("nomic", ["c"]),
+        ), timeout=1)
+
+    assert asyncio.run(main()) == [([[1.0], [1.0]], 2), ([[1.0]], 1)]
+    assert fake.calls == [["a", "b", "c"]]
+
+def test_client_error_is_retried_per_caller():
+    fake = FakeEmbed(status_for=lambda inputs: 400 if "bad" in inputs else 200)
+    batcher = EmbeddingBatcher(fake, window=0.01, max_batch_size=100)
+    (good, good_metrics), (bad, bad_metrics) = run_callers(batcher, ("nomic", ["ok"]), ("nomic", ["bad"]))
+
+    assert fake.calls[0] == ["ok", "bad"]
+    assert sorted(fake.calls[1:]) == [["bad"], ["ok"]]
+    assert good == ([[2.0]], 2)
+    assert isinstance(bad, HTTPException) and bad.status_code == 400
+    assert good_metrics.backend == bad_metrics.backend == "http://backend-1"
+
+def test_server_error_reaches_every_caller():
+    fake = FakeEmbed(status_for=lambda inputs: 503)
+    batcher = EmbeddingBatcher(fake, window=0.01, max_batch_size=100)
+    results = run_callers(batcher, ("nomic", ["a"]), ("nomic", ["b"]), ("nomic", ["c"]))
+
+    # Not retried one by one: the backend is failing, not one of the inputs
+    assert fake.calls == [["a", "b", "c"]]
+    for error, request_metrics in results:
+        assert isinstance(error, HTTPException) and error.status_code == 503
+        assert request_metrics.backend == "http://backend-1"
+
+@pytest.mark.parametrize("window, max_batch_size", [(0, 100), (0.01, 2)])
+def test_unbatched_requests_go_straight_through(window, max_batch_size):
+    fake = FakeEmbed()
+    batcher = EmbeddingBatcher(fake, window=window, max_batch_size=max_batch_size)
+    [(result, request_metrics)] = run_callers(batcher, ("nomic", ["a", "b"]))
+    assert result == ([[1.0], [1.0]], 2)
+    assert request_metrics.backend == "http://backend-1"
+
+def test_embeddings_route_takes_a_scheduler_slot(monkeypatch):
+    from types import SimpleNamespace
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app import api_routes
+    from app.scheduler import AdmissionScheduler
+
+    scheduler = AdmissionScheduler(lambda model: 1, backend_concurrency=4, model_concurrency=0, max_queue=10, queue_timeout=5)
+    running = []
+
+    async def embed(data):
+        running.append((scheduler.total_running, dict(scheduler.running)))
+        return {"embeddings": [[0.5]], "prompt_eval_count": 1}, 200
+
+    monkeypatch.setattr(api_routes, "scheduler", scheduler)
+    monkeypatch.setattr(api_routes, "embedding_batcher", EmbeddingBatcher(embed, window=0))
+    monkeypatch.setattr(api_routes, "log_api_request", lambda *args, **kwargs: None)
+    app = FastAPI()
+    app.include_router(api_routes.router)
+    app.dependency_overrides[api_routes.verify_bearer_token_dependency] = lambda: SimpleNamespace(id=1, weight=1)
+
+    response = TestClient(app).post("/v1/embeddings", json={"model": "nomic", "input": "hello"})
+    assert response.status_code == 200
+    assert running == [(1, {"nomic": 1})]
+    assert scheduler.total_running == 0
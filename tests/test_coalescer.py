@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+from app import metrics
+from app.coalescer import RequestCoalescer
+import asyncio
+import pytest
+
+def run_as_request(coro):
+    """Run coro with request metrics of its own, like a request inside MetricsMiddleware"""
+    async def wrapper():
+        request_metrics = metrics.RequestMetrics()
+        metrics.current_request.set(request_metrics)
+        return await coro, request_metrics
+    return wrapper()
+
+def test_identical_requests_share_one_call():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        metrics.tag_request(backend="http://backend-1")
+        metrics.record_phase("upstream", 0.5)
+        return {"response": "hi"}, 200
+
+    async def main():
+        return await asyncio.gather(*(run_as_request(coalescer.run("key", call)) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    for result, request_metrics in results:
+        assert result == ({"response": "hi"}, 200)
+        # Followers are attributed to the backend as well, not only the first caller
+        assert request_metrics.backend == "http://backend-1"
+        assert request_metrics.phases["upstream"] == 0.5
+
+def test_different_requests_are_not_coalesced():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    def call_for(key):
+        async def call():
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key
+        return call
+
+    async def main():
+        return await asyncio.gather(coalescer.run("a", call_for("a")), coalescer.run("b", call_for("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+def test_error_reaches_every_waiter():
+    coalescer = RequestCoalescer()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        return await asyncio.gather(*(coalescer.run("key", call) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+def test_call_is_cancelled_only_when_every_waiter_left():
+    coalescer = RequestCoalescer()
+
+    async def main():
+        started = asyncio.Event()
+        finished = []
+
+        async def call():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                finished.append("cancelled")
+                raise
+
+        first = asyncio.create_task(coalescer.run("key", call))
+        second = asyncio.create_task(coalescer.run("key", call))
+        await started.wait()
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert finished == [] and coalescer.in_flight("key")
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert finished == ["cancelled"] and not coalescer.in_flight("key")
+
+    asyncio.run(main())
+
+@pytest.mark.parametrize("mode, temperature, expected_calls", [
+    ("deterministic", 0, 1),
+    ("deterministic", 0.7, 2),
+    ("all", 0.7, 1),
+    ("off", 0, 2),
+])
+def test_call_ollama_coalesces_only_identical_eligible_requests(monkeypatch, mode, temperature, expected_calls):
+    from app import api_routes, config
+    monkeypatch.setattr(config, "REQUEST_COALESCING", mode)
+    api_key = SimpleNamespace(id=1, weight=1)
+    calls = []
+
+    async def upstream(ollama_req):
+        calls.append(ollama_req)
+        await asyncio.sleep(0.01)
+        return {"message": {"content": "x"}}, 200
+
+    request = {"model": "llama2", "messages": [{"role": "user", "content": "hi"}], "options": {"temperature": temperature}}
+
+    async def main():
+        await asyncio.gather(*(api_routes.call_ollama("/v1/chat/completions", upstream, dict(request), api_key) for _ in range(2)))
+
+    asyncio.run(main())
+    assert len(calls) == expected_calls
+
+def test_request_key_distinguishes_any_difference():
+    from app.response_cache import canonical_request_key
+    request = {"model": "llama2", "messages": [{"role": "user", "content": "hi"}], "options": {"temperature": 0, "seed": 1}}
+    same = {"options": {"seed": 1, "temperature": 0}, "messages": [{"content": "hi", "role": "user"}], "model": "llama2"}
+    assert canonical_request_key("/v1/chat/completions", request) == canonical_request_key("/v1/chat/completions", same)
+    for changed in (
+        {**request, "model": "mistral"},
+        {**request, "messages": [{"role": "user", "content": "hi!"}]},
+        {**request, "options": {"temperature": 0, "seed": 2}},
+    ):
+        assert canonical_request_key("/v1/chat/completions", request) != canonical_request_key("/v1/chat/completions", changed)
+    assert canonical_request_key("/v1/chat/completions", request) != canonical_request_key("/v1/completions", request)
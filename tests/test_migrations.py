@@ -0,0 +1,139 @@
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, select
+from app.migrations import ALEMBIC_INI, _upgrade, legacy_revision
+from app.models import UsageRollup
+import pytest
+
+HEAD = ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_current_head()
+
+@pytest.fixture
+def engine(tmp_path):
+    """A synchronous engine on an empty SQLite database of its own"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    yield engine
+    engine.dispose()
+
+def upgrade_to(connection, revision):
+    alembic_config = Config(ALEMBIC_INI)
+    alembic_config.attributes["connection"] = connection
+    alembic_config.attributes["configure_logger"] = False
+    command.upgrade(alembic_config, revision)
+
+def test_request_logs_are_counted_into_rollups(engine):
+    with engine.begin() as connection:
+        upgrade_to(connection, "0001")
+        connection.exec_driver_sql("INSERT INTO api_keys (id, key_name, api_key, is_active) VALUES (1, 'k', 't', 1)")
+        for endpoint, timestamp in (
+            ("/api/generate", "2026-10-17 23:59:59"),
+            ("/api/generate", "2026-10-18 09:15:00"),
+            ("/api/generate", "2026-10-18 09:45:00.123456"),
+            ("/api/chat", "2026-10-18 10:00:00"),
+        ):
+            connection.exec_driver_sql(
+                "INSERT INTO api_request_logs (api_key_id, endpoint, timestamp) VALUES (1, ?, ?)", (endpoint, timestamp)
+            )
+        # Logs of deleted keys have nothing to be counted against
+        connection.exec_driver_sql("INSERT INTO api_request_logs (api_key_id, endpoint) VALUES (NULL, '/api/chat')")
+        _upgrade(connection)
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(UsageRollup.granularity, UsageRollup.bucket_start, UsageRollup.endpoint, UsageRollup.request_count, UsageRollup.model)
+            .order_by(UsageRollup.granularity, UsageRollup.bucket_start, UsageRollup.endpoint)
+        ).all()
+    assert [tuple(row) for row in rows] == [
+        ("day", datetime(2026, 10, 17), "/api/generate", 1, ""),
+        ("day", datetime(2026, 10, 18), "/api/chat", 1, ""),
+        ("day", datetime(2026, 10, 18), "/api/generate", 2, ""),
+        ("hour", datetime(2026, 10, 17, 23), "/api/generate", 1, ""),
+        ("hour", datetime(2026, 10, 18, 9), "/api/generate", 2, ""),
+        ("hour", datetime(2026, 10, 18, 10), "/api/chat", 1, ""),
+    ]
+
+def test_backfilled_buckets_match_the_usage_writer(engine):
+    """Reports compare bucket_start with bound datetimes, so the stored text must be identical"""
+    with engine.begin() as connection:
+        upgrade_to(connection, "0001")
+        connection.exec_driver_sql("INSERT INTO api_request_logs (api_key_id, endpoint, timestamp) VALUES (1, '/api/chat', '2026-10-18 09:15:00')")
+        _upgrade(connection)
+        count = connection.scalar(
+            select(UsageRollup.request_count)
+            .where(UsageRollup.granularity == "day", UsageRollup.bucket_start == datetime(2026, 10, 18))
+        )
+    assert count == 1
+
+def unversioned(connection, revision):
+    """A database at revision as create_all in a release before migrations left it: no alembic_version"""
+    upgrade_to(connection, revision)
+    connection.exec_driver_sql("DROP TABLE alembic_version")
+
+def schema(connection):
+    inspector = inspect(connection)
+    return {table: {column["name"] for column in inspector.get_columns(table)} for table in inspector.get_table_names()}
+
+def upgraded_version(connection):
+    _upgrade(connection)
+    return connection.exec_driver_sql("SELECT version_num FROM alembic_version").scalar()
+
+@pytest.mark.parametrize("revision", ["0001", "0002"])
+def test_known_schemas_are_stamped_with_their_revision(engine, revision):
+    with engine.begin() as connection:
+        unversioned(connection, revision)
+        assert legacy_revision(schema(connection)) == revision
+        assert upgraded_version(connection) == HEAD
+
+@pytest.mark.parametrize("partial", [
+    ["ALTER TABLE api_keys ADD COLUMN weight INTEGER NOT NULL DEFAULT 1"],
+    ["ALTER TABLE api_request_logs ADD COLUMN cache_hit BOOLEAN"],
+    [
+        "ALTER TABLE api_keys ADD COLUMN weight INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE api_request_logs ADD COLUMN cache_hit BOOLEAN",
+        "CREATE TABLE usage_rollups (id INTEGER PRIMARY KEY, granularity VARCHAR NOT NULL, bucket_start DATETIME NOT NULL, "
+        "api_key_id INTEGER NOT NULL, model VARCHAR NOT NULL, endpoint VARCHAR NOT NULL, "
+        "request_count INTEGER NOT NULL, cache_hits INTEGER NOT NULL)",
+    ],
+])
+def test_partially_applied_0002_is_stamped_0001_and_completed(engine, partial):
+    with engine.begin() as connection:
+        unversioned(connection, "0001")
+        for statement in partial:
+            connection.exec_driver_sql(statement)
+        assert legacy_revision(schema(connection)) == "0001"
+        assert upgraded_version(connection) == HEAD
+        upgraded = schema(connection)
+    assert {"weight", "rpm_limit"} <= upgraded["api_keys"]
+    assert {"model", "cache_hit", "status_code"} <= upgraded["api_request_logs"]
+    assert "error_count" in upgraded["usage_rollups"]
+
+@pytest.mark.parametrize("change", [
+    # A column no known revision has
+    "ALTER TABLE api_keys ADD COLUMN owner VARCHAR",
+    # Part of 0002 together with a column of a later revision
+    "ALTER TABLE api_request_logs ADD COLUMN status_code INTEGER",
+    # A table of its own
+    "CREATE TABLE notes (id INTEGER PRIMARY KEY)",
+])
+def test_unknown_schemas_are_refused(engine, change):
+    with engine.begin() as connection:
+        unversioned(connection, "0001")
+        connection.exec_driver_sql(change)
+        with pytest.raises(RuntimeError, match="does not match any known revision"):
+            legacy_revision(schema(connection))
+        with pytest.raises(RuntimeError):
+            _upgrade(connection)
+        assert "alembic_version" not in inspect(connection).get_table_names()
+
+def test_partial_0002_table_must_match_exactly(engine):
+    with engine.begin() as connection:
+        unversioned(connection, "0001")
+        connection.exec_driver_sql("CREATE TABLE usage_rollups (id INTEGER PRIMARY KEY, granularity VARCHAR)")
+        with pytest.raises(RuntimeError):
+            legacy_revision(schema(connection))
+
+def test_empty_database_is_migrated_from_scratch(engine):
+    with engine.begin() as connection:
+        assert legacy_revision(schema(connection)) is None
+        assert upgraded_version(connection) == HEAD
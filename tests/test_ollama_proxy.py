@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.ollama_proxy import OllamaProxy
+import asyncio
+import httpx
+
+def fake_backend(proxy, index, handler, models=("llama2:latest",)):
+    """Answer backend index's requests with handler instead of a real Ollama"""
+    backend = proxy.backends[index]
+    backend._client = httpx.AsyncClient(base_url=backend.base_url, transport=httpx.MockTransport(handler))
+    backend.models = set(models)
+    return backend
+
+def empty_ok(request):
+    # What Ollama answers to a successful DELETE /api/delete
+    return httpx.Response(200)
+
+def not_found(request):
+    return httpx.Response(404, json={"error": "model 'llama2' not found"})
+
+def test_delete_with_empty_success_body():
+    proxy = OllamaProxy(["http://ollama-1:11434"])
+    backend = fake_backend(proxy, 0, empty_ok)
+
+    assert asyncio.run(proxy.delete_model("llama2")) == ({}, 200)
+    assert not backend.has_model("llama2")
+    assert backend.in_flight == 0
+
+def test_delete_keeps_the_model_where_it_failed():
+    proxy = OllamaProxy(["http://ollama-1:11434", "http://ollama-2:11434"])
+    deleted, failed = fake_backend(proxy, 0, empty_ok), fake_backend(proxy, 1, not_found)
+
+    result, status_code = asyncio.run(proxy.delete_model("llama2"))
+    assert status_code == 404 and "not found" in result["error"]
+    assert not deleted.has_model("llama2")
+    assert failed.has_model("llama2")
+
+def test_empty_error_body_is_still_an_error():
+    proxy = OllamaProxy(["http://ollama-1:11434"])
+    fake_backend(proxy, 0, lambda request: httpx.Response(502))
+
+    async def main():
+        try:
+            await proxy.forward_request("POST", "/api/show", data={"name": "llama2"})
+        except Exception as e:
+            return e
+
+    assert getattr(asyncio.run(main()), "status_code", None) == 500
+
+def test_delete_route_returns_success(monkeypatch):
+    from app import ollama_routes
+    proxy = OllamaProxy(["http://ollama-1:11434"])
+    fake_backend(proxy, 0, empty_ok)
+    monkeypatch.setattr(ollama_routes, "ollama_proxy", proxy)
+    monkeypatch.setattr(ollama_routes, "log_api_request", lambda *args, **kwargs: None)
+
+    app = FastAPI()
+    app.include_router(ollama_routes.router)
+    app.dependency_overrides[ollama_routes.verify_bearer_token_dependency] = lambda: SimpleNamespace(id=1, weight=1)
+    response = TestClient(app).request("DELETE", "/api/delete", json={"name": "llama2"})
+    assert response.status_code == 200
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+from fastapi import HTTPException
+from app import rate_limits
+from app.rate_limits import RateLimiter
+import pytest
+
+def make_key(api_key_id=1, rpm_limit=None, tokens_per_day_limit=None):
+    return SimpleNamespace(id=api_key_id, rpm_limit=rpm_limit, tokens_per_day_limit=tokens_per_day_limit)
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A controllable time.monotonic"""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limits.time, "monotonic", lambda: now[0])
+    return now
+
+def admitted(limiter, api_key, attempts):
+    count = 0
+    for _ in range(attempts):
+        try:
+            limiter.check(api_key)
+            count += 1
+        except HTTPException:
+            pass
+    return count
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    limiter = RateLimiter(default_rpm=60, default_tokens_per_day=0, workers=1)
+    api_key = make_key()
+    assert admitted(limiter, api_key, 100) == 60
+
+    with pytest.raises(HTTPException) as rejected:
+        limiter.check(api_key)
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "1"
+    assert rejected.value.headers["x-ratelimit-remaining-requests"] == "0"
+
+    # 60 per minute refills one request per second, never past the limit
+    clock[0] += 2.5
+    assert admitted(limiter, api_key, 10) == 2
+    clock[0] += 3600
+    assert admitted(limiter, api_key, 100) == 60
+
+def test_keys_have_their_own_buckets_and_limits(clock):
+    limiter = RateLimiter(default_rpm=2, default_tokens_per_day=0, workers=1)
+    assert admitted(limiter, make_key(1), 5) == 2
+    assert admitted(limiter, make_key(2), 5) == 2
+    assert admitted(limiter, make_key(3, rpm_limit=4), 5) == 4
+    assert admitted(limiter, make_key(4, rpm_limit=0), 50) == 50
+
+def test_workers_split_the_requests_per_minute(clock):
+    workers = [RateLimiter(default_rpm=60, default_tokens_per_day=0, workers=4) for _ in range(4)]
+    api_key = make_key()
+    assert sum(admitted(limiter, api_key, 100) for limiter in workers) == 60
+    clock[0] += 60
+    assert sum(admitted(limiter, api_key, 100) for limiter in workers) == 60
+
+def test_daily_token_quota_is_enforced():
+    limiter = RateLimiter(default_rpm=0, default_tokens_per_day=1000, workers=1)
+    api_key = make_key()
+    limiter.check(api_key)
+    limiter.add_tokens(api_key.id, 600)
+    limiter.check(api_key)
+    limiter.add_tokens(api_key.id, 400)
+
+    with pytest.raises(HTTPException) as rejected:
+        limiter.check(api_key)
+    assert rejected.value.status_code == 429
+    assert rejected.value.detail == "Daily token quota exceeded"
+    assert rejected.value.headers["x-ratelimit-remaining-tokens"] == "0"
+    assert 1 <= int(rejected.value.headers["Retry-After"]) <= 86400
+
+    # Other keys and keys with a higher quota of their own are unaffected
+    limiter.check(make_key(2))
+    limiter.check(make_key(1, tokens_per_day_limit=5000))
+
+def test_token_usage_resets_with_the_utc_day(monkeypatch):
+    limiter = RateLimiter(default_rpm=0, default_tokens_per_day=100, workers=1)
+    limiter.add_tokens(1, 100)
+    with pytest.raises(HTTPException):
+        limiter.check(make_key())
+    monkeypatch.setattr(RateLimiter, "_today", staticmethod(lambda: limiter._day + 1))
+    limiter.check(make_key())
+    assert limiter.tokens_used(1) == 0
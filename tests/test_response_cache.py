@@ -0,0 +1,70 @@
+from app.response_cache import ResponseCache, STALE_TEMP_SECONDS, canonical_request_key
+import asyncio
+import os
+import time
+
+def make_cache(disk_dir=None, **kwargs):
+    options = {"max_entries": 100, "max_bytes": 1 << 20, "ttl": 3600, "disk_dir": disk_dir,
+               "disk_max_entries": 100, "disk_max_bytes": 1 << 20, "sweep_interval": 0}
+    options.update(kwargs)
+    return ResponseCache(**options)
+
+def store(cache, count, age=0.0):
+    """Write count entries to disk, the first one oldest, each stored age seconds before the next"""
+    keys = [canonical_request_key("/api/generate", {"prompt": f"p{i}"}) for i in range(count)]
+    for i, key in enumerate(keys):
+        cache._write_disk(key, b'{"response":"x"}')
+        stored_at = time.time() - age * (count - i)
+        os.utime(cache._disk_path(key), (stored_at, stored_at))
+    return keys
+
+def on_disk(cache, keys):
+    return [key for key in keys if os.path.exists(cache._disk_path(key))]
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = make_cache(max_entries=2)
+
+    async def main():
+        await cache.put("a", {"n": 1})
+        await cache.put("b", {"n": 2})
+        await cache.get("a")
+        await cache.put("c", {"n": 3})
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(main()) == [{"n": 1}, None, {"n": 3}]
+
+def test_disk_tier_serves_another_process(tmp_path):
+    asyncio.run(make_cache(str(tmp_path)).put("k" * 64, {"n": 1}))
+    assert asyncio.run(make_cache(str(tmp_path)).get("k" * 64)) == {"n": 1}
+
+def test_sweep_deletes_expired_entries(tmp_path):
+    cache = make_cache(str(tmp_path), ttl=75)
+    keys = store(cache, 4, age=30)
+    # Stored 120, 90, 60 and 30 seconds ago
+    assert cache.sweep() == 2
+    assert on_disk(cache, keys) == keys[2:]
+
+def test_sweep_enforces_the_entry_cap_oldest_first(tmp_path):
+    cache = make_cache(str(tmp_path), disk_max_entries=3)
+    keys = store(cache, 5, age=1)
+    assert cache.sweep() == 2
+    assert on_disk(cache, keys) == keys[2:]
+
+def test_sweep_enforces_the_byte_cap_oldest_first(tmp_path):
+    cache = make_cache(str(tmp_path), disk_max_bytes=40)
+    keys = store(cache, 4, age=1)
+    # Each entry is 16 bytes
+    cache.sweep()
+    assert on_disk(cache, keys) == keys[2:]
+
+def test_sweep_deletes_abandoned_temporary_files(tmp_path):
+    cache = make_cache(str(tmp_path))
+    store(cache, 1)
+    subdir = next(entry.path for entry in os.scandir(tmp_path))
+    abandoned, in_progress = os.path.join(subdir, "tmpabandoned"), os.path.join(subdir, "tmpwriting")
+    for path in (abandoned, in_progress):
+        open(path, "wb").close()
+    old = time.time() - STALE_TEMP_SECONDS - 1
+    os.utime(abandoned, (old, old))
+    assert cache.sweep() == 1
+    assert not os.path.exists(abandoned) and os.path.exists(in_progress)
@@ -0,0 +1,99 @@
+from fastapi import HTTPException
+from app.scheduler import AdmissionScheduler
+import asyncio
+import pytest
+
+def single_slot_scheduler(**kwargs):
+    """A scheduler with room for one request at a time"""
+    options = {"backend_concurrency": 1, "model_concurrency": 0, "max_queue": 100, "queue_timeout": 5}
+    options.update(kwargs)
+    return AdmissionScheduler(lambda model: 1, **options)
+
+async def admission_order(scheduler, requests):
+    """Queue requests [(api_key_id, weight)] behind a held slot and return the key of each in admission order"""
+    order = []
+
+    async def request(api_key_id, weight):
+        async with scheduler.slot("llama2", api_key_id, weight):
+            order.append(api_key_id)
+            await asyncio.sleep(0)
+
+    await scheduler.acquire("llama2", 0)
+    tasks = [asyncio.create_task(request(api_key_id, weight)) for api_key_id, weight in requests]
+    await asyncio.sleep(0)
+    assert scheduler.queued == len(requests)
+    scheduler.release("llama2")
+    await asyncio.gather(*tasks)
+    return order
+
+def test_keys_are_admitted_in_proportion_to_weight():
+    scheduler = single_slot_scheduler()
+    # The heavy key queues everything first; weights, not arrival order, decide
+    requests = [(1, 4)] * 20 + [(2, 1)] * 20
+    order = asyncio.run(admission_order(scheduler, requests))
+
+    assert order[:10].count(1) == 8
+    assert order[:10].count(2) == 2
+    assert sorted(order) == sorted(key for key, _ in requests)
+
+def test_equal_weights_take_turns():
+    scheduler = single_slot_scheduler()
+    order = asyncio.run(admission_order(scheduler, [(1, 1)] * 5 + [(2, 1)] * 5))
+    assert order == [1, 2] * 5
+
+def test_full_queue_is_shed_with_retry_after():
+    scheduler = single_slot_scheduler(max_queue=1)
+
+    async def main():
+        await scheduler.acquire("llama2", 0)
+        waiting = asyncio.create_task(scheduler.acquire("llama2", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as shed:
+            await scheduler.acquire("llama2", 2)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        return shed.value
+
+    shed = asyncio.run(main())
+    assert shed.status_code == 429
+    assert int(shed.headers["Retry-After"]) >= 1
+    assert scheduler.queued == 0
+
+def test_queue_timeout_is_shed():
+    scheduler = single_slot_scheduler(queue_timeout=0.01)
+
+    async def main():
+        await scheduler.acquire("llama2", 0)
+        with pytest.raises(HTTPException) as shed:
+            await scheduler.acquire("llama2", 1)
+        return shed.value
+
+    assert asyncio.run(main()).status_code == 429
+    assert scheduler.queued == 0
+
+def test_background_requests_wait_for_interactive_ones():
+    scheduler = single_slot_scheduler()
+    order = []
+
+    async def interactive():
+        async with scheduler.slot("llama2", 1):
+            order.append("interactive")
+
+    async def background():
+        async with scheduler.background_slot("llama2"):
+            order.append("background")
+
+    async def main():
+        await scheduler.acquire("llama2", 0)
+        tasks = [asyncio.create_task(background()), asyncio.create_task(interactive())]
+        await asyncio.sleep(0)
+        scheduler.release("llama2")
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["interactive", "background"]
+
+@pytest.mark.parametrize("limit, workers, share", [(8, 1, 8), (8, 4, 2), (9, 4, 2), (2, 4, 1), (0, 4, 0)])
+def test_workers_split_the_concurrency_limits(limit, workers, share):
+    scheduler = AdmissionScheduler(lambda model: 1, backend_concurrency=limit, model_concurrency=limit, workers=workers)
+    assert (scheduler.backend_concurrency, scheduler.model_concurrency) == (share, share)
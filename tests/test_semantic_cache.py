@@ -0,0 +1,67 @@
+from app.semantic_cache import SemanticCache, semantic_query
+import asyncio
+import os
+import pytest
+
+NAMESPACE = b"n" * 16
+
+def make_cache(index_dir=None, **kwargs):
+    return SemanticCache(**{"max_entries": 4, "ttl": 0, "threshold": 0.9, "thresholds": {}, "index_dir": index_dir, **kwargs})
+
+def test_similar_questions_share_an_answer():
+    cache = make_cache()
+
+    async def main():
+        await cache.add(NAMESPACE, [1.0, 0.0], {"answer": 1})
+        return (
+            await cache.search(NAMESPACE, "llama2", [0.99, 0.05]),
+            await cache.search(NAMESPACE, "llama2", [0.0, 1.0]),
+            await cache.search(b"o" * 16, "llama2", [1.0, 0.0]),
+        )
+
+    (hit, similarity), (miss, _), (other_namespace, none) = asyncio.run(main())
+    assert hit == {"answer": 1} and similarity > 0.99
+    assert miss is None
+    assert other_namespace is None and none is None
+
+def test_workers_get_directories_of_their_own(tmp_path):
+    first, second = make_cache(str(tmp_path)), make_cache(str(tmp_path))
+    assert first.index_dir != second.index_dir
+    assert {os.path.basename(first.index_dir), os.path.basename(second.index_dir)} == {"worker-0", "worker-1"}
+
+    async def main():
+        await first.add(NAMESPACE, [1.0, 0.0], {"answer": "first"})
+        await second.add(NAMESPACE, [1.0, 0.0], {"answer": "second"})
+        return (await first.search(NAMESPACE, None, [1.0, 0.0]))[0], (await second.search(NAMESPACE, None, [1.0, 0.0]))[0]
+
+    assert asyncio.run(main()) == ({"answer": "first"}, {"answer": "second"})
+    first.close()
+    second.close()
+
+def test_index_survives_a_restart(tmp_path):
+    cache = make_cache(str(tmp_path))
+    asyncio.run(cache.add(NAMESPACE, [0.0, 1.0], {"answer": "kept"}))
+    cache.close()
+
+    restarted = make_cache(str(tmp_path))
+    assert restarted.index_dir == cache.index_dir
+    assert restarted.entries == 1
+    assert asyncio.run(restarted.search(NAMESPACE, None, [0.0, 1.0]))[0] == {"answer": "kept"}
+    restarted.close()
+
+@pytest.mark.parametrize("request_body", [
+    {"model": "llama2", "messages": []},
+    {"model": "llama2", "messages": [{"role": "assistant", "content": "hi"}]},
+    {"model": "llama2", "messages": [{"role": "user", "content": "  "}]},
+    {"model": "llama2", "messages": [{"role": "user", "content": "hi", "images": ["..."]}]},
+])
+def test_requests_that_are_not_cached(request_body):
+    assert semantic_query(request_body) is None
+
+def test_context_is_part_of_the_namespace():
+    question = {"role": "user", "content": "What is it?"}
+    namespace, text = semantic_query({"model": "llama2", "messages": [question]})
+    assert text == "What is it?"
+    assert semantic_query({"model": "mistral", "messages": [question]})[0] != namespace
+    assert semantic_query({"model": "llama2", "messages": [{"role": "user", "content": "A cat"}, question]})[0] != namespace
+    assert semantic_query({"model": "llama2", "messages": [question], "options": {"temperature": 1}})[0] != namespace